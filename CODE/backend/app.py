@@ -1,23 +1,153 @@
-from flask import Flask
+import os
+import time
+import click
+from dotenv import load_dotenv
+from flask import Flask, current_app, jsonify
+from flask.cli import with_appcontext
 from patient import patient_bp
 from doctor import doctor_bp
 from nurse import nurse_bp
 from extra import extras_bp
 from appointment import appointment_bp
-from departments import department_bp
+from departments import department_bp, refresh_department_stats
+from bulk import bulk_bp
+from dashboard import dashboard_bp
+from jobs import jobs_bp, init_jobs
+from coalescer import init_writes, writes
 from flask_cors import CORS
+from json_provider import MongoJSONProvider
+from metrics import init_metrics
+from auth import init_auth, migrate_plaintext_passwords
+from consistency import init_consistency, check_read_routing, CAUSAL_HEADER
+from database import init_db, get_db, get_pool_stats, warm_up_in_background, readiness
+from cache import init_cache, cache
+from indexes import ensure_indexes, create_and_verify_indexes
+from scheduler import backfill_slots
+from name_index import start_change_stream_watcher
 
-app = Flask(__name__)
-CORS(app)
+BLUEPRINTS = (
+    (patient_bp, '/patients'),
+    (doctor_bp, '/doctor'),
+    (nurse_bp, '/nurse'),
+    (extras_bp, '/extra'),
+    (appointment_bp, '/appointment'),
+    (department_bp, '/department'),
+    (bulk_bp, '/bulk'),
+    (dashboard_bp, '/dashboard'),
+    (jobs_bp, '/jobs'),
+)
 
 
-# Register blueprints
-app.register_blueprint(patient_bp, url_prefix='/patients')
-app.register_blueprint(doctor_bp, url_prefix='/doctor')
-app.register_blueprint(nurse_bp, url_prefix='/nurse')
-app.register_blueprint(extras_bp, url_prefix='/extra')
-app.register_blueprint(appointment_bp, url_prefix='/appointment')
-app.register_blueprint(department_bp, url_prefix='/department')
+def pool_stats():
+    return jsonify({'status': 'success', 'pool': get_pool_stats()})
+
+
+def cache_stats():
+    return jsonify({'status': 'success', 'cache': cache.stats()})
+
+
+def write_stats():
+    return jsonify({'status': 'success', 'writes': writes.stats()})
+
+
+# liveness: the process answers, the database is not touched
+def healthz():
+    return jsonify({'status': 'success'})
+
+
+# readiness: 503 until the pool is warmed and MongoDB answers a ping
+def readyz():
+    ready, message = readiness()
+    if not ready:
+        return jsonify({'status': 'error', 'message': message}), 503
+    return jsonify({'status': 'success'})
+
+
+@click.command('create-indexes')
+@with_appcontext
+def create_indexes():
+    create_and_verify_indexes(get_db())
+
+
+@click.command('refresh-department-stats')
+@with_appcontext
+def refresh_departments():
+    refresh_department_stats(get_db())
+
+
+@click.command('hash-passwords')
+@with_appcontext
+def hash_passwords():
+    print('Doctor passwords hashed:', migrate_plaintext_passwords(get_db()))
+
+
+# a dedicated worker process, web processes can then run with JOB_WORKERS=0
+@click.command('run-jobs')
+@with_appcontext
+def run_jobs():
+    workers = current_app.extensions['jobs']
+    workers.count = workers.count or 1
+    workers.ensure_started()
+    while True:
+        time.sleep(60)
+
+
+@click.command('backfill-slots')
+@with_appcontext
+def backfill_appointment_slots():
+    print('Appointment slots claimed:', backfill_slots(get_db()))
+
+
+# e.g. against `mongod --replSet rs0` after rs.initiate(), with MONGO_LIST_READ_PREFERENCE=secondaryPreferred
+@click.command('check-read-routing')
+@with_appcontext
+def check_routing():
+    for key, value in check_read_routing(current_app).items():
+        print(f'{key}: {value}')
+
+
+def enabled(app, key, default='0'):
+    return str(app.config.get(key, os.getenv(key, default))) in ('1', 'True', 'true')
+
+
+# nothing here talks to MongoDB, the client is built on first use or by the background warm-up
+def create_app(config=None):
+    load_dotenv()
+    app = Flask(__name__)
+    app.config.update(config or {})
+    app.json = MongoJSONProvider(app)
+    # browsers only let the UI read the causal token when it is exposed
+    CORS(app, expose_headers=[CAUSAL_HEADER])
+    init_db(app)
+    init_cache(app)
+    init_metrics(app)
+    init_auth(app)
+    init_jobs(app)
+    init_writes(app)
+    init_consistency(app)
+
+    for blueprint, url_prefix in BLUEPRINTS:
+        app.register_blueprint(blueprint, url_prefix=url_prefix)
+    app.add_url_rule('/pool_stats', 'pool_stats', pool_stats)
+    app.add_url_rule('/cache_stats', 'cache_stats', cache_stats)
+    app.add_url_rule('/write_stats', 'write_stats', write_stats)
+    app.add_url_rule('/healthz', 'healthz', healthz)
+    app.add_url_rule('/readyz', 'readyz', readyz)
+    for command in (create_indexes, refresh_departments, hash_passwords, run_jobs, backfill_appointment_slots,
+                    check_routing):
+        app.cli.add_command(command)
+
+    if enabled(app, 'NAME_INDEX_CHANGE_STREAMS'):
+        start_change_stream_watcher(app)
+    if enabled(app, 'CREATE_INDEXES_ON_STARTUP'):
+        with app.app_context():
+            ensure_indexes(get_db())
+    if enabled(app, 'MONGO_WARM_UP', '1'):
+        warm_up_in_background(app)
+    return app
+
+
+app = create_app()
 
 if __name__ == "__main__":
     app.run(debug=True)
@@ -1,87 +1,208 @@
 from flask import Blueprint, request, jsonify
 from datetime import datetime
 from bson.objectid import ObjectId
-from functions import connect_to_database, check_appointment_collision, convert_objectid, convert_id
+from functions import wants_stream, stream_documents, STREAM_BATCH_SIZE
+from database import db
+from consistency import reads_from
+from name_index import patient_names, doctor_names
+from sync import current_versions, delta, is_not_modified, list_etag, not_modified, parse_sync_token, \
+    versioned_write, with_etag, SYNC_FIELD
+from search import run_search, SearchError
+from scheduler import book_appointments, reschedule_appointment, interval_index, DEFAULT_DURATION_MINUTES
 
 appointment_bp = Blueprint('appointment', __name__)
-db = connect_to_database()
 
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# all a reschedule reads of the stored appointment
+RESCHEDULE_FIELDS = {'patient_id': 1, 'doctor_id': 1, 'appointment_time': 1, 'duration_minutes': 1}
+# the booking form (AppointmentScheduling.js) posts camelCase keys, form key -> API key
+FORM_KEYS = (('patientName', 'patient_name'), ('doctorName', 'doctor_name'), ('patientId', 'patient_id'))
 
-# Function to update appointment data with patient_id and doctor_id
-def update_appointment_with_ids(appointment_data):
-    patient_name = appointment_data.get('patient_name')
-    doctor_name = appointment_data.get('doctor_name')
 
-    # Perform the aggregation pipeline to get patient_id and doctor_id
-    pipeline = [
-        {"$match": {"name": {"$in": [patient_name, doctor_name]}}},
-        {"$group": {"_id": "$name", "id": {"$first": "$_id"}}}
-    ]
-    patient = list(db.patient.aggregate(pipeline))
-    doctor = list(db.doctor.aggregate(pipeline))
-    patient_id = next((p['id'] for p in patient if p['_id'] == patient_name), None)
-    doctor_id = next((d['id'] for d in doctor if d['_id'] == doctor_name), None)
+class AmbiguousNameError(ValueError):
+    pass
+
 
-    appointment_data['patient_id'] = patient_id
-    appointment_data['doctor_id'] = doctor_id
+# Function to update appointment data with patient_id and doctor_id
+def update_appointment_with_ids(appointment_data, stored=None):
+    for form_key, key in FORM_KEYS:
+        value = appointment_data.get(form_key)
+        # the form's patient id is free text, only a real ObjectId stands in for the name
+        if value and not appointment_data.get(key) and (key != 'patient_id' or ObjectId.is_valid(value)):
+            appointment_data[key] = value
+    # ids sent by the client skip name resolution entirely
+    for key, name_key, names in (('patient_id', 'patient_name', patient_names),
+                                 ('doctor_id', 'doctor_name', doctor_names)):
+        document_id = appointment_data.get(key)
+        if document_id:
+            appointment_data[key] = ObjectId(document_id)
+        elif stored is not None and not appointment_data.get(name_key):
+            appointment_data[key] = stored.get(key)
+        else:
+            name = appointment_data.get(name_key)
+            appointment_data[key] = names.resolve(db, name)
+            # booking the first of several namesakes could silently pick the wrong person
+            if names.is_ambiguous(name):
+                raise AmbiguousNameError(f'More than one {names.collection} is named {name}, send {key} instead')
+
+
+# parse the time, resolve ids and give the appointment its _id before any slot is claimed
+def prepare_appointment(appointment_data):
+    appointment_data['appointment_time'] = datetime.strptime(appointment_data.get('appointment_time'), TIME_FORMAT)
+    appointment_data['duration_minutes'] = int(appointment_data.get('duration_minutes', DEFAULT_DURATION_MINUTES))
+    update_appointment_with_ids(appointment_data)
+    appointment_data['_id'] = ObjectId()
+    return appointment_data
+
+
+def format_appointment(appointment_data):
+    appointment_data['doctorName'] = appointment_data.pop('doctor_name', None)
+    return appointment_data
 
 
 # Routes for Appointments
 @appointment_bp.route('/add', methods=['POST'])
+@reads_from('primary')
 def add_appointment():
     try:
-        appointment_data = request.json
-        doctor_id = appointment_data.get('doctor_id')
-        appointment_time_str = appointment_data.get('appointment_time')
-
-        appointment_time = datetime.strptime(appointment_time_str, "%Y-%m-%d %H:%M:%S")
-        appointment_data['appointment_time'] = appointment_time
-        if check_appointment_collision(doctor_id=doctor_id, appointment_time=appointment_time, db=db):
+        appointment_data = prepare_appointment(request.json)
+        if appointment_data['doctor_id'] is None:
+            return jsonify({'status': 'error', 'message': 'Doctor not found'}), 404
+
+        with versioned_write('appointment') as version:
+            appointment_data[SYNC_FIELD] = version
+            collided = book_appointments(db, [appointment_data])
+        if collided:
             return jsonify(
                 {'status': 'error', 'message': 'Appointment collides with existing appointment for the doctor'}), 400
 
-        update_appointment_with_ids(appointment_data)
-        result = db.appointment.insert_one(appointment_data)
-        appointment_data['_id'] = str(result.inserted_id)
-
-        appointment_data['doctorName'] = appointment_data.pop('doctor_name', None)
-        appointment_data = convert_objectid(appointment_data)
-
+        appointment_data = format_appointment(appointment_data)
         return jsonify({'status': 'success', 'message': 'Appointment added', 'appointment': appointment_data})
+    except AmbiguousNameError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 409
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+@appointment_bp.route('/add_batch', methods=['POST'])
+@reads_from('primary')
+def add_appointments():
+    try:
+        appointments, errors = [], []
+        for appointment_data in request.json.get('appointments', []):
+            try:
+                appointments.append(prepare_appointment(appointment_data))
+            except AmbiguousNameError as e:
+                errors.append({'appointment': format_appointment(appointment_data), 'message': str(e)})
+        bookable = [appointment for appointment in appointments if appointment['doctor_id'] is not None]
+        with versioned_write('appointment') as version:
+            for appointment in bookable:
+                appointment[SYNC_FIELD] = version
+            failed = {bookable[i]['_id'] for i in book_appointments(db, bookable)}
+
+        booked = []
+        for appointment in appointments:
+            if appointment['doctor_id'] is None:
+                errors.append({'appointment': format_appointment(appointment), 'message': 'Doctor not found'})
+            elif appointment['_id'] in failed:
+                errors.append({'appointment': format_appointment(appointment),
+                               'message': 'Appointment collides with existing appointment for the doctor'})
+            else:
+                booked.append(format_appointment(appointment))
+        return jsonify({'status': 'success', 'message': f'{len(booked)} appointments added',
+                        'appointments': booked, 'errors': errors})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
 
 @appointment_bp.route('/update', methods=['PUT'])
+@reads_from('primary')
 def update_appointment():
     try:
         appointment_data = request.json
         appointment_id = appointment_data.get('appointment_id')
         appointment_time_str = appointment_data.get('appointment_time')
-        appointment_time = datetime.strptime(appointment_time_str, "%Y-%m-%d %H:%M:%S")
+        appointment_time = datetime.strptime(appointment_time_str, TIME_FORMAT)
         appointment_data['appointment_time'] = appointment_time
 
-        doctor_id = appointment_data.get('doctor_id')
-        if check_appointment_collision(doctor_id=doctor_id, appointment_time=appointment_time, db=db):
-            return jsonify(
-                {'status': 'error', 'message': 'Appointment collides with existing appointment for the doctor'}), 400
-        update_appointment_with_ids(appointment_data)
-        db.appointment.update_one({"_id": ObjectId(appointment_id)}, {"$set": {"appointment_time": appointment_time}})
+        appointment = db.appointment.find_one({"_id": ObjectId(appointment_id)}, RESCHEDULE_FIELDS)
+        if not appointment:
+            return jsonify({'status': 'error', 'message': 'Appointment not found'}), 404
+        # names are only resolved when the client sent them, otherwise the stored ids are returned;
+        # before the move, so an ambiguous name leaves the appointment where it was
+        update_appointment_with_ids(appointment_data, appointment)
+        # the same time again claims no slots and writes nothing
+        if appointment_time != appointment.get('appointment_time'):
+            with versioned_write('appointment') as version:
+                moved = reschedule_appointment(db, appointment, appointment_time, {SYNC_FIELD: version})
+            if not moved:
+                return jsonify(
+                    {'status': 'error', 'message': 'Appointment collides with existing appointment for the doctor'}), 400
         appointment_data['_id'] = appointment_id
-        appointment_data = convert_objectid(appointment_data)
 
         return jsonify({'status': 'success', 'message': 'Appointment time updated', 'appointment': appointment_data})
+    except AmbiguousNameError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 409
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@appointment_bp.route('/free_slots', methods=['GET'])
+@reads_from('primary')
+def get_free_slots():
+    try:
+        doctor_id = request.args.get('doctor_id')
+        if not doctor_id:
+            return jsonify({'status': 'error', 'message': 'Doctor ObjectId not provided'}), 400
+        count = request.args.get('count', 5, type=int)
+        duration = request.args.get('duration_minutes', DEFAULT_DURATION_MINUTES, type=int)
+        after_str = request.args.get('after')
+        after = datetime.strptime(after_str, TIME_FORMAT) if after_str else datetime.now()
+
+        slots = interval_index.next_free(db, doctor_id, after, count, duration)
+        return jsonify({'status': 'success', 'doctor_id': doctor_id,
+                        'free_slots': [slot.strftime(TIME_FORMAT) for slot in slots]})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
 @appointment_bp.route('/', methods=['GET'])
+@reads_from('lists')
 def get_all_appointments():
     try:
+        versions = current_versions(['appointment'])
+        etag = list_etag(versions)
+        if is_not_modified(etag):
+            return not_modified(etag)
+        since = request.args.get('since')
+        if since is not None:
+            version = parse_sync_token(since)
+            if version is None:
+                return jsonify({'status': 'error', 'message': 'since must be a sync_token from /appointment/'}), 400
+            appointments, deleted = delta('appointment', version)
+            return with_etag(jsonify({'status': 'success', 'appointments': list(appointments), 'deleted': deleted,
+                                      'sync_token': versions['appointment']}), etag)
+        if wants_stream():
+            return with_etag(stream_documents(db.appointment.find().batch_size(STREAM_BATCH_SIZE)), etag)
         appointments = list(db.appointment.find())
-        appointments = [convert_objectid(app) for app in appointments]
 
-        return jsonify({'status': 'success', 'appointments': appointments})
+        return with_etag(jsonify({'status': 'success', 'appointments': appointments,
+                                  'sync_token': versions['appointment']}), etag)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@appointment_bp.route('/search', methods=['GET'])
+@reads_from('lists')
+def search_appointments():
+    try:
+        versions = current_versions(['appointment'])
+        etag = list_etag(versions)
+        if is_not_modified(etag):
+            return not_modified(etag)
+        appointments, next_after = run_search('appointment', request.args)
+        return with_etag(jsonify({'status': 'success', 'appointments': appointments, 'next_after': next_after}), etag)
+    except SearchError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
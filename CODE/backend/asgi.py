@@ -0,0 +1,230 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qs
+from werkzeug.http import parse_etags
+from asgiref.wsgi import WsgiToAsgi
+from motor.motor_asyncio import AsyncIOMotorClient
+from app import app as flask_app
+from auth import auth_required
+from consistency import CAUSAL_HEADER, CausalTokenError, decode_token
+from database import DB_NAME, PoolStatsListener, client_options, config_value, read_preference
+from functions import build_projection, NDJSON_MIMETYPE
+from patient import APPOINTMENT_BATCH_SIZE, PageError, parse_page_args, patient_sync_token
+from sync import etag_for
+
+# doctor plus assigned nurse in one round trip, nurse_id is stored as a string
+DOCTOR_WITH_NURSE_PIPELINE = [
+    {'$limit': 1},
+    {'$lookup': {
+        'from': 'nurse',
+        'let': {'nurse_id': {'$convert': {'input': '$nurse_id', 'to': 'objectId', 'onError': None, 'onNull': None}}},
+        'pipeline': [{'$match': {'$expr': {'$eq': ['$_id', '$$nurse_id']}}}],
+        'as': 'assigned_nurse',
+    }},
+    {'$project': {'password': 0}},
+]
+
+# list path -> (collections versioning the response, its sync token), the same as the Flask routes
+LIST_VERSIONS = {
+    '/patients/': (['patient', 'appointment'], patient_sync_token),
+    '/doctor/': (['doctor'], lambda versions: versions['doctor']),
+    '/nurse/': (['nurse'], lambda versions: versions['nurse']),
+    '/appointment/': (['appointment'], lambda versions: versions['appointment']),
+}
+
+
+# ASGI entry point: hot read paths run natively on Motor, every other route is served by the Flask app
+class AsyncBackend:
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.fallback = WsgiToAsgi(wsgi_app)
+        self.client = None
+        self.listener = PoolStatsListener()
+        self.routes = {
+            ('GET', '/patients/'): self.get_patients,
+            ('GET', '/doctor/'): self.list_route('doctor', 'doctors', {'password': 0}),
+            ('GET', '/nurse/'): self.list_route('nurse', 'nurses'),
+            ('GET', '/appointment/'): self.list_route('appointment', 'appointments'),
+            ('POST', '/extra/find_nurse_from_doctor'): self.find_doctor_and_nurse,
+        }
+
+    @property
+    def db(self):
+        if self.client is None:
+            options = client_options(self.wsgi_app, self.listener)
+            self.client = AsyncIOMotorClient(config_value(self.wsgi_app, 'MONGO_URI'), **options)
+        return self.client[DB_NAME]
+
+    @property
+    def lists(self):
+        return self.db.with_options(read_preference=read_preference(self.wsgi_app, 'lists'))
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        handler = self.routes.get((scope.get('method'), scope.get('path'))) if scope['type'] == 'http' else None
+        args = parse_qs(scope.get('query_string', b'').decode())
+        headers = dict(scope.get('headers', []))
+        # token checks live in Flask's before_request hook, so protected deployments skip the native paths;
+        # so do delta syncs
+        if handler is None or wants_stream(scope, args) or auth_required(self.wsgi_app) or 'since' in args:
+            return await self.fallback(scope, receive, send)
+        etag = None
+        try:
+            async with self.read_session(headers.get(CAUSAL_HEADER.lower().encode(), b'').decode()) as session:
+                if scope['path'] in LIST_VERSIONS:
+                    collections, sync_token = LIST_VERSIONS[scope['path']]
+                    versions = await self.current_versions(collections, session)
+                    etag = etag_for(versions, scope.get('query_string', b'').decode())
+                    if parse_etags(headers.get(b'if-none-match', b'').decode()).contains(etag):
+                        return await self.send_not_modified(send, etag)
+                payload, status = await handler(args, receive, session)
+            if status != 200:
+                etag = None
+            elif etag is not None:
+                payload['sync_token'] = sync_token(versions)
+        except CausalTokenError as e:
+            payload, status, etag = {'status': 'error', 'message': str(e)}, 400, None
+        except Exception as e:
+            payload, status, etag = {'status': 'error', 'message': str(e)}, 500, None
+        await self.send_json(send, payload, status, etag)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.client is not None:
+                    self.client.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # consistency.reads_from for the native paths: off the primary, the versions and the body are read in one
+    # causal session, so the body is never older than its ETag and a write's causal token is honoured
+    @asynccontextmanager
+    async def read_session(self, token):
+        if read_preference(self.wsgi_app, 'lists').mode == 0:
+            yield None
+            return
+        operation_time, cluster_time = decode_token(token) if token else (None, None)
+        async with await self.db.client.start_session(causal_consistency=True) as session:
+            if token:
+                session.advance_cluster_time(cluster_time)
+                session.advance_operation_time(operation_time)
+            yield session
+
+    # read before the documents, so the ETag never claims newer data than the body holds
+    async def current_versions(self, collections, session=None):
+        versions = {collection: 0 for collection in collections}
+        cursor = self.lists.collection_version.find({'_id': {'$in': collections}}, session=session)
+        for counter in await cursor.to_list(None):
+            versions[counter['_id']] = counter['version']
+        return versions
+
+    async def send_json(self, send, payload, status, etag=None):
+        body = self.wsgi_app.json.dumps(payload).encode()
+        await send({'type': 'http.response.start', 'status': status, 'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+            (b'access-control-allow-origin', b'*'),
+        ] + etag_headers(etag)})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def send_not_modified(self, send, etag):
+        await send({'type': 'http.response.start', 'status': 304,
+                    'headers': [(b'access-control-allow-origin', b'*')] + etag_headers(etag)})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    def list_route(self, collection, key, projection=None):
+        async def handler(args, receive, session=None):
+            documents = await self.lists[collection].find({}, projection, session=session).to_list(None)
+            return {'status': 'success', key: documents}, 200
+        return handler
+
+    async def get_patients(self, args, receive, session=None):
+        try:
+            limit, after = parse_page_args(args.get('limit', [None])[0], args.get('after', [None])[0])
+        except PageError as e:
+            return {'status': 'error', 'message': str(e)}, 400
+        projection = build_projection(args.get('fields', [None])[0])
+
+        query = {'_id': {'$gt': after}} if after else {}
+        lists = self.lists
+        cursor = lists.patient.find(query, projection, session=session).sort('_id', 1)
+        if limit:
+            cursor = cursor.limit(limit)
+        # the count is collection metadata and takes no session, it runs alongside the list
+        patients, total = await asyncio.gather(cursor.to_list(None), lists.patient.estimated_document_count())
+
+        if projection is None or 'appointments' in projection:
+            # every batch's $in lookup is in flight at the same time, unless they share a causal session
+            batches = [patients[start:start + APPOINTMENT_BATCH_SIZE]
+                       for start in range(0, len(patients), APPOINTMENT_BATCH_SIZE)]
+            grouped = {}
+            lookups = [self.appointments_for(batch, session) for batch in batches]
+            for appointments in await self.gather(lookups, session):
+                for appointment in appointments:
+                    grouped.setdefault(str(appointment['patient_id']), []).append(appointment)
+            for patient in patients:
+                patient['appointments'] = grouped.get(str(patient['_id']), 'N/A')
+
+        response = {'status': 'success', 'patients': patients, 'total': total}
+        if limit and len(patients) == limit:
+            response['next_after'] = patients[-1]['_id']
+        return response, 200
+
+    async def appointments_for(self, patients, session=None):
+        patient_ids = [patient['_id'] for patient in patients]
+        patient_keys = [str(patient_id) for patient_id in patient_ids] + patient_ids
+        return await self.lists.appointment.find({'patient_id': {'$in': patient_keys}}, session=session).to_list(None)
+
+    # concurrent without a session, in turn within one
+    @staticmethod
+    async def gather(coroutines, session):
+        if session is None:
+            return await asyncio.gather(*coroutines)
+        return [await coroutine for coroutine in coroutines]
+
+    async def find_doctor_and_nurse(self, args, receive, session=None):
+        request_data = await read_json(receive)
+        doctor_name = request_data.get('doctorName')
+        if not doctor_name:
+            return {'status': 'error', 'message': 'Doctor name not provided'}, 400
+
+        pipeline = [{'$match': {'name': doctor_name}}] + DOCTOR_WITH_NURSE_PIPELINE
+        doctors = await self.db.doctor.aggregate(pipeline).to_list(1)
+        if not doctors:
+            return {'status': 'error', 'message': 'Doctor not found'}, 404
+        doctor = doctors[0]
+        nurses = doctor.pop('assigned_nurse')
+        if not doctor.get('nurse_id'):
+            return {'status': 'error', 'message': 'No nurse assigned to this doctor'}, 404
+        if not nurses:
+            return {'status': 'error', 'message': 'Nurse not found'}, 404
+        return {'status': 'success', 'doctor': doctor, 'assigned_nurse': nurses[0]}, 200
+
+
+def etag_headers(etag):
+    if etag is None:
+        return []
+    return [(b'etag', f'"{etag}"'.encode()), (b'cache-control', b'no-cache')]
+
+
+def wants_stream(scope, args):
+    accept = dict(scope.get('headers', [])).get(b'accept', b'').decode()
+    return args.get('stream', [None])[0] == '1' or accept.startswith(NDJSON_MIMETYPE)
+
+
+async def read_json(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    return json.loads(body or b'{}')
+
+
+app = AsyncBackend(flask_app)
@@ -0,0 +1,127 @@
+import hmac
+import os
+import threading
+import time
+import uuid
+import jwt
+from cachetools import TTLCache
+from flask import current_app, g, jsonify, request
+from werkzeug.security import check_password_hash, generate_password_hash
+
+# werkzeug method string, the cost factor is part of it (e.g. "scrypt:32768:8:1", "pbkdf2:sha256:600000")
+DEFAULT_PASSWORD_HASH_METHOD = 'scrypt'
+HASH_PREFIXES = ('scrypt:', 'pbkdf2:')
+JWT_ALGORITHM = 'HS256'
+DEFAULT_TOKEN_SECONDS = 8 * 3600
+REVOCATION_LIST_SIZE = 100000
+# reachable without a token even when AUTH_REQUIRED is set
+PUBLIC_ENDPOINTS = ('doctor.doctor_login', 'metrics', 'static', 'healthz', 'readyz')
+
+
+def setting(key, default=None, app=None):
+    return (app or current_app).config.get(key, os.getenv(key, default))
+
+
+def auth_required(app=None):
+    return str(setting('AUTH_REQUIRED', '', app)) in ('1', 'True', 'true')
+
+
+def hash_password(password):
+    return generate_password_hash(password, method=setting('PASSWORD_HASH_METHOD', DEFAULT_PASSWORD_HASH_METHOD))
+
+
+def is_hashed(stored):
+    return isinstance(stored, str) and stored.startswith(HASH_PREFIXES)
+
+
+# returns (matches, needs_rehash); plaintext rows from before hashing still log in once and get migrated
+def verify_password(stored, password):
+    if not stored or not password:
+        return False, False
+    if not is_hashed(stored):
+        return hmac.compare_digest(str(stored), str(password)), True
+    if not check_password_hash(stored, password):
+        return False, False
+    method = setting('PASSWORD_HASH_METHOD', DEFAULT_PASSWORD_HASH_METHOD)
+    return True, not stored.startswith(method)
+
+
+def secret_key():
+    return setting('JWT_SECRET') or current_app.config.get('SECRET_KEY')
+
+
+# without a configured secret logins still work, they just don't get a session token
+def issue_token(doctor):
+    if not secret_key():
+        return None
+    now = int(time.time())
+    claims = {
+        'sub': str(doctor['_id']),
+        'email': doctor.get('email'),
+        'jti': uuid.uuid4().hex,
+        'iat': now,
+        'exp': now + int(setting('JWT_EXPIRES_SECONDS', DEFAULT_TOKEN_SECONDS)),
+    }
+    return jwt.encode(claims, secret_key(), algorithm=JWT_ALGORITHM)
+
+
+class RevocationList:
+    def __init__(self, size=REVOCATION_LIST_SIZE, ttl=DEFAULT_TOKEN_SECONDS):
+        self.lock = threading.Lock()
+        # entries only need to outlive the token they revoke
+        self.revoked = TTLCache(maxsize=size, ttl=ttl)
+
+    def revoke(self, jti):
+        with self.lock:
+            self.revoked[jti] = True
+
+    def is_revoked(self, jti):
+        with self.lock:
+            return jti in self.revoked
+
+
+revocation_list = RevocationList()
+
+
+def bearer_token():
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        return header[len('Bearer '):].strip()
+    return None
+
+
+# stateless check: signature, expiry and the in-memory revocation list, no database lookup
+def authenticate_request():
+    if request.method == 'OPTIONS':
+        return None
+    token = bearer_token()
+    if token is None:
+        if auth_required() and request.endpoint not in PUBLIC_ENDPOINTS:
+            return jsonify({'status': 'error', 'message': 'Authentication required'}), 401
+        return None
+    if not secret_key():
+        return jsonify({'status': 'error', 'message': 'Token authentication is not configured'}), 401
+    try:
+        claims = jwt.decode(token, secret_key(), algorithms=[JWT_ALGORITHM])
+    except jwt.InvalidTokenError as e:
+        return jsonify({'status': 'error', 'message': f'Invalid token: {e}'}), 401
+    if revocation_list.is_revoked(claims['jti']):
+        return jsonify({'status': 'error', 'message': 'Token has been revoked'}), 401
+    g.auth_claims = claims
+    return None
+
+
+# hash every password still stored in plaintext
+def migrate_plaintext_passwords(db):
+    migrated = 0
+    for doctor in db.doctor.find({'password': {'$exists': True}}, {'password': 1}):
+        if not is_hashed(doctor['password']):
+            # matching on the old value skips rows changed since they were read
+            result = db.doctor.update_one({'_id': doctor['_id'], 'password': doctor['password']},
+                                          {'$set': {'password': hash_password(str(doctor['password']))}})
+            migrated += result.modified_count
+    return migrated
+
+
+def init_auth(app):
+    app.before_request(authenticate_request)
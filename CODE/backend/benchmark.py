@@ -0,0 +1,793 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import threading
+import time
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from bson import ObjectId
+from flask.json.provider import DefaultJSONProvider
+from seed import SEED_PASSWORD
+
+FIXTURE_SIZE = 100
+DEFAULT_REQUESTS = 200
+# full lists and exports read whole collections, they get far fewer iterations
+DEFAULT_HEAVY_REQUESTS = 5
+WARMUP_REQUESTS = 3
+# routes that are never benchmarked: static files and the opt-in metrics endpoint
+COVERAGE_IGNORED = ('static', 'metrics')
+# run in a fresh interpreter per startup sample: import and build the app, then serve one request
+STARTUP_PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+if sys.argv[2] == "1":
+    import mongomock, database
+    client = mongomock.MongoClient()
+    database.MongoClient = lambda *_, **__: client
+import app
+imported = time.perf_counter()
+status = app.app.test_client().get(sys.argv[1]).status_code
+answered = time.perf_counter()
+print(json.dumps({"status": status, "import_ms": (imported - started) * 1000,
+                  "first_response_ms": (answered - imported) * 1000}))
+'''
+# appointments written by the benchmark are booked from here on, far from seeded ones
+BOOKING_START = datetime(2100, 1, 1)
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+# --path seeds (and drops) its own database, never the one the app serves
+PATH_DB_NAME = 'HospitalManagementBenchmark'
+DEFAULT_PATH_REPEAT = 3
+# documents serialized per call of --path serialize
+SERIALIZE_SAMPLE = 1000
+# werkzeug hash methods timed next to the configured one, the cost factor trade-off of --path login
+HASH_COST_METHODS = ('pbkdf2:sha256:260000', 'pbkdf2:sha256:600000', 'scrypt:16384:8:1', 'scrypt:32768:8:1')
+
+
+class Scenario:
+    def __init__(self, name, method, rule, build, heavy=False):
+        self.name = name
+        self.method = method
+        self.rule = rule
+        # iteration number -> request keyword arguments
+        self.build = build
+        self.heavy = heavy
+
+
+class ClientTransport:
+    def __init__(self, app):
+        self.app = app
+        self.client = app.test_client()
+
+    def request(self, method, path, json=None, data=None, content_type=None, headers=None):
+        response = self.client.open(path, method=method, json=json, data=data, content_type=content_type,
+                                    headers=headers)
+        body = response.get_data()
+        response.close()
+        return response.status_code, body
+
+
+class HttpTransport:
+    def __init__(self, base_url, timeout=60):
+        import requests
+        self.requests = requests
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def request(self, method, path, json=None, data=None, content_type=None, headers=None):
+        if not hasattr(self.local, 'session'):
+            self.local.session = self.requests.Session()
+        headers = dict(headers or {})
+        if content_type:
+            headers['Content-Type'] = content_type
+        response = self.local.session.request(method, self.base_url + path, json=json, data=data, headers=headers,
+                                              timeout=self.timeout)
+        return response.status_code, response.content
+
+
+# sample ids and names the scenarios work on, read through the API so both transports can run them
+class Fixtures:
+    def __init__(self, transport):
+        self.patients = self.sample(transport, '/patients/search?fields=name', 'patients')
+        self.doctors = self.sample(transport, '/doctor/search?fields=name,email', 'doctors')
+        self.nurses = self.sample(transport, '/nurse/search?fields=name', 'nurses')
+        self.appointments = self.sample(transport, '/appointment/search?fields=doctor_id', 'appointments')
+        self.created = {'patient': [], 'doctor': [], 'nurse': []}
+        self.token = None
+        self.job_id = '000000000000000000000000'
+        self.bookings = itertools.count()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def sample(transport, path, key):
+        status, body = transport.request('GET', f'{path}&limit={FIXTURE_SIZE}')
+        documents = json.loads(body).get(key) if status == 200 else None
+        if not documents:
+            raise SystemExit(f'No {key} to benchmark with (HTTP {status}), seed the database first with seed.py')
+        return documents
+
+    def pick(self, documents, i):
+        return documents[i % len(documents)]
+
+    # every booking gets its own 10 minute slot, so benchmark writes never collide
+    def next_booking(self):
+        with self.lock:
+            number = next(self.bookings)
+        return (BOOKING_START + timedelta(minutes=10 * number)).strftime(TIME_FORMAT)
+
+    def remember(self, collection, body):
+        document = json.loads(body).get(collection)
+        if document:
+            with self.lock:
+                self.created[collection].append(document['_id'])
+
+    def forget(self, collection):
+        with self.lock:
+            return self.created[collection].pop() if self.created[collection] else '000000000000000000000000'
+
+
+def build_scenarios(fixtures):
+    f = fixtures
+    patient = lambda i: f.pick(f.patients, i)
+    doctor = lambda i: f.pick(f.doctors, i)
+    nurse = lambda i: f.pick(f.nurses, i)
+
+    def appointment_body(i):
+        return {'patient_name': patient(i)['name'], 'doctor_name': doctor(i)['name'],
+                'appointment_time': f.next_booking()}
+
+    def logout(i):
+        return {'headers': {'Authorization': f'Bearer {f.token}'} if f.token else None}
+
+    return [
+        Scenario('patients_list', 'GET', '/patients/', lambda i: {'path': '/patients/'}, heavy=True),
+        Scenario('patients_page', 'GET', '/patients/', lambda i: {'path': '/patients/?limit=50'}),
+        Scenario('patients_search', 'GET', '/patients/search',
+                 lambda i: {'path': f"/patients/search?q={patient(i)['name'][:3]}&limit=20"}),
+        Scenario('patients_info', 'POST', '/patients/get_patient_info',
+                 lambda i: {'json': {'name': patient(i)['name']}}),
+        Scenario('patients_update', 'PUT', '/patients/update',
+                 lambda i: {'json': {'name': patient(i)['name'], 'contact': f'9{i:09d}'}}),
+        # bursts of edits to one record, what WRITE_COALESCING merges
+        Scenario('patients_update_hot', 'PUT', '/patients/update',
+                 lambda i: {'json': {'name': patient(0)['name'], 'contact': f'9{i:09d}'}}),
+        Scenario('patients_add', 'POST', '/patients/add',
+                 lambda i: {'json': {'name': f'Benchmark Patient {i}', 'age': '30', 'gender': 'Female'},
+                            'remember': 'patient'}),
+        Scenario('patients_delete', 'DELETE', '/patients/delete', lambda i: {'json': {'_id': f.forget('patient')}}),
+        Scenario('doctors_list', 'GET', '/doctor/', lambda i: {'path': '/doctor/'}, heavy=True),
+        Scenario('doctors_search', 'GET', '/doctor/search',
+                 lambda i: {'path': '/doctor/search?department=Cardiology&limit=20'}),
+        Scenario('doctors_info', 'POST', '/doctor/get_doctor_info', lambda i: {'json': {'name': doctor(i)['name']}}),
+        Scenario('doctors_login', 'POST', '/doctor/login',
+                 lambda i: {'json': {'email': doctor(i)['email'], 'password': SEED_PASSWORD}, 'token': True}),
+        Scenario('doctors_logout', 'POST', '/doctor/logout', logout),
+        Scenario('doctors_update', 'PUT', '/doctor/update',
+                 lambda i: {'json': {'name': doctor(i)['name'], 'experience': str(i % 40)}}),
+        Scenario('doctors_assign_nurse', 'PUT', '/doctor/assign_nurse',
+                 lambda i: {'json': {'name': doctor(i)['name'], 'nurseName': nurse(i)['name']}}),
+        Scenario('doctors_add', 'POST', '/doctor/add',
+                 lambda i: {'json': {'name': f'Benchmark Doctor {i}',
+                                     'email': f'benchmark{i}.{time.time_ns()}@example.com'}, 'remember': 'doctor'}),
+        Scenario('doctors_delete', 'DELETE', '/doctor/delete', lambda i: {'json': {'objectId': f.forget('doctor')}}),
+        Scenario('nurses_list', 'GET', '/nurse/', lambda i: {'path': '/nurse/'}, heavy=True),
+        Scenario('nurses_search', 'GET', '/nurse/search',
+                 lambda i: {'path': f"/nurse/search?q={nurse(i)['name'][:3]}"}),
+        Scenario('nurses_info', 'POST', '/nurse/get_nurse_info', lambda i: {'json': {'name': nurse(i)['name']}}),
+        Scenario('nurses_update', 'PUT', '/nurse/update',
+                 lambda i: {'json': {'name': nurse(i)['name'], 'shift': 'Morning'}}),
+        Scenario('nurses_add', 'POST', '/nurse/add',
+                 lambda i: {'json': {'name': f'Benchmark Nurse {i}'}, 'remember': 'nurse'}),
+        Scenario('nurses_delete', 'DELETE', '/nurse/delete', lambda i: {'json': {'objectId': f.forget('nurse')}}),
+        Scenario('nurses_reassign', 'PUT', '/nurse/reassign',
+                 lambda i: {'json': {'name': nurse(i)['name'], 'replacementName': nurse(i + 1)['name']}}),
+        Scenario('find_nurse_from_doctor', 'POST', '/extra/find_nurse_from_doctor',
+                 lambda i: {'json': {'doctorName': doctor(i)['name']}}),
+        Scenario('appointments_list', 'GET', '/appointment/', lambda i: {'path': '/appointment/'}, heavy=True),
+        Scenario('appointments_search', 'GET', '/appointment/search',
+                 lambda i: {'path': f"/appointment/search?doctor_id={doctor(i)['_id']}&limit=20"}),
+        Scenario('appointments_add', 'POST', '/appointment/add', lambda i: {'json': appointment_body(i)}),
+        Scenario('appointments_add_batch', 'POST', '/appointment/add_batch',
+                 lambda i: {'json': {'appointments': [appointment_body(i * 10 + j) for j in range(10)]}}),
+        Scenario('appointments_update', 'PUT', '/appointment/update',
+                 lambda i: {'json': {'appointment_id': f.pick(f.appointments, i)['_id'],
+                                     'appointment_time': f.next_booking()}}),
+        Scenario('appointments_free_slots', 'GET', '/appointment/free_slots',
+                 lambda i: {'path': f"/appointment/free_slots?doctor_id={doctor(i)['_id']}&count=5"}),
+        Scenario('bulk_import', 'POST', '/bulk/<kind>',
+                 lambda i: {'path': '/bulk/patients', 'content_type': 'application/x-ndjson',
+                            'data': ''.join(json.dumps({'name': f'Bulk Patient {i}.{j}'}) + '\n'
+                                            for j in range(100))}),
+        Scenario('bulk_export', 'GET', '/bulk/<kind>', lambda i: {'path': '/bulk/patients?format=ndjson'}, heavy=True),
+        Scenario('jobs_report', 'POST', '/jobs/reports', lambda i: {'json': {'kind': 'nurses', 'format': 'csv'}}),
+        Scenario('jobs_status', 'GET', '/jobs/<job_id>', lambda i: {'path': f'/jobs/{f.job_id}'}),
+        Scenario('jobs_download', 'GET', '/jobs/<job_id>/download', lambda i: {'path': f'/jobs/{f.job_id}/download'}),
+        Scenario('department_details', 'GET', '/department/getDetails', lambda i: {'path': '/department/getDetails'}),
+        Scenario('dashboard_summary', 'GET', '/dashboard/summary', lambda i: {'path': '/dashboard/summary'}),
+        Scenario('healthz', 'GET', '/healthz', lambda i: {'path': '/healthz'}),
+        Scenario('readyz', 'GET', '/readyz', lambda i: {'path': '/readyz'}),
+        Scenario('pool_stats', 'GET', '/pool_stats', lambda i: {'path': '/pool_stats'}),
+        Scenario('cache_stats', 'GET', '/cache_stats', lambda i: {'path': '/cache_stats'}),
+        Scenario('write_stats', 'GET', '/write_stats', lambda i: {'path': '/write_stats'}),
+    ]
+
+
+# ids the way every response rendered them before the JSON provider did it
+def legacy_convert_objectid(data):
+    if isinstance(data, dict):
+        return {key: legacy_convert_objectid(value) for key, value in data.items()}
+    elif isinstance(data, list):
+        return [legacy_convert_objectid(item) for item in data]
+    elif isinstance(data, ObjectId):
+        return str(data)
+    return data
+
+
+# GET /patients/ before batching: every patient, then one appointment query per patient. Both id forms
+# are matched, like the new path, so both return the same appointments
+def legacy_patients_list(db, json_provider):
+    patients = list(db.patient.find())
+    for patient in patients:
+        appointments = list(db.appointment.find({'patient_id': {'$in': [str(patient['_id']), patient['_id']]}}))
+        patient['appointments'] = [legacy_convert_objectid(appointment) for appointment in appointments] \
+            if appointments else 'N/A'
+        patient['_id'] = str(patient['_id'])
+    return json_provider.dumps({'status': 'success', 'patients': patients})
+
+
+def checked_call(client, method, path, **kwargs):
+    response = client.open(path, method=method, **kwargs)
+    if response.status_code != 200:
+        raise SystemExit(f'{method} {path} answered {response.status_code}: {response.get_data(as_text=True)[:200]}')
+    return response.get_data()
+
+
+def checked_get(client, path):
+    return checked_call(client, 'GET', path)
+
+
+def patients_paths(app, db, size):
+    client = app.test_client()
+    legacy_json = DefaultJSONProvider(app)
+    middle = next(db.patient.find({}, {'_id': 1}).sort('_id', 1).skip(size // 2).limit(1))['_id']
+    return {
+        'before_n_plus_one': lambda i: legacy_patients_list(db, legacy_json),
+        'after_full_list': lambda i: checked_get(client, '/patients/'),
+        'after_first_page': lambda i: checked_get(client, '/patients/?limit=50'),
+        'after_middle_page': lambda i: checked_get(client, f'/patients/?limit=50&after={middle}'),
+    }
+
+
+# booking name resolution before the name index: a $match/$group aggregation on each collection
+def legacy_resolver(db):
+    def update_appointment_with_ids(appointment_data):
+        patient_name = appointment_data.get('patient_name')
+        doctor_name = appointment_data.get('doctor_name')
+        pipeline = [
+            {'$match': {'name': {'$in': [patient_name, doctor_name]}}},
+            {'$group': {'_id': '$name', 'id': {'$first': '$_id'}}}
+        ]
+        patient = list(db.patient.aggregate(pipeline))
+        doctor = list(db.doctor.aggregate(pipeline))
+        appointment_data['patient_id'] = next((p['id'] for p in patient if p['_id'] == patient_name), None)
+        appointment_data['doctor_id'] = next((d['id'] for d in doctor if d['_id'] == doctor_name), None)
+    return update_appointment_with_ids
+
+
+# every variant books its own 10 minute slots, so no call is rejected as a collision
+def appointment_add_paths(app, db, size):
+    import appointment
+    client = app.test_client()
+    patients = list(db.patient.find({}, {'name': 1}).limit(FIXTURE_SIZE))
+    doctors = list(db.doctor.find({}, {'name': 1}).limit(FIXTURE_SIZE))
+    bookings = itertools.count()
+    current = appointment.update_appointment_with_ids
+    legacy = legacy_resolver(db)
+
+    def by_name(i):
+        return {'patient_name': patients[i % len(patients)]['name'], 'doctor_name': doctors[i % len(doctors)]['name'],
+                'appointment_time': (BOOKING_START + timedelta(minutes=10 * next(bookings))).strftime(TIME_FORMAT)}
+
+    def by_id(i):
+        body = by_name(i)
+        body['patient_id'] = str(patients[i % len(patients)]['_id'])
+        body['doctor_id'] = str(doctors[i % len(doctors)]['_id'])
+        return body
+
+    def before(i):
+        appointment.update_appointment_with_ids = legacy
+        try:
+            return checked_call(client, 'POST', '/appointment/add', json=by_name(i))
+        finally:
+            appointment.update_appointment_with_ids = current
+
+    return {
+        'before_aggregations': before,
+        'after_name_index': lambda i: checked_call(client, 'POST', '/appointment/add', json=by_name(i)),
+        'after_ids': lambda i: checked_call(client, 'POST', '/appointment/add', json=by_id(i)),
+    }
+
+
+# one call serializes the whole sample document by document, the result is also reported per document
+def serialize_paths(app, db, size):
+    from json_provider import MongoJSONProvider
+    if not isinstance(app.json, MongoJSONProvider):
+        raise SystemExit('The app does not use MongoJSONProvider')
+    documents = list(db.appointment.find().limit(SERIALIZE_SAMPLE))
+    legacy_json = DefaultJSONProvider(app)
+
+    def before(i):
+        for document in documents:
+            legacy_json.dumps(legacy_convert_objectid(document))
+
+    def after(i):
+        for document in documents:
+            app.json.dumps(document)
+
+    # the provider's own encoder without orjson, the same as after when orjson is not installed
+    def after_stdlib(i):
+        for document in documents:
+            DefaultJSONProvider.dumps(app.json, document)
+
+    return {'before_convert_objectid': (before, len(documents)), 'after_provider': (after, len(documents)),
+            'after_provider_stdlib': (after_stdlib, len(documents))}
+
+
+# a page of every kind of search, each must cost the same however many patients there are
+def search_paths(app, db, size):
+    client = app.test_client()
+    doctor = db.doctor.find_one({}, {'_id': 1}, sort=[('_id', 1)])
+    first_page = json.loads(checked_get(client, '/patients/search?q=Pri&limit=20&fields=name'))
+    after = quote(first_page['next_after'] or '')
+    day = db.appointment.find_one({'doctor_id': doctor['_id']}, {'appointment_time': 1})['appointment_time']
+    appointments = (f"/appointment/search?doctor_id={doctor['_id']}&appointment_time_from={day:%Y-%m-%d}"
+                    f"&appointment_time_to={day + timedelta(days=1):%Y-%m-%d}&limit=20")
+    variants = {
+        'patients_prefix': lambda i: checked_get(client, '/patients/search?q=Pri&limit=20&fields=name'),
+        'patients_prefix_next_page': lambda i: checked_get(client, f'/patients/search?q=Pri&limit=20&fields=name'
+                                                                   f'&after={after}'),
+        'patients_filter': lambda i: checked_get(client, '/patients/search?gender=Female&limit=20&fields=name'),
+        'appointments_doctor_day': lambda i: checked_get(client, appointments),
+    }
+    # mongomock has no text search; seeded names end in their sequence number, a term as rare as a surname
+    if not type(db).__module__.startswith('mongomock'):
+        variants['patients_text'] = lambda i: checked_get(client, f'/patients/search?mode=text&q={size // 2}'
+                                                                  f'&fields=name')
+    return variants
+
+
+# POST /doctor/login before hashing compared plaintext with ==, and never rehashed
+def legacy_verify_password(stored, password):
+    return stored == password, False
+
+
+def login_paths(app, db, size):
+    from werkzeug.security import check_password_hash, generate_password_hash
+    import doctor
+    from auth import DEFAULT_PASSWORD_HASH_METHOD, setting
+    client = app.test_client()
+    current = doctor.verify_password
+    emails = [doctor['email'] for doctor in db.doctor.find({}, {'email': 1}).limit(FIXTURE_SIZE)]
+    # the old rows stored the password itself
+    db.doctor.insert_one({'name': 'Plaintext Login', 'email': 'plaintext-login@example.com', 'password': SEED_PASSWORD})
+    # tokens are only issued with a secret, and only checked when a request carries one or auth is required
+    app.config.setdefault('JWT_SECRET', 'benchmark-only-secret-of-32-bytes-or-more')
+    token = json.loads(checked_call(client, 'POST', '/doctor/login',
+                                    json={'email': emails[0], 'password': SEED_PASSWORD}))['token']
+
+    def login(i):
+        return checked_call(client, 'POST', '/doctor/login',
+                            json={'email': emails[i % len(emails)], 'password': SEED_PASSWORD})
+
+    def before(i):
+        doctor.verify_password = legacy_verify_password
+        try:
+            return checked_call(client, 'POST', '/doctor/login',
+                                json={'email': 'plaintext-login@example.com', 'password': SEED_PASSWORD})
+        finally:
+            doctor.verify_password = current
+
+    def authenticated(i):
+        app.config['AUTH_REQUIRED'] = '1'
+        try:
+            return checked_call(client, 'GET', '/doctor/search?limit=1',
+                                headers={'Authorization': f'Bearer {token}'})
+        finally:
+            app.config['AUTH_REQUIRED'] = '0'
+
+    variants = {
+        'login_before_plaintext': before,
+        'login_after_hashed': login,
+        'request_anonymous': lambda i: checked_get(client, '/doctor/search?limit=1'),
+        'request_with_token': authenticated,
+    }
+    configured = setting('PASSWORD_HASH_METHOD', DEFAULT_PASSWORD_HASH_METHOD)
+    for method in (configured,) + tuple(method for method in HASH_COST_METHODS if method != configured):
+        stored = generate_password_hash(SEED_PASSWORD, method=method)
+        variants[f'hash {method}'] = lambda i, method=method: generate_password_hash(SEED_PASSWORD, method=method)
+        variants[f'check {method}'] = lambda i, stored=stored: check_password_hash(stored, SEED_PASSWORD)
+    return variants
+
+
+# what the frontend fetched on load before the summary existed, against the summary itself
+def dashboard_paths(app, db, size):
+    import dashboard
+    client = app.test_client()
+    return {
+        'before_four_lists': lambda i: b''.join(checked_get(client, path) for path in
+                                               ('/patients/', '/doctor/', '/nurse/', '/appointment/')),
+        'after_summary': lambda i: checked_get(client, '/dashboard/summary'),
+        # the summary is cached for a few seconds, this is what a cache miss costs
+        'after_summary_uncached': lambda i: app.json.dumps(dashboard.build_summary()),
+    }
+
+
+def checked_not_modified(client, path, etag):
+    response = client.get(path, headers={'If-None-Match': etag})
+    if response.status_code != 304:
+        raise SystemExit(f'GET {path} with its ETag answered {response.status_code}, not 304')
+    return response.get_data()
+
+
+# a client polling the patient list after a handful of edits: refetch everything, revalidate its
+# ETag, or ask for what changed since its sync token
+def sync_paths(app, db, size):
+    from sync import bump_version, SYNC_OVERLAP
+    client = app.test_client()
+    # seeded documents all carry version 1, move the counters past the overlap a delta re-sends,
+    # as a server that has seen some writes would be
+    for collection in ('patient', 'appointment'):
+        for _ in range(SYNC_OVERLAP + 1):
+            bump_version(collection)
+    first = client.get('/patients/')
+    token = first.get_json()['sync_token']
+    for patient in db.patient.find({}, {'name': 1}).limit(max(1, size // 100)):
+        checked_call(client, 'PUT', '/patients/update', json={'name': patient['name'], 'phone': '555-0100'})
+    app.extensions['writes'].flush()
+    etag = client.get('/patients/').headers['ETag']
+    if etag == first.headers['ETag']:
+        raise SystemExit('editing patients did not change the ETag of /patients/')
+    # a stale ETag costs the same as full_refetch
+    return {
+        'full_refetch': lambda i: checked_get(client, '/patients/'),
+        'conditional_unchanged': lambda i: checked_not_modified(client, '/patients/', etag),
+        'delta_since': lambda i: checked_get(client, f'/patients/?since={token}'),
+    }
+
+
+# size new patients per call, imported in one NDJSON upload or added one /patients/add at a time
+def bulk_paths(app, db, size):
+    client = app.test_client()
+    rows = lambda i: [{'name': f'Imported Patient {i}-{n}', 'age': 20 + n % 60, 'gender': 'F' if n % 2 else 'M',
+                       'phone': f'555-{n:04d}'} for n in range(size)]
+
+    def per_row(i):
+        for row in rows(i):
+            checked_call(client, 'POST', '/patients/add', json=row)
+
+    def bulk(i, batch_size=None):
+        body = ''.join(json.dumps(row) + '\n' for row in rows(i))
+        query = f'?batch_size={batch_size}' if batch_size else ''
+        response = checked_call(client, 'POST', f'/bulk/patients{query}', data=body, content_type='application/x-ndjson')
+        if json.loads(response)['inserted'] != size:
+            raise SystemExit(f'bulk import rejected rows: {response[:200]}')
+
+    return {
+        'before_per_row_add': (per_row, size),
+        'after_bulk_import': (lambda i: bulk(i), size),
+        'after_bulk_import_batch_100': (lambda i: bulk(i, 100), size),
+    }
+
+
+# --path name -> (variants builder, default patient counts); a builder returns variant name -> call(i),
+# or (call(i), documents handled per call) to also get the cost per document
+PATH_BENCHMARKS = {
+    'patients': (patients_paths, (10000, 100000)),
+    'appointment_add': (appointment_add_paths, (10000, 100000)),
+    'serialize': (serialize_paths, (1000,)),
+    'search': (search_paths, (10000, 100000, 1000000)),
+    'login': (login_paths, (1000,)),
+    'dashboard': (dashboard_paths, (10000, 100000)),
+    'sync': (sync_paths, (10000, 100000)),
+    'bulk': (bulk_paths, (1000, 10000)),
+}
+
+
+# nearest-rank percentile of an already sorted list
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+
+def rss_kb(pid=None):
+    if pid is None:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    return None
+
+
+# memory is this process in client mode, the server's only when its pid is known
+def run_scenario(transport, fixtures, scenario, requests, concurrency, memory_pid=None,
+                 measure_memory=True):
+    latencies = []
+    sizes = []
+    status_codes = {}
+    errors = 0
+    lock = threading.Lock()
+
+    def call(i):
+        nonlocal errors
+        options = scenario.build(i)
+        path = options.pop('path', scenario.rule)
+        remember = options.pop('remember', None)
+        keep_token = options.pop('token', False)
+        started = time.perf_counter()
+        try:
+            status, body = transport.request(scenario.method, path, **options)
+        except Exception:
+            status, body = None, b''
+        elapsed = time.perf_counter() - started
+        if remember and status == 200:
+            fixtures.remember(remember, body)
+        if keep_token and status == 200:
+            fixtures.token = json.loads(body).get('token') or fixtures.token
+        if status == 202:
+            fixtures.job_id = json.loads(body)['job_id']
+        with lock:
+            latencies.append(elapsed)
+            sizes.append(len(body))
+            status_codes[str(status)] = status_codes.get(str(status), 0) + 1
+            if status is None or status >= 500:
+                errors += 1
+
+    for i in range(WARMUP_REQUESTS):
+        call(-1 - i)
+    latencies.clear()
+    sizes.clear()
+    status_codes.clear()
+    errors = 0
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(call, range(requests)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    to_ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    return {
+        'method': scenario.method,
+        'rule': scenario.rule,
+        'requests': requests,
+        'errors': errors,
+        'status_codes': status_codes,
+        'p50_ms': to_ms(percentile(latencies, 0.50)),
+        'p95_ms': to_ms(percentile(latencies, 0.95)),
+        'p99_ms': to_ms(percentile(latencies, 0.99)),
+        'mean_ms': to_ms(sum(latencies) / len(latencies)) if latencies else None,
+        'max_ms': to_ms(latencies[-1]) if latencies else None,
+        'throughput_rps': round(requests / wall, 2) if wall else None,
+        'mean_response_bytes': round(sum(sizes) / len(sizes)) if sizes else None,
+        'peak_rss_kb': rss_kb(memory_pid) if measure_memory else None,
+    }
+
+
+# cold start: process spawn to the first response, what a freshly scaled worker pays before serving
+def measure_startup(samples, path, mongomock=False):
+    backend = os.path.dirname(os.path.abspath(__file__))
+    runs = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', STARTUP_PROBE, path, '1' if mongomock else '0'],
+                                capture_output=True, text=True, cwd=backend, check=True).stdout
+        total = (time.perf_counter() - started) * 1000
+        runs.append(dict(json.loads(output.strip().splitlines()[-1]), total_ms=total))
+    result = {'samples': samples, 'path': path, 'statuses': sorted({run['status'] for run in runs})}
+    for key in ('total_ms', 'import_ms', 'first_response_ms'):
+        values = sorted(run[key] for run in runs)
+        result[f'{key[:-3]}_p50_ms'] = round(percentile(values, 0.50), 1)
+        result[f'{key[:-3]}_p95_ms'] = round(percentile(values, 0.95), 1)
+    return result
+
+
+# one variant called repeat times, after one uncounted call that loads caches and indexes; variants
+# returning a body also get its size
+def time_calls(call, repeat, items=1):
+    call(-1)
+    latencies, sizes = [], []
+    for i in range(repeat):
+        started = time.perf_counter()
+        body = call(i)
+        latencies.append(time.perf_counter() - started)
+        if isinstance(body, (bytes, str)):
+            sizes.append(len(body.encode() if isinstance(body, str) else body))
+    latencies.sort()
+    result = {'calls': repeat, 'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+              'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3), 'max_ms': round(latencies[-1] * 1000, 3)}
+    if items > 1:
+        result['per_item_us'] = round(sum(latencies) / len(latencies) / items * 1e6, 2)
+        result['items_per_s'] = round(items * len(latencies) / sum(latencies))
+    if sizes:
+        result['response_bytes'] = round(sum(sizes) / len(sizes))
+    return result
+
+
+# the same code path before and after a change, on freshly seeded data at every size. mongomock scans
+# linearly and has no query planner, its numbers only mean something at small --sizes
+def run_path_benchmark(args):
+    import database
+    from name_index import patient_names, doctor_names
+    from seed import seed
+    database.DB_NAME = PATH_DB_NAME
+    if args.mongomock:
+        import mongomock
+        client = mongomock.MongoClient()
+        database.MongoClient = lambda *_, **__: client
+    from app import app
+    build, default_sizes = PATH_BENCHMARKS[args.path]
+    sizes = [int(size) for size in args.sizes.split(',')] if args.sizes else default_sizes
+    results = {'path': args.path, 'mongomock': args.mongomock, 'repeat': args.repeat, 'sizes': {}}
+    for size in sizes:
+        with app.app_context():
+            db = database.get_client()[PATH_DB_NAME]
+            print(f'Seeded {size}:', seed(db, size, args.seed_doctors, args.seed_nurses,
+                                          args.appointments_per_patient, drop=True))
+            # the name indexes still hold the ids of the previous size
+            for names in (patient_names, doctor_names):
+                names.load(db)
+            results['sizes'][size] = {}
+            for variant, call in build(app, db, size).items():
+                call, items = call if isinstance(call, tuple) else (call, 1)
+                result = time_calls(call, args.repeat, items)
+                results['sizes'][size][variant] = result
+                per_item = (f" {result['per_item_us']}us per document, {result['items_per_s']}/s"
+                            if 'per_item_us' in result else '')
+                body = f" {result['response_bytes']} bytes" if 'response_bytes' in result else ''
+                print(f"{size:>9} {variant:28} p50 {result['p50_ms']}ms mean {result['mean_ms']}ms "
+                      f"max {result['max_ms']}ms{per_item}{body}")
+    return results
+
+
+def uncovered_routes(app, scenarios):
+    covered = {(scenario.method, scenario.rule) for scenario in scenarios}
+    return sorted(f'{method} {rule.rule}' for rule in app.url_map.iter_rules() if rule.endpoint not in COVERAGE_IGNORED
+                  for method in rule.methods - {'HEAD', 'OPTIONS'} if (method, rule.rule) not in covered)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(baseline_path, results):
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)['scenarios']
+    print(f"{'scenario':28} {'p50 ms':>18} {'p95 ms':>18} {'p99 ms':>18} {'req/s':>18}")
+    for name, current in results['scenarios'].items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        cells = []
+        for key in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps'):
+            old, new = before.get(key), current.get(key)
+            change = f'{(new - old) / old * 100:+.0f}%' if old and new is not None else 'n/a'
+            cells.append(f'{new} ({change})'.rjust(18))
+        print(f'{name:28} ' + ' '.join(cells))
+
+
+# the Flask app on a private in-memory database, seeded before the first request
+def mongomock_app(args):
+    import mongomock
+    import database
+    from seed import seed
+    client = mongomock.MongoClient()
+    database.MongoClient = lambda *_, **__: client
+    from app import app
+    print('Seeded:', seed(client[database.DB_NAME], args.seed_patients, args.seed_doctors, args.seed_nurses,
+                          drop=True))
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency and throughput of every backend route.')
+    parser.add_argument('--mode', choices=('client', 'http'), default='client',
+                        help='Flask test client in this process, or a running server over HTTP')
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--server-pid', type=int, help='report the peak RSS of this process in http mode')
+    parser.add_argument('--mongomock', action='store_true',
+                        help='client mode or --path on a seeded in-memory database')
+    parser.add_argument('--seed-patients', type=int, default=500)
+    parser.add_argument('--seed-doctors', type=int, default=20)
+    parser.add_argument('--seed-nurses', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS)
+    parser.add_argument('--heavy-requests', type=int, default=DEFAULT_HEAVY_REQUESTS)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--only', help='regex, run only the matching scenarios')
+    parser.add_argument('--skip', help='regex, skip the matching scenarios')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='print the change against an earlier JSON result')
+    parser.add_argument('--startup', type=int, metavar='SAMPLES',
+                        help='measure cold start in this many fresh processes instead of the routes')
+    parser.add_argument('--startup-path', default='/patients/', help='the first request of each cold start')
+    parser.add_argument('--path', choices=sorted(PATH_BENCHMARKS),
+                        help=f'time the old and new implementation of one code path in database {PATH_DB_NAME}')
+    parser.add_argument('--sizes', help='comma separated patient counts for --path, each one seeded afresh')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_PATH_REPEAT, help='calls per variant for --path')
+    parser.add_argument('--appointments-per-patient', type=int, default=2)
+    args = parser.parse_args()
+
+    if args.path:
+        result = run_path_benchmark(args)
+        result['commit'] = git_commit()
+        if args.output:
+            with open(args.output, 'w') as output:
+                json.dump(result, output, indent=2, sort_keys=True)
+        return
+
+    if args.startup:
+        result = measure_startup(args.startup, args.startup_path, args.mongomock)
+        result['commit'] = git_commit()
+        print(json.dumps(result, indent=2, sort_keys=True))
+        if args.output:
+            with open(args.output, 'w') as output:
+                json.dump(result, output, indent=2, sort_keys=True)
+        return
+
+    app = None
+    if args.mode == 'client':
+        if args.mongomock:
+            app = mongomock_app(args)
+        else:
+            from app import app
+        transport = ClientTransport(app)
+    else:
+        transport = HttpTransport(args.base_url)
+
+    fixtures = Fixtures(transport)
+    scenarios = build_scenarios(fixtures)
+    selected = [scenario for scenario in scenarios
+                if (not args.only or re.search(args.only, scenario.name))
+                and not (args.skip and re.search(args.skip, scenario.name))]
+
+    results = {
+        'meta': {
+            'commit': git_commit(),
+            'mode': args.mode,
+            'mongomock': args.mongomock,
+            'concurrency': args.concurrency,
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+        },
+        'scenarios': {},
+    }
+    for scenario in selected:
+        requests = args.heavy_requests if scenario.heavy else args.requests
+        result = run_scenario(transport, fixtures, scenario, requests, args.concurrency, args.server_pid,
+                              measure_memory=args.mode == 'client' or args.server_pid is not None)
+        results['scenarios'][scenario.name] = result
+        print(f"{scenario.name:28} p50 {result['p50_ms']}ms p95 {result['p95_ms']}ms p99 {result['p99_ms']}ms "
+              f"{result['throughput_rps']} req/s {result['mean_response_bytes']} bytes errors {result['errors']}")
+    if app is not None:
+        results['meta']['uncovered_routes'] = uncovered_routes(app, scenarios)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import csv
+import io
+import json
+from datetime import datetime
+from bson.objectid import ObjectId
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from pymongo.errors import BulkWriteError
+from functions import build_projection, NDJSON_MIMETYPE, STREAM_BATCH_SIZE
+from database import db
+from consistency import reads_from
+from scheduler import book_appointments, DEFAULT_DURATION_MINUTES
+from name_index import patient_names, doctor_names
+from sync import versioned_write, SYNC_FIELD
+from auth import hash_password, is_hashed
+
+# pyarrow takes longer to import than the rest of the app, it is loaded by the first parquet export
+pa = pq = None
+
+bulk_bp = Blueprint('bulk', __name__)
+
+NAME_INDEXES = {'patient': patient_names, 'doctor': doctor_names}
+
+# url name -> collection
+BULK_COLLECTIONS = {
+    'patients': 'patient',
+    'doctors': 'doctor',
+    'nurses': 'nurse',
+    'appointments': 'appointment',
+}
+DEFAULT_IMPORT_BATCH_SIZE = 1000
+# never leave the backend, whatever ?fields= asks for
+EXPORT_HIDDEN_FIELDS = {'doctor': ('password',)}
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def upload_stream():
+    if 'file' in request.files:
+        upload = request.files['file']
+        return io.TextIOWrapper(upload.stream, encoding='utf-8'), f'{upload.mimetype} {upload.filename}'
+    return io.TextIOWrapper(request.stream, encoding='utf-8'), request.mimetype
+
+
+# yield (row number, document or None, error) without reading the whole upload
+def parse_rows(stream, content_type):
+    if 'csv' in content_type:
+        for row_number, row in enumerate(csv.DictReader(stream), start=1):
+            yield row_number, {key: value for key, value in row.items() if value != ''}, None
+        return
+    for row_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            document = json.loads(line)
+        except ValueError as e:
+            yield row_number, None, str(e)
+            continue
+        if isinstance(document, dict):
+            yield row_number, document, None
+        else:
+            yield row_number, None, 'Row is not a JSON object'
+
+
+def prepare_appointment_row(document):
+    document['appointment_time'] = datetime.strptime(document['appointment_time'], TIME_FORMAT)
+    document['duration_minutes'] = int(document.get('duration_minutes', DEFAULT_DURATION_MINUTES))
+    for key in ('patient_id', 'doctor_id'):
+        if document.get(key):
+            document[key] = ObjectId(document[key])
+    if not document.get('doctor_id'):
+        raise ValueError('doctor_id not provided')
+    document['_id'] = ObjectId()
+    return document
+
+
+# imported passwords are stored like /doctor/add stores them, rows that are already hashed are kept
+def prepare_doctor_row(document):
+    if document.get('password') and not is_hashed(document['password']):
+        document['password'] = hash_password(document['password'])
+    return document
+
+
+# collection -> function(row document) raising on a row that cannot be imported
+ROW_PREPARERS = {'appointment': prepare_appointment_row, 'doctor': prepare_doctor_row}
+
+
+def write_batch(collection, rows):
+    documents = [document for _, document in rows]
+    with versioned_write(collection) as version:
+        for document in documents:
+            document[SYNC_FIELD] = version
+        if collection == 'appointment':
+            failed = book_appointments(db, documents)
+            return [{'row': rows[i][0], 'message': 'Appointment collides with existing appointment for the doctor'}
+                    for i in sorted(failed)]
+        write_errors = []
+        try:
+            db[collection].insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            write_errors = e.details['writeErrors']
+    if collection in NAME_INDEXES:
+        failed = {error['index'] for error in write_errors}
+        for i, document in enumerate(documents):
+            if i not in failed:
+                NAME_INDEXES[collection].add(document['_id'], document.get('name'))
+    return [{'row': rows[error['index']][0], 'message': error['errmsg']} for error in write_errors]
+
+
+@bulk_bp.route('/<kind>', methods=['POST'])
+def bulk_import(kind):
+    try:
+        collection = BULK_COLLECTIONS.get(kind)
+        if not collection:
+            return jsonify({'status': 'error', 'message': f'Unknown collection {kind}'}), 404
+        batch_size = request.args.get('batch_size', str(DEFAULT_IMPORT_BATCH_SIZE))
+        # a batch never fills up below 1, every row would wait for the end of the upload
+        if not batch_size.isdigit() or int(batch_size) < 1:
+            return jsonify({'status': 'error', 'message': 'batch_size must be a positive integer'}), 400
+        batch_size = int(batch_size)
+
+        stream, content_type = upload_stream()
+        total, errors, batch = 0, [], []
+        for row_number, document, error in parse_rows(stream, content_type or ''):
+            total += 1
+            if document is not None and collection in ROW_PREPARERS:
+                try:
+                    document = ROW_PREPARERS[collection](document)
+                except Exception as e:
+                    document, error = None, str(e)
+            if document is None:
+                errors.append({'row': row_number, 'message': error})
+                continue
+            batch.append((row_number, document))
+            if len(batch) == batch_size:
+                errors.extend(write_batch(collection, batch))
+                batch = []
+        if batch:
+            errors.extend(write_batch(collection, batch))
+
+        return jsonify({'status': 'success', 'message': f'{total - len(errors)} of {total} rows imported',
+                        'inserted': total - len(errors), 'errors': errors})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+def export_value(value):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, datetime):
+        return value.strftime(TIME_FORMAT)
+    return str(value)
+
+
+def flatten_batch(batch, columns):
+    columns = columns or list(dict.fromkeys(key for document in batch for key in document))
+    return columns, [{column: export_value(document.get(column)) for column in columns} for document in batch]
+
+
+# documents in batches, flattened to the columns of the first batch (or ?fields=)
+def export_batches(cursor, columns):
+    batch = []
+    for document in cursor:
+        batch.append(document)
+        if len(batch) == STREAM_BATCH_SIZE:
+            columns, rows = flatten_batch(batch, columns)
+            yield columns, rows
+            batch = []
+    if batch:
+        yield flatten_batch(batch, columns)
+
+
+def export_csv(batches):
+    buffer = io.StringIO()
+    writer = None
+    for columns, rows in batches:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=columns)
+            writer.writeheader()
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+class ChunkSink(io.RawIOBase):
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def load_pyarrow():
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            return False
+        pa, pq = pyarrow, pyarrow.parquet
+    return True
+
+
+# one parquet row group per batch, bytes are sent as soon as a group is written
+def export_parquet(batches):
+    sink = ChunkSink()
+    writer = None
+    for columns, rows in batches:
+        if writer is None:
+            schema = pa.schema([(column, pa.string()) for column in columns])
+            writer = pq.ParquetWriter(sink, schema)
+        writer.write_table(pa.Table.from_pylist(
+            [{column: None if value is None else str(value) for column, value in row.items()} for row in rows],
+            schema=schema))
+        yield sink.drain()
+    if writer is not None:
+        writer.close()
+        yield sink.drain()
+
+
+@bulk_bp.route('/<kind>', methods=['GET'])
+@reads_from('reports')
+def bulk_export(kind):
+    try:
+        collection = BULK_COLLECTIONS.get(kind)
+        if not collection:
+            return jsonify({'status': 'error', 'message': f'Unknown collection {kind}'}), 404
+        export_format = request.args.get('format', 'csv')
+        projection = build_projection(request.args.get('fields'))
+        hidden = EXPORT_HIDDEN_FIELDS.get(collection, ())
+        columns = None
+        if projection:
+            # an empty projection would return every field
+            projection = {field: 1 for field in projection if field not in hidden} or {'_id': 1}
+            columns = ['_id'] + [field for field in projection if field != '_id']
+        elif hidden:
+            projection = {field: 0 for field in hidden}
+        batches = export_batches(db[collection].find({}, projection).batch_size(STREAM_BATCH_SIZE), columns)
+
+        if export_format == 'csv':
+            body, mimetype = export_csv(batches), 'text/csv'
+        elif export_format == 'parquet':
+            if not load_pyarrow():
+                return jsonify({'status': 'error', 'message': 'Parquet export needs pyarrow installed'}), 400
+            body, mimetype = export_parquet(batches), 'application/vnd.apache.parquet'
+        elif export_format == 'ndjson':
+            body, mimetype = (''.join(json.dumps(row) + '\n' for row in rows) for _, rows in batches), NDJSON_MIMETYPE
+        else:
+            return jsonify({'status': 'error', 'message': f'Unknown export format {export_format}'}), 400
+        headers = {'Content-Disposition': f'attachment; filename={kind}.{export_format}'}
+        return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
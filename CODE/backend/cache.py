@@ -0,0 +1,113 @@
+import copy
+import os
+import threading
+import bson
+from cachetools import TTLCache
+from flask import current_app
+from werkzeug.local import LocalProxy
+
+DEFAULT_TTL_SECONDS = 60
+DEFAULT_MAX_SIZE = 10000
+
+
+# in-process TTL/LRU store, each worker keeps its own copy
+class MemoryBackend:
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL_SECONDS):
+        self.lock = threading.Lock()
+        self.store = TTLCache(maxsize=max_size, ttl=ttl)
+        self.versions = {}
+
+    def get(self, key):
+        with self.lock:
+            return self.store.get(key)
+
+    def set(self, key, value):
+        with self.lock:
+            self.store[key] = value
+
+    def version(self, collection):
+        return self.versions.get(collection, 0)
+
+    def bump(self, collection):
+        with self.lock:
+            self.versions[collection] = self.versions.get(collection, 0) + 1
+
+
+# shared store for every worker, takes any redis-py compatible client (fakeredis in tests)
+class RedisBackend:
+    def __init__(self, client, ttl=DEFAULT_TTL_SECONDS, prefix='hms:cache:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return bson.decode(raw) if raw else None
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, bson.encode(value), ex=self.ttl)
+
+    def version(self, collection):
+        return int(self.client.get(f'{self.prefix}version:{collection}') or 0)
+
+    def bump(self, collection):
+        self.client.incr(f'{self.prefix}version:{collection}')
+
+
+class Cache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # keys carry the collection version, so a write drops every cached lookup of that collection
+    def key(self, collection, name, objectId, email):
+        return f'{collection}:{self.backend.version(collection)}:{name or ""}:{objectId or ""}:{email or ""}'
+
+    def get_or_load(self, key, loader):
+        document = self.backend.get(key)
+        with self.lock:
+            if document is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if document is None:
+            document = loader()
+            if document is None:
+                return None
+            self.backend.set(key, copy.deepcopy(document))
+            return document
+        # callers may modify what they get back, never hand out the cached dict
+        return copy.deepcopy(document)
+
+    def find_one(self, collection, loader, name=None, objectId=None, email=None):
+        return self.get_or_load(self.key(collection, name, objectId, email), loader)
+
+    def invalidate(self, collection):
+        self.backend.bump(collection)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'backend': type(self.backend).__name__}
+
+
+def create_backend(app):
+    ttl = int(app.config.get('CACHE_TTL_SECONDS', os.getenv('CACHE_TTL_SECONDS', DEFAULT_TTL_SECONDS)))
+    redis_url = app.config.get('CACHE_REDIS_URL', os.getenv('CACHE_REDIS_URL'))
+    if redis_url:
+        import redis
+        return RedisBackend(redis.Redis.from_url(redis_url), ttl=ttl)
+    max_size = int(app.config.get('CACHE_MAX_SIZE', os.getenv('CACHE_MAX_SIZE', DEFAULT_MAX_SIZE)))
+    return MemoryBackend(max_size=max_size, ttl=ttl)
+
+
+def init_cache(app, backend=None):
+    app.extensions['cache'] = Cache(backend or create_backend(app))
+
+
+def get_cache():
+    return current_app.extensions['cache']
+
+
+cache = LocalProxy(get_cache)
@@ -0,0 +1,171 @@
+import atexit
+import os
+import threading
+from flask import current_app
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from werkzeug.local import LocalProxy
+from database import db
+from cache import cache
+from sync import versioned_write, SYNC_FIELD
+
+# off: every update is written by its request. sync: requests wait until the bulk write holding their
+# update is acknowledged. batched: requests return once the update is buffered, a crash loses the
+# last window of updates.
+COALESCING_MODES = ('off', 'sync', 'batched')
+DEFAULT_WINDOW_MS = 20
+DEFAULT_MAX_BATCH = 500
+SYNC_ACK_TIMEOUT_SECONDS = 10
+DUPLICATE_KEY_CODE = 11000
+
+
+class PendingWrite:
+    def __init__(self):
+        self.done = threading.Event()
+        self.error = None
+
+    def wait(self):
+        if not self.done.wait(SYNC_ACK_TIMEOUT_SECONDS):
+            raise TimeoutError('Update was not acknowledged in time')
+        if self.error is not None:
+            raise self.error
+
+
+class WriteCoalescer:
+    def __init__(self, app, mode='off', window_ms=DEFAULT_WINDOW_MS, max_batch=DEFAULT_MAX_BATCH):
+        if mode not in COALESCING_MODES:
+            raise ValueError(f'WRITE_COALESCING must be one of {", ".join(COALESCING_MODES)}')
+        self.app = app
+        self.mode = mode
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake_event = threading.Event()
+        # (collection, filter) -> merged update, kept in the order of each document's latest update
+        self.pending = {}
+        self.pid = None
+        self.updates = 0
+        self.operations = 0
+        self.flushes = 0
+
+    # $set the fields on the document matching query; later updates of a document win
+    def update(self, collection, query, fields):
+        if self.mode == 'off':
+            with versioned_write(collection) as version:
+                fields[SYNC_FIELD] = version
+                db[collection].update_one(query, {'$set': fields})
+            return
+        self.ensure_started()
+        key = (collection, tuple(sorted(query.items())))
+        waiter = PendingWrite() if self.mode == 'sync' else None
+        with self.lock:
+            entry = self.pending.pop(key, None) or {'collection': collection, 'query': query, 'fields': {},
+                                                    'waiters': []}
+            entry['fields'].update(fields)
+            if waiter:
+                entry['waiters'].append(waiter)
+            self.pending[key] = entry
+            self.updates += 1
+            full = len(self.pending) >= self.max_batch
+        if full:
+            self.wake_event.set()
+        if waiter:
+            waiter.wait()
+
+    # the flusher thread never survives a fork, every process starts its own on first use
+    def ensure_started(self):
+        if self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.pending = {}
+                    threading.Thread(target=self.run, daemon=True, name='write-coalescer').start()
+                    if self.pid is None:
+                        atexit.register(self.flush)
+                    self.pid = os.getpid()
+
+    def run(self):
+        while True:
+            self.wake_event.wait(self.window)
+            self.wake_event.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.app.logger.warning('Flushing coalesced updates failed: %s', e)
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                entries = list(self.pending.values())
+                self.pending = {}
+            if not entries:
+                return
+            with self.app.app_context():
+                for collection in dict.fromkeys(entry['collection'] for entry in entries):
+                    batch = [entry for entry in entries if entry['collection'] == collection]
+                    try:
+                        self.write(collection, batch)
+                    except Exception as e:
+                        self.app.logger.warning('Coalesced updates of %s failed: %s', collection, e)
+                        release_waiters(batch, e)
+            with self.lock:
+                self.flushes += 1
+                self.operations += len(entries)
+
+    # ordered, so documents matched by two different filters still end with the latest update
+    def write(self, collection, entries):
+        errors = {}
+        with versioned_write(collection) as version:
+            operations = [UpdateOne(entry['query'], {'$set': {**entry['fields'], SYNC_FIELD: version}})
+                          for entry in entries]
+            start = 0
+            while start < len(operations):
+                try:
+                    db[collection].bulk_write(operations[start:], ordered=True)
+                    break
+                except BulkWriteError as e:
+                    # an ordered bulk write stops at its first error, carry on after it
+                    write_error = e.details['writeErrors'][0]
+                    failed = start + write_error['index']
+                    # waiters of a duplicate key see the same error an unbatched update_one raises
+                    if write_error.get('code') == DUPLICATE_KEY_CODE:
+                        errors[failed] = DuplicateKeyError(write_error['errmsg'], DUPLICATE_KEY_CODE)
+                    else:
+                        errors[failed] = Exception(write_error['errmsg'])
+                    start = failed + 1
+                except Exception as e:
+                    for position in range(start, len(operations)):
+                        errors[position] = e
+                    break
+        cache.invalidate(collection)
+        for position, entry in enumerate(entries):
+            error = errors.get(position)
+            if error is not None and not entry['waiters']:
+                self.app.logger.warning('Coalesced update of %s %s failed: %s', collection, entry['query'], error)
+            release_waiters([entry], error)
+
+    def stats(self):
+        with self.lock:
+            return {'mode': self.mode, 'updates': self.updates, 'operations': self.operations,
+                    'flushes': self.flushes, 'pending': len(self.pending)}
+
+
+def release_waiters(entries, error=None):
+    for entry in entries:
+        for waiter in entry['waiters']:
+            waiter.error = error
+            waiter.done.set()
+
+
+def init_writes(app):
+    setting = lambda key, default: app.config.get(key, os.getenv(key, default))
+    app.extensions['writes'] = WriteCoalescer(app, setting('WRITE_COALESCING', 'off'),
+                                              int(setting('WRITE_COALESCING_WINDOW_MS', DEFAULT_WINDOW_MS)),
+                                              int(setting('WRITE_COALESCING_MAX_BATCH', DEFAULT_MAX_BATCH)))
+
+
+def get_writes():
+    return current_app.extensions['writes']
+
+
+writes = LocalProxy(get_writes)
@@ -0,0 +1,151 @@
+import base64
+from datetime import datetime
+from functools import partial, wraps
+import bson
+from bson.errors import InvalidBSON
+from flask import current_app, g, jsonify, request
+from database import DB_NAME, READ_CLASS_SETTINGS, database_for, get_client, read_preference
+
+# a write response carries the cluster time it reached; sending it back on a read makes that read wait
+# until the secondary serving it has caught up, so the UI sees its own writes
+CAUSAL_HEADER = 'X-Causal-Token'
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+# collection calls that take the request's causal session, writes always go to the primary anyway;
+# estimated_document_count reads collection metadata and refuses a session
+SESSION_METHODS = ('find', 'find_one', 'find_raw_batches', 'aggregate', 'aggregate_raw_batches',
+                   'count_documents', 'distinct')
+PROBE_COLLECTION = 'read_routing_probe'
+
+
+class CausalTokenError(ValueError):
+    pass
+
+
+def encode_token(session):
+    # standalone servers have no cluster time, there is nothing to wait for
+    if session.operation_time is None or session.cluster_time is None:
+        return None
+    raw = bson.encode({'operation_time': session.operation_time, 'cluster_time': session.cluster_time})
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_token(token):
+    try:
+        fields = bson.decode(base64.urlsafe_b64decode(token.encode()))
+        return fields['operation_time'], fields['cluster_time']
+    except (ValueError, KeyError, InvalidBSON):
+        raise CausalTokenError('Invalid causal token')
+
+
+def causal_session(token=None):
+    operation_time, cluster_time = decode_token(token) if token else (None, None)
+    session = get_client().start_session(causal_consistency=True)
+    if token:
+        session.advance_cluster_time(cluster_time)
+        session.advance_operation_time(operation_time)
+    return session
+
+
+class CausalCollection:
+    def __init__(self, collection, session):
+        self.collection = collection
+        self.session = session
+
+    def __getattr__(self, name):
+        attribute = getattr(self.collection, name)
+        return partial(attribute, session=self.session) if name in SESSION_METHODS else attribute
+
+
+# hands the request's session to every read, so routes need no session= arguments
+class CausalDatabase:
+    def __init__(self, database, session):
+        self.database = database
+        self.session = session
+
+    def __getitem__(self, name):
+        return CausalCollection(self.database[name], self.session)
+
+    def __getattr__(self, name):
+        return CausalCollection(self.database[name], self.session)
+
+
+# route decorator: the route's reads follow the read preference of its class ('lists', 'reports' or
+# 'primary'). Off the primary they share one causal session, so a later read never sees an older member
+# than an earlier one (the data is never behind its ETag versions) and a token from a write is honoured.
+def reads_from(read_class):
+    def decorate(view):
+        @wraps(view)
+        def route(*args, **kwargs):
+            database = database_for(read_class)
+            if database.read_preference.mode != 0:
+                try:
+                    session = causal_session(request.headers.get(CAUSAL_HEADER))
+                except CausalTokenError as e:
+                    return jsonify({'status': 'error', 'message': str(e)}), 400
+                g.causal_session = session
+                database = CausalDatabase(database, session)
+            g.db = database
+            return view(*args, **kwargs)
+        return route
+    return decorate
+
+
+def end_causal_session(exception=None):
+    session = g.pop('causal_session', None)
+    if session is not None:
+        session.end_session()
+
+
+# a ping on the primary after the write returns an operation time at or past it
+def issue_causal_token(response):
+    if request.method not in WRITE_METHODS or response.status_code >= 400:
+        return response
+    try:
+        with get_client().start_session(causal_consistency=True) as session:
+            get_client().admin.command('ping', session=session)
+            token = encode_token(session)
+    except Exception as e:
+        current_app.logger.warning('Issuing a causal token failed: %s', e)
+        return response
+    if token:
+        response.headers[CAUSAL_HEADER] = token
+    return response
+
+
+def secondary_reads(app):
+    return [read_class for read_class in READ_CLASS_SETTINGS if read_preference(app, read_class).mode != 0]
+
+
+def init_consistency(app):
+    app.teardown_request(end_causal_session)
+    # tokens cost a round trip per write, they are only issued when some reads can lag behind
+    if secondary_reads(app):
+        app.after_request(issue_causal_token)
+
+
+# against a replica set, even a single node one: write, then read back through every read class
+def check_read_routing(app):
+    with app.app_context():
+        client = get_client()
+        hello = client.admin.command('hello')
+        report = {'replica_set': hello.get('setName'), 'primary': hello.get('primary'),
+                  'secondaries': [host for host in hello.get('hosts', []) if host != hello.get('primary')]}
+        report['read_preferences'] = {read_class: read_preference(app, read_class).document
+                                      for read_class in list(READ_CLASS_SETTINGS) + ['primary']}
+        with client.start_session(causal_consistency=True) as session:
+            probe_id = client[DB_NAME][PROBE_COLLECTION].insert_one({'written_at': datetime.utcnow()},
+                                                                    session=session).inserted_id
+            token = encode_token(session)
+        report['causal_token'] = token is not None
+        try:
+            for read_class in READ_CLASS_SETTINGS:
+                database = database_for(read_class)
+                if token:
+                    with causal_session(token) as session:
+                        found = database[PROBE_COLLECTION].find_one({'_id': probe_id}, session=session)
+                else:
+                    found = database[PROBE_COLLECTION].find_one({'_id': probe_id})
+                report[f'{read_class}_read_your_write'] = found is not None
+        finally:
+            client[DB_NAME][PROBE_COLLECTION].delete_one({'_id': probe_id})
+        return report
@@ -0,0 +1,78 @@
+import time
+from datetime import datetime, timedelta
+from flask import Blueprint, jsonify
+from database import db
+from consistency import reads_from
+from cache import cache
+
+dashboard_bp = Blueprint('dashboard', __name__)
+
+# the summary is shared by every dashboard view for this long
+SUMMARY_TTL_SECONDS = 10
+RECENT_LIMIT = 5
+TODAY_LIMIT = 50
+TOP_DOCTORS_LIMIT = 10
+
+APPOINTMENT_FIELDS = {'patient_name': 1, 'doctor_name': 1, 'patient_id': 1, 'doctor_id': 1,
+                      'appointment_time': 1, 'duration_minutes': 1, 'reason': 1}
+PERSON_FIELDS = {'name': 1, 'email': 1, 'department': 1, 'specialization': 1, 'age': 1, 'gender': 1}
+
+
+def appointment_facets(day_start, day_end):
+    today = {'appointment_time': {'$gte': day_start, '$lt': day_end}}
+    return [{'$facet': {
+        'today': [
+            {'$match': today},
+            {'$sort': {'appointment_time': 1}},
+            {'$limit': TODAY_LIMIT},
+            {'$project': APPOINTMENT_FIELDS},
+        ],
+        'today_count': [{'$match': today}, {'$count': 'count'}],
+        'doctor_load': [
+            {'$match': {'appointment_time': {'$gte': day_start}, 'doctor_id': {'$ne': None}}},
+            {'$group': {'_id': '$doctor_id', 'doctor_name': {'$first': '$doctor_name'}, 'upcoming': {'$sum': 1},
+                        'today': {'$sum': {'$cond': [{'$lt': ['$appointment_time', day_end]}, 1, 0]}}}},
+            {'$sort': {'upcoming': -1}},
+            {'$limit': TOP_DOCTORS_LIMIT},
+        ],
+        'recent': [
+            {'$sort': {'_id': -1}},
+            {'$limit': RECENT_LIMIT},
+            {'$project': APPOINTMENT_FIELDS},
+        ],
+    }}]
+
+
+def build_summary():
+    day_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    facets = next(db.appointment.aggregate(appointment_facets(day_start, day_start + timedelta(days=1))))
+    return {
+        'totals': {
+            'patients': db.patient.estimated_document_count(),
+            'doctors': db.doctor.estimated_document_count(),
+            'nurses': db.nurse.estimated_document_count(),
+            'appointments': db.appointment.estimated_document_count(),
+        },
+        'today': {
+            'count': facets['today_count'][0]['count'] if facets['today_count'] else 0,
+            'appointments': facets['today'],
+        },
+        'doctor_load': facets['doctor_load'],
+        'recent': {
+            'appointments': facets['recent'],
+            'patients': list(db.patient.find({}, PERSON_FIELDS).sort('_id', -1).limit(RECENT_LIMIT)),
+        },
+        'generated_at': datetime.now(),
+    }
+
+
+@dashboard_bp.route('/summary', methods=['GET'])
+@reads_from('reports')
+def get_summary():
+    try:
+        # one cache entry per time bucket, so the summary expires independently of the cache TTL
+        key = f'dashboard:summary:{int(time.time() // SUMMARY_TTL_SECONDS)}'
+        summary = cache.get_or_load(key, build_summary)
+        return jsonify({'status': 'success', 'summary': summary})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
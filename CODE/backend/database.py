@@ -0,0 +1,214 @@
+import os
+import threading
+from flask import current_app, g
+from pymongo import MongoClient, monitoring
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+from werkzeug.local import LocalProxy
+
+DB_NAME = 'HospitalManagement'
+
+# defaults for the shared client, each one can be overridden by app.config or the environment
+MONGO_DEFAULTS = {
+    'MONGO_URI': None,
+    'MONGO_MAX_POOL_SIZE': 100,
+    'MONGO_MIN_POOL_SIZE': 0,
+    'MONGO_MAX_IDLE_TIME_MS': None,
+    'MONGO_CONNECT_TIMEOUT_MS': 20000,
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': 30000,
+    'MONGO_SOCKET_TIMEOUT_MS': None,
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': None,
+    'MONGO_READ_PREFERENCE': 'primary',
+    'MONGO_LIST_READ_PREFERENCE': None,
+    'MONGO_REPORT_READ_PREFERENCE': None,
+    'MONGO_MAX_STALENESS_SECONDS': None,
+    'MONGO_WRITE_CONCERN': None,
+}
+
+READ_MODES = {'primary': Primary, 'primaryPreferred': PrimaryPreferred, 'secondary': Secondary,
+              'secondaryPreferred': SecondaryPreferred, 'nearest': Nearest}
+# route read class -> its setting; unset ones follow MONGO_READ_PREFERENCE, 'primary' routes never move
+READ_CLASS_SETTINGS = {'lists': 'MONGO_LIST_READ_PREFERENCE', 'reports': 'MONGO_REPORT_READ_PREFERENCE'}
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {'pools': 0, 'created': 0, 'closed': 0, 'checked_out': 0,
+                      'check_out_failed': 0, 'in_use': 0, 'cleared': 0}
+
+    def increment(self, *counters, in_use=0):
+        with self.lock:
+            for counter in counters:
+                self.stats[counter] += 1
+            self.stats['in_use'] += in_use
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def pool_created(self, event):
+        self.increment('pools')
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self.increment('cleared')
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.increment('created')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.increment('closed')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self.increment('check_out_failed')
+
+    def connection_checked_out(self, event):
+        self.increment('checked_out', in_use=1)
+
+    def connection_checked_in(self, event):
+        self.increment(in_use=-1)
+
+
+def config_value(app, key):
+    value = app.config.get(key, os.getenv(key, MONGO_DEFAULTS[key]))
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return value
+
+
+def client_options(app, listener):
+    options = {
+        'maxPoolSize': config_value(app, 'MONGO_MAX_POOL_SIZE'),
+        'minPoolSize': config_value(app, 'MONGO_MIN_POOL_SIZE'),
+        'maxIdleTimeMS': config_value(app, 'MONGO_MAX_IDLE_TIME_MS'),
+        'connectTimeoutMS': config_value(app, 'MONGO_CONNECT_TIMEOUT_MS'),
+        'serverSelectionTimeoutMS': config_value(app, 'MONGO_SERVER_SELECTION_TIMEOUT_MS'),
+        'socketTimeoutMS': config_value(app, 'MONGO_SOCKET_TIMEOUT_MS'),
+        'waitQueueTimeoutMS': config_value(app, 'MONGO_WAIT_QUEUE_TIMEOUT_MS'),
+        'readPreference': config_value(app, 'MONGO_READ_PREFERENCE'),
+        'event_listeners': [listener],
+    }
+    staleness = config_value(app, 'MONGO_MAX_STALENESS_SECONDS')
+    if staleness is not None and options['readPreference'] != 'primary':
+        options['maxStalenessSeconds'] = staleness
+    write_concern = config_value(app, 'MONGO_WRITE_CONCERN')
+    if write_concern is not None:
+        options['w'] = write_concern
+    return options
+
+
+# maxStaleness must be at least 90 seconds and cannot be combined with primary
+def read_preference(app, read_class):
+    if read_class == 'primary':
+        return Primary()
+    mode = config_value(app, READ_CLASS_SETTINGS[read_class]) or config_value(app, 'MONGO_READ_PREFERENCE')
+    if mode not in READ_MODES:
+        raise ValueError(f'Unknown read preference {mode}')
+    staleness = config_value(app, 'MONGO_MAX_STALENESS_SECONDS')
+    if mode == 'primary':
+        return Primary()
+    return READ_MODES[mode](max_staleness=-1 if staleness is None else staleness)
+
+
+def create_client(app, listener):
+    return MongoClient(config_value(app, 'MONGO_URI'), **client_options(app, listener))
+
+
+class MongoState:
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.listener = PoolStatsListener()
+        self.client = None
+        self.pid = None
+        # pid of the process running a warm-up, a forked worker does not inherit the thread
+        self.warming_pid = None
+
+    # a client must never cross a fork, so pre-fork workers build their own on first use
+    def get_client(self):
+        if self.client is None or self.pid != os.getpid():
+            with self.lock:
+                if self.client is None or self.pid != os.getpid():
+                    self.listener = PoolStatsListener()
+                    self.client = create_client(self.app, self.listener)
+                    self.pid = os.getpid()
+        return self.client
+
+    # building the client resolves the SRV/TXT records, the ping selects a server and opens the first
+    # connection; minPoolSize connections are then filled in by pymongo's own background task
+    def ping(self):
+        self.get_client().admin.command('ping')
+
+    def warm_up(self):
+        try:
+            self.ping()
+        except Exception as e:
+            self.app.logger.warning('Warming up the MongoDB pool failed: %s', e)
+        finally:
+            self.warming_pid = None
+
+    def close(self):
+        with self.lock:
+            if self.client is not None and self.pid == os.getpid():
+                self.client.close()
+            self.client = None
+
+
+def init_db(app):
+    app.extensions['mongo'] = MongoState(app)
+
+
+# off the startup path, the first request finds a connected pool instead of paying for it
+def warm_up_in_background(app):
+    state = app.extensions['mongo']
+    state.warming_pid = os.getpid()
+    threading.Thread(target=state.warm_up, daemon=True, name='mongo-warm-up').start()
+
+
+# (ready, reason); while the warm-up runs the probe answers at once instead of queueing behind it
+def readiness():
+    state = current_app.extensions['mongo']
+    if state.warming_pid == os.getpid():
+        return False, 'Connecting to MongoDB'
+    try:
+        state.ping()
+    except Exception as e:
+        return False, str(e)
+    return True, None
+
+
+def get_client():
+    return current_app.extensions['mongo'].get_client()
+
+
+def database_for(read_class):
+    return get_client()[DB_NAME].with_options(read_preference=read_preference(current_app, read_class))
+
+
+def get_db():
+    if 'db' not in g:
+        g.db = get_client()[DB_NAME]
+    return g.db
+
+
+def get_pool_stats():
+    state = current_app.extensions['mongo']
+    stats = state.listener.snapshot()
+    stats['max_pool_size'] = config_value(state.app, 'MONGO_MAX_POOL_SIZE')
+    stats['pid'] = state.pid
+    return stats
+
+
+# blueprints keep using `db.<collection>`, resolved against the app-scoped client per request
+db = LocalProxy(get_db)
@@ -1,28 +1,105 @@
-from flask import Blueprint, jsonify
+import threading
+from datetime import datetime
+from flask import Blueprint, jsonify, current_app
+from database import db, get_client, DB_NAME
+from consistency import reads_from
 
 department_bp = Blueprint('department_bp', __name__)
 
 departments = [
-    { "index": "DEPT01", "name": 'Cardiology', "staffs": 20, "appointments": 150 },
-    { "index": "DEPT02", "name": 'Neurology', "staffs": 15, "appointments": 120 },
-    { "index": "DEPT03", "name": 'Orthopedics', "staffs": 18, "appointments": 130 },
-    { "index": "DEPT04", "name": 'Pediatrics', "staffs": 25, "appointments": 170 },
-    { "index": "DEPT05", "name": 'Dermatology', "staffs": 12, "appointments": 100 },
-    { "index": "DEPT06", "name": 'Oncology', "staffs": 22, "appointments": 160 },
-    { "index": "DEPT07", "name": 'Gynecology', "staffs": 17, "appointments": 140 },
+    { "index": "DEPT01", "name": 'Cardiology' },
+    { "index": "DEPT02", "name": 'Neurology' },
+    { "index": "DEPT03", "name": 'Orthopedics' },
+    { "index": "DEPT04", "name": 'Pediatrics' },
+    { "index": "DEPT05", "name": 'Dermatology' },
+    { "index": "DEPT06", "name": 'Oncology' },
+    { "index": "DEPT07", "name": 'Gynecology' },
 ]
 
-def format_department_data(department):
+# how old db.department_stats may get before a read triggers a background refresh
+REFRESH_SECONDS = 60
+refresh_lock = threading.Lock()
+
+
+# staff are doctors and nurses by department, appointments count towards their doctor's department
+def department_stats_pipeline():
+    return [
+        {'$project': {'department': 1, 'kind': {'$literal': 'staff'}}},
+        {'$unionWith': {'coll': 'nurse', 'pipeline': [{'$project': {'department': 1, 'kind': {'$literal': 'staff'}}}]}},
+        {'$unionWith': {'coll': 'appointment', 'pipeline': [
+            {'$lookup': {'from': 'doctor', 'localField': 'doctor_id', 'foreignField': '_id', 'as': 'doctor'}},
+            {'$project': {'department': {'$first': '$doctor.department'}, 'kind': {'$literal': 'appointment'}}},
+        ]}},
+        {'$match': {'department': {'$type': 'string'}}},
+        {'$group': {
+            '_id': '$department',
+            'staffs': {'$sum': {'$cond': [{'$eq': ['$kind', 'staff']}, 1, 0]}},
+            'appointments': {'$sum': {'$cond': [{'$eq': ['$kind', 'appointment']}, 1, 0]}},
+        }},
+    ]
+
+
+# from-scratch counts, department name -> (staffs, appointments)
+def compute_department_stats(database):
+    return {stats['_id']: (stats['staffs'], stats['appointments'])
+            for stats in database.doctor.aggregate(department_stats_pipeline())}
+
+
+# rebuild the materialized db.department_stats collection server side
+def refresh_department_stats(database):
+    run_at = datetime.utcnow()
+    pipeline = department_stats_pipeline() + [
+        {'$set': {'refreshed_at': run_at}},
+        {'$merge': {'into': 'department_stats', 'whenMatched': 'replace', 'whenNotMatched': 'insert'}},
+    ]
+    database.doctor.aggregate(pipeline)
+    # departments that no longer have any staff or appointments
+    database.department_stats.delete_many({'refreshed_at': {'$lt': run_at}})
+
+
+def refresh_in_background(app):
+    def run():
+        try:
+            with app.app_context():
+                refresh_department_stats(get_client()[DB_NAME])
+        except Exception as e:
+            app.logger.warning('Department stats refresh failed: %s', e)
+        finally:
+            refresh_lock.release()
+
+    if refresh_lock.acquire(blocking=False):
+        threading.Thread(target=run, daemon=True, name='department-stats').start()
+
+
+def load_department_stats():
+    stats = list(db.department_stats.find())
+    if not stats:
+        refresh_department_stats(db)
+        stats = list(db.department_stats.find())
+    elif (datetime.utcnow() - min(s['refreshed_at'] for s in stats)).total_seconds() > REFRESH_SECONDS:
+        refresh_in_background(current_app._get_current_object())
+    return {s['_id']: s for s in stats}
+
+
+def format_department_data(department, stats):
     formatted_department = {
         "id": department["index"],
         "name": department["name"],
-        "staffs": department["staffs"],
-        "appointments": department["appointments"]
+        "staffs": stats.get("staffs", 0),
+        "appointments": stats.get("appointments", 0)
     }
     return formatted_department
 
 @department_bp.route('/getDetails', methods=['GET'])
+@reads_from('reports')
 def get_department_details():
-    formatted_departments = [format_department_data(department) for department in departments]
-    return jsonify({'departments': formatted_departments})
-
+    try:
+        stats = load_department_stats()
+        known = {department["name"] for department in departments}
+        catalog = departments + [{"index": f"DEPT{len(departments) + i:02d}", "name": name}
+                                 for i, name in enumerate(sorted(set(stats) - known), start=1)]
+        formatted_departments = [format_department_data(department, stats.get(department["name"], {}))
+                                 for department in catalog]
+        return jsonify({'departments': formatted_departments})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -1,18 +1,64 @@
-from flask import Blueprint, request, jsonify
-from functions import convert_id, build_query, connect_to_database
-from werkzeug.security import check_password_hash
+from flask import Blueprint, g, request, jsonify
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+from functions import build_query, wants_stream, stream_documents, \
+    STREAM_BATCH_SIZE
+from database import db
+from consistency import reads_from
+from name_index import doctor_names
+from cache import cache
+from jobs import enqueue
+from coalescer import writes
+from search import run_search, SearchError
+from sync import current_versions, delta, is_not_modified, list_etag, not_modified, record_deletion, \
+    parse_sync_token, versioned_write, with_etag, SYNC_FIELD
+from auth import hash_password, verify_password, issue_token, revocation_list
 
 doctor_bp = Blueprint('doctor', __name__)
-db = connect_to_database()
+
+# password hashes never leave the backend
+HIDE_PASSWORD = {'password': 0}
+# the doctor_email index keeps non-empty emails unique
+DUPLICATE_EMAIL = 'A doctor with this email already exists'
 
 
 # Routes for Doctors
 @doctor_bp.route('/', methods=['GET'])
+@reads_from('lists')
 def get_doctors():
     try:
-        doctors = list(db.doctor.find())
-        doctors = [convert_id(doctor) for doctor in doctors]
-        return jsonify({'status': 'success', 'doctors': doctors})
+        versions = current_versions(['doctor'])
+        etag = list_etag(versions)
+        if is_not_modified(etag):
+            return not_modified(etag)
+        since = request.args.get('since')
+        if since is not None:
+            version = parse_sync_token(since)
+            if version is None:
+                return jsonify({'status': 'error', 'message': 'since must be a sync_token from /doctor/'}), 400
+            doctors, deleted = delta('doctor', version, HIDE_PASSWORD)
+            return with_etag(jsonify({'status': 'success', 'doctors': list(doctors), 'deleted': deleted,
+                                      'sync_token': versions['doctor']}), etag)
+        if wants_stream():
+            return with_etag(stream_documents(db.doctor.find({}, HIDE_PASSWORD).batch_size(STREAM_BATCH_SIZE)), etag)
+        doctors = list(db.doctor.find({}, HIDE_PASSWORD))
+        return with_etag(jsonify({'status': 'success', 'doctors': doctors, 'sync_token': versions['doctor']}), etag)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@doctor_bp.route('/search', methods=['GET'])
+@reads_from('lists')
+def search_doctors():
+    try:
+        versions = current_versions(['doctor'])
+        etag = list_etag(versions)
+        if is_not_modified(etag):
+            return not_modified(etag)
+        doctors, next_after = run_search('doctor', request.args, hidden_fields=('password',))
+        return with_etag(jsonify({'status': 'success', 'doctors': doctors, 'next_after': next_after}), etag)
+    except SearchError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -21,30 +67,55 @@ def get_doctors():
 def add_doctor():
     try:
         new_doctor_data = request.json
-        result = db.doctor.insert_one(new_doctor_data)
+        if new_doctor_data.get('password'):
+            new_doctor_data['password'] = hash_password(new_doctor_data['password'])
+        with versioned_write('doctor') as version:
+            new_doctor_data[SYNC_FIELD] = version
+            result = db.doctor.insert_one(new_doctor_data)
+        doctor_names.add(result.inserted_id, new_doctor_data.get('name'))
         inserted_id = str(result.inserted_id)
         new_doctor_data['_id'] = inserted_id
+        new_doctor_data.pop('password', None)
         return jsonify({'status': 'success', 'message': 'Doctor added', 'doctor': new_doctor_data})
+    except DuplicateKeyError:
+        return jsonify({'status': 'error', 'message': DUPLICATE_EMAIL}), 409
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
 @doctor_bp.route('/login', methods=['POST'])
+@reads_from('primary')
 def doctor_login():
     try:
         request_data = request.json
         email = request_data.get('email')
         password = request_data.get('password')
         doctor = db.doctor.find_one({"email": email})
-        if password == doctor["password"]:
-            doctor = convert_id(doctor)
-            return jsonify({'status': 'success', 'message': 'Doctor logged in', 'doctor': doctor}), 200
+        matches, needs_rehash = verify_password(doctor.get('password') if doctor else None, password)
+        if matches:
+            if needs_rehash:
+                db.doctor.update_one({'_id': doctor['_id']}, {'$set': {'password': hash_password(password)}})
+            doctor.pop('password', None)
+            token = issue_token(doctor)
+            return jsonify({'status': 'success', 'message': 'Doctor logged in', 'doctor': doctor, 'token': token}), 200
         else:
             return jsonify({'status': 'error', 'message': 'Invalid email or password'}), 401
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
 
+@doctor_bp.route('/logout', methods=['POST'])
+def doctor_logout():
+    try:
+        claims = g.get('auth_claims')
+        if not claims:
+            return jsonify({'status': 'error', 'message': 'Not logged in'}), 401
+        revocation_list.revoke(claims['jti'])
+        return jsonify({'status': 'success', 'message': 'Doctor logged out'})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
 @doctor_bp.route('/get_doctor_info', methods=['POST'])
 def get_doctor_info():
     try:
@@ -55,9 +126,10 @@ def get_doctor_info():
         if not doctor_name and not doctor_id and not doctor_email:
             return jsonify({'status': 'error', 'message': 'Doctor name or ObjectId or email not provided'}), 400
         query = build_query(name=doctor_name, objectId=doctor_id, email=doctor_email)
-        doctor = db.doctor.find_one(query)
+        # extra.find_doctor_by_name shares these cache keys, so no cached doctor may carry the hash
+        doctor = cache.find_one('doctor', lambda: db.doctor.find_one(query, HIDE_PASSWORD),
+                                name=doctor_name, objectId=doctor_id, email=doctor_email)
         if doctor:
-            doctor = convert_id(doctor)
             return jsonify({'status': 'success', 'doctor': doctor})
         else:
             return jsonify({'status': 'error', 'message': 'Doctor not found'}), 404
@@ -74,8 +146,15 @@ def update_doctor():
         if not doctor_name and not doctor_id:
             return jsonify({'status': 'error', 'message': 'Doctor name or ObjectId not provided'}), 400
         query = build_query(name=doctor_name, objectId=doctor_id, email=None)
-        db.doctor.update_one(query, {"$set": updated_data})
+        if updated_data.get('password'):
+            updated_data['password'] = hash_password(updated_data['password'])
+        writes.update('doctor', query, updated_data)
+        if doctor_id and doctor_name:
+            doctor_names.add(ObjectId(doctor_id), doctor_name)
+        cache.invalidate('doctor')
         return jsonify({'status': 'success', 'message': 'Doctor updated'})
+    except DuplicateKeyError:
+        return jsonify({'status': 'error', 'message': DUPLICATE_EMAIL}), 409
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -90,9 +169,16 @@ def delete_doctor():
         if not doctor_name and not doctor_id and not doctor_email:
             return jsonify({'status': 'error', 'message': 'Doctor name or ObjectId or email not provided'}), 400
         query = build_query(name=doctor_name, objectId=doctor_id, email=doctor_email)
-        result = db.doctor.delete_one(query)
-        if result.deleted_count == 1:
-            return jsonify({'status': 'success', 'message': 'Doctor deleted'})
+        deleted = db.doctor.find_one_and_delete(query, {'_id': 1})
+        if deleted:
+            with versioned_write('doctor') as version:
+                record_deletion('doctor', deleted['_id'], version)
+        cache.invalidate('doctor')
+        if deleted:
+            doctor_names.remove(deleted['_id'])
+            # the doctor's appointments are removed by a job worker
+            job_id = enqueue('cascade_doctor', {'doctor_id': str(deleted['_id'])})
+            return jsonify({'status': 'success', 'message': 'Doctor deleted', 'job_id': job_id})
         else:
             return jsonify({'status': 'error', 'message': 'Doctor not found'}), 404
     except Exception as e:
@@ -123,7 +209,9 @@ def assign_nurse():
         if nurse:
             nurse_id = str(nurse['_id'])
             query = build_query(name=doctor_name, objectId=doctor_id, email=None)
-            db.doctor.update_one(query, {"$set": {"nurse_id": nurse_id}})
+            with versioned_write('doctor') as version:
+                db.doctor.update_one(query, {"$set": {"nurse_id": nurse_id, SYNC_FIELD: version}})
+            cache.invalidate('doctor')
             return jsonify({'status': 'success', 'message': 'Nurse assigned to doctor'})
         else:
             return jsonify({'status': 'error', 'message': 'Nurse not found'}), 404
@@ -1,17 +1,18 @@
 from flask import Blueprint, jsonify, request
-from functions import ObjectId, connect_to_database
+from functions import ObjectId
+from database import db
+from cache import cache
 
 extras_bp = Blueprint('extras', __name__)
-db = connect_to_database()
 
 
 def find_doctor_by_name(doctor_name):
-    doctor = db.doctor.find_one({"name": doctor_name})
+    doctor = cache.find_one('doctor', lambda: db.doctor.find_one({"name": doctor_name}, {'password': 0}), name=doctor_name)
     return doctor
 
 
 def find_nurse_by_id(nurse_id):
-    nurse = db.nurse.find_one({"_id": ObjectId(nurse_id)})
+    nurse = cache.find_one('nurse', lambda: db.nurse.find_one({"_id": ObjectId(nurse_id)}), objectId=nurse_id)
     return nurse
 
 
@@ -29,8 +30,6 @@ def find_doctor_and_nurse():
             if nurse_id:
                 nurse = find_nurse_by_id(nurse_id)
                 if nurse:
-                    doctor['_id'] = str(doctor['_id'])
-                    nurse['_id'] = str(nurse['_id'])
                     return jsonify({'status': 'success', 'doctor': doctor, 'assigned_nurse': nurse})
                 else:
                     return jsonify({'status': 'error', 'message': 'Nurse not found'}), 404
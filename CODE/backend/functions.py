@@ -1,20 +1,12 @@
 from bson import ObjectId
+from flask import Response, current_app, request, stream_with_context
 from pymongo import MongoClient
 from dotenv import load_dotenv
-from datetime import datetime, timedelta
 import os
 
-load_dotenv()
-
-
-# function to convert ObjectId to string
-def convert_id(data):
-    if isinstance(data, list):
-        for item in data:
-            item['_id'] = str(item['_id'])
-    else:
-        data['_id'] = str(data['_id'])
-    return data
+NDJSON_MIMETYPE = 'application/x-ndjson'
+# documents fetched per cursor getMore while streaming
+STREAM_BATCH_SIZE = 500
 
 
 # to build query dynamically
@@ -30,29 +22,38 @@ def build_query(name, objectId, email):
 
 
 def connect_to_database():
+    load_dotenv()
     mongo_uri = os.getenv("MONGO_URI")
     client = MongoClient(mongo_uri)
     db = client['HospitalManagement']
     return db
 
 
-def check_appointment_collision(doctor_id, appointment_time, db):
-    time_before = appointment_time - timedelta(minutes=10)
-    time_after = appointment_time + timedelta(minutes=10)
-    existing_appointment = db.appointment.find_one({
-        "doctor_id": doctor_id,
-        "appointment_time": {"$gte": time_before, "$lte": time_after}
-    })
-    return existing_appointment is not None
+# fetch appointments for a batch of patients in one round trip, keyed by patient id string
+def group_appointments_by_patient(patient_ids, db):
+    patient_keys = [str(patient_id) for patient_id in patient_ids] + list(patient_ids)
+    grouped = {}
+    for appointment in db.appointment.find({'patient_id': {'$in': patient_keys}}):
+        grouped.setdefault(str(appointment['patient_id']), []).append(appointment)
+    return grouped
+
+
+# to build a projection from a comma separated ?fields= argument
+def build_projection(fields):
+    if not fields:
+        return None
+    projection = {field.strip(): 1 for field in fields.split(',') if field.strip()}
+    return projection or None
+
 
+# list endpoints stream when asked with ?stream=1 or Accept: application/x-ndjson
+def wants_stream():
+    return request.args.get('stream') == '1' or request.accept_mimetypes.best == NDJSON_MIMETYPE
 
-def convert_objectid(data):
-    if isinstance(data, dict):
-        return {key: convert_objectid(value) for key, value in data.items()}
-    elif isinstance(data, list):
-        return [convert_objectid(item) for item in data]
-    elif isinstance(data, ObjectId):
-        return str(data)
-    else:
-        return data
 
+# serialize one document per line so memory stays flat regardless of result size
+def stream_documents(documents):
+    def generate():
+        for document in documents:
+            yield current_app.json.dumps(document) + '\n'
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
@@ -0,0 +1,127 @@
+from datetime import datetime
+from pymongo import ASCENDING, TEXT
+from pymongo.errors import OperationFailure
+from functions import connect_to_database
+from search import SEARCH_COLLATION
+
+# index name -> (collection, keys, options) for every hot lookup in the blueprints
+INDEXES = {
+    # sparse would still index '' and null, so only non-empty emails have to be unique
+    'doctor_email': ('doctor', [('email', ASCENDING)],
+                     {'unique': True, 'partialFilterExpression': {'email': {'$type': 'string', '$gt': ''}}}),
+    'doctor_name': ('doctor', [('name', ASCENDING)], {}),
+    'nurse_email': ('nurse', [('email', ASCENDING)], {}),
+    'nurse_name': ('nurse', [('name', ASCENDING)], {}),
+    'patient_name': ('patient', [('name', ASCENDING)], {}),
+    'appointment_patient_id': ('appointment', [('patient_id', ASCENDING)], {}),
+    'appointment_doctor_time': ('appointment', [('doctor_id', ASCENDING), ('appointment_time', ASCENDING)], {}),
+    'appointment_time': ('appointment', [('appointment_time', ASCENDING)], {}),
+    'patient_sync_version': ('patient', [('sync_version', ASCENDING)], {}),
+    'doctor_sync_version': ('doctor', [('sync_version', ASCENDING)], {}),
+    'nurse_sync_version': ('nurse', [('sync_version', ASCENDING)], {}),
+    'appointment_sync_version': ('appointment', [('sync_version', ASCENDING)], {}),
+    'tombstone_sync_version': ('tombstone', [('collection', ASCENDING), ('sync_version', ASCENDING)], {}),
+    # clients whose token is older than this have to do a full reload
+    'tombstone_expiry': ('tombstone', [('deleted_at', ASCENDING)], {'expireAfterSeconds': 30 * 24 * 3600}),
+    'appointment_slot_unique': ('appointment_slot', [('doctor_id', ASCENDING), ('slot', ASCENDING)], {'unique': True}),
+    'appointment_slot_owner': ('appointment_slot', [('appointment_id', ASCENDING)], {}),
+    # search queries run under SEARCH_COLLATION and can only use indexes built with it
+    'patient_name_search': ('patient', [('name', ASCENDING), ('_id', ASCENDING)], {'collation': SEARCH_COLLATION}),
+    'doctor_name_search': ('doctor', [('name', ASCENDING), ('_id', ASCENDING)], {'collation': SEARCH_COLLATION}),
+    'doctor_department_search': ('doctor', [('department', ASCENDING), ('name', ASCENDING)],
+                                 {'collation': SEARCH_COLLATION}),
+    'nurse_name_search': ('nurse', [('name', ASCENDING), ('_id', ASCENDING)], {'collation': SEARCH_COLLATION}),
+    'nurse_department_search': ('nurse', [('department', ASCENDING), ('name', ASCENDING)],
+                                {'collation': SEARCH_COLLATION}),
+    'appointment_patient_search': ('appointment', [('patient_name', ASCENDING), ('_id', ASCENDING)],
+                                   {'collation': SEARCH_COLLATION}),
+    'appointment_time_search': ('appointment', [('appointment_time', ASCENDING), ('_id', ASCENDING)],
+                                {'collation': SEARCH_COLLATION}),
+    'appointment_doctor_time_search': ('appointment', [('doctor_id', ASCENDING), ('appointment_time', ASCENDING)],
+                                       {'collation': SEARCH_COLLATION}),
+    # job workers claim due jobs and expired leases, finished jobs are kept for a week
+    'job_claim': ('job', [('status', ASCENDING), ('run_after', ASCENDING)], {}),
+    'job_lease': ('job', [('status', ASCENDING), ('lease_until', ASCENDING)], {}),
+    'job_expiry': ('job', [('finished_at', ASCENDING)], {'expireAfterSeconds': 7 * 24 * 3600}),
+    # one text index per collection backs ?mode=text
+    'patient_text': ('patient', [('name', TEXT)], {}),
+    'doctor_text': ('doctor', [('name', TEXT), ('specialization', TEXT), ('department', TEXT)], {}),
+    'nurse_text': ('nurse', [('name', TEXT), ('department', TEXT)], {}),
+    'appointment_text': ('appointment', [('patient_name', TEXT), ('doctor_name', TEXT), ('reason', TEXT)], {}),
+}
+
+# queries that must be answered from an index: name -> (collection, filter[, find options])
+HOT_QUERIES = {
+    'doctor_login': ('doctor', {'email': 'doctor@example.com'}),
+    'find_doctor_by_name': ('doctor', {'name': 'Doctor'}),
+    'find_nurse_by_name': ('nurse', {'name': 'Nurse'}),
+    'find_patient_by_name': ('patient', {'name': 'Patient'}),
+    'patient_appointments': ('appointment', {'patient_id': {'$in': ['000000000000000000000000']}}),
+    'doctor_free_slots': ('appointment_slot', {'doctor_id': '000000000000000000000000',
+                                               'slot': {'$gte': datetime(2024, 1, 1)}}),
+    'search_patients_by_prefix': ('patient', {'name': {'$gte': 'pat', '$lt': 'pat\uffff'}},
+                                  {'collation': SEARCH_COLLATION}),
+    'search_doctors_by_department': ('doctor', {'department': 'Cardiology'}, {'collation': SEARCH_COLLATION}),
+    'search_appointments_by_date': ('appointment', {'appointment_time': {'$gte': datetime(2024, 1, 1),
+                                                                         '$lt': datetime(2024, 1, 2)}},
+                                    {'collation': SEARCH_COLLATION}),
+    'search_text': ('patient', {'$text': {'$search': 'patient'}}),
+}
+
+# server codes for an existing index with the same name or keys but other options
+INDEX_CONFLICT_CODES = (85, 86)
+
+
+def ensure_indexes(db):
+    created = []
+    for name, (collection, keys, options) in INDEXES.items():
+        try:
+            db[collection].create_index(keys, name=name, **options)
+        except OperationFailure as e:
+            if e.code not in INDEX_CONFLICT_CODES:
+                raise
+            # the index spec changed since it was first built, rebuild it
+            drop_conflicting_index(db[collection], name, keys, options)
+            db[collection].create_index(keys, name=name, **options)
+        created.append(name)
+    return created
+
+
+# same name, or same keys under the same collation; the key pattern alone is shared by the search indexes
+def drop_conflicting_index(collection, name, keys, options):
+    locale = options.get('collation', {}).get('locale')
+    for index_name, info in collection.index_information().items():
+        if index_name == name or (info['key'] == keys and info.get('collation', {}).get('locale') == locale):
+            collection.drop_index(index_name)
+
+
+def winning_plan_stages(plan):
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            yield plan['stage']
+        for value in plan.values():
+            yield from winning_plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from winning_plan_stages(item)
+
+
+# names of hot queries whose winning plan falls back to a collection scan
+def find_collscans(db):
+    collscans = []
+    for name, (collection, query, *options) in HOT_QUERIES.items():
+        explain = db[collection].find(query, **(options[0] if options else {})).explain()
+        if 'COLLSCAN' in winning_plan_stages(explain['queryPlanner']['winningPlan']):
+            collscans.append(name)
+    return collscans
+
+
+def create_and_verify_indexes(db):
+    print('Indexes ensured:', ', '.join(ensure_indexes(db)))
+    collscans = find_collscans(db)
+    if collscans:
+        raise SystemExit('Hot queries using COLLSCAN: ' + ', '.join(collscans))
+
+
+if __name__ == "__main__":
+    create_and_verify_indexes(connect_to_database())
@@ -0,0 +1,289 @@
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+import gridfs
+from bson.objectid import ObjectId
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from pymongo import ReturnDocument
+from database import db, database_for, get_client, get_db, DB_NAME
+from cache import cache
+from sync import record_deletions, versioned_write, SYNC_FIELD
+from scheduler import slot_keys, interval_index, DEFAULT_DURATION_MINUTES
+from functions import NDJSON_MIMETYPE
+from bulk import BULK_COLLECTIONS, EXPORT_HIDDEN_FIELDS, export_batches, export_csv
+
+jobs_bp = Blueprint('jobs', __name__)
+
+DEFAULT_JOB_WORKERS = 2
+DEFAULT_MAX_ATTEMPTS = 5
+# retries wait BACKOFF_BASE_SECONDS * 2^(attempt - 1), capped at BACKOFF_MAX_SECONDS
+BACKOFF_BASE_SECONDS = 2
+BACKOFF_MAX_SECONDS = 300
+# a running job whose process stops renewing its lease for this long is picked up by another worker
+LEASE_SECONDS = 60
+POLL_SECONDS = 5
+CASCADE_BATCH_SIZE = 1000
+REPORT_BUCKET = 'report'
+REPORT_FORMATS = {'csv': 'text/csv', 'ndjson': NDJSON_MIMETYPE}
+# what the status endpoint shows of a job
+JOB_FIELDS = {'kind': 1, 'params': 1, 'status': 1, 'attempts': 1, 'max_attempts': 1, 'created_at': 1,
+              'started_at': 1, 'finished_at': 1, 'run_after': 1, 'result': 1, 'error': 1}
+
+# job kind -> function(**params), registered with @job_handler
+handlers = {}
+
+
+def job_handler(kind):
+    def register(function):
+        handlers[kind] = function
+        return function
+    return register
+
+
+def enqueue(kind, params, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    if kind not in handlers:
+        raise ValueError(f'Unknown job kind {kind}')
+    now = datetime.utcnow()
+    result = db.job.insert_one({'kind': kind, 'params': params, 'status': 'queued', 'attempts': 0,
+                                'max_attempts': max_attempts, 'run_after': now, 'created_at': now})
+    current_app.extensions['jobs'].wake()
+    return result.inserted_id
+
+
+def backoff_seconds(attempts):
+    return min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+
+
+# queued jobs that are due, or running ones whose worker died; claiming counts as an attempt
+def claim_job(database, worker_id):
+    now = datetime.utcnow()
+    return database.job.find_one_and_update(
+        {'$or': [{'status': 'queued', 'run_after': {'$lte': now}},
+                 {'status': 'running', 'lease_until': {'$lt': now}}]},
+        {'$set': {'status': 'running', 'worker': worker_id, 'started_at': now,
+                  'lease_until': now + timedelta(seconds=LEASE_SECONDS)},
+         '$inc': {'attempts': 1}},
+        sort=[('run_after', 1)], return_document=ReturnDocument.AFTER)
+
+
+def finish_job(database, job, error=None, result=None):
+    now = datetime.utcnow()
+    if error is None:
+        changes = {'status': 'succeeded', 'result': result, 'finished_at': now, 'error': None}
+    elif job['attempts'] >= job['max_attempts']:
+        changes = {'status': 'failed', 'error': error, 'finished_at': now}
+    else:
+        changes = {'status': 'queued', 'error': error,
+                   'run_after': now + timedelta(seconds=backoff_seconds(job['attempts']))}
+    # a worker whose lease ran out no longer owns the job
+    database.job.update_one({'_id': job['_id'], 'worker': job['worker']},
+                            {'$set': changes, '$unset': {'lease_until': '', 'worker': ''}})
+
+
+class JobWorkers:
+    def __init__(self, app, count):
+        self.app = app
+        self.count = count
+        self.lock = threading.Lock()
+        self.wake_event = threading.Event()
+        self.running = set()
+        self.pid = None
+
+    @property
+    def worker_id(self):
+        return f'{socket.gethostname()}:{os.getpid()}'
+
+    # threads never survive a fork, so every process starts its own on first use
+    def ensure_started(self):
+        if self.count and self.pid != os.getpid():
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.running = set()
+                    for number in range(self.count):
+                        threading.Thread(target=self.work, daemon=True, name=f'job-worker-{number}').start()
+                    threading.Thread(target=self.renew_leases, daemon=True, name='job-leases').start()
+                    self.pid = os.getpid()
+
+    def wake(self):
+        self.ensure_started()
+        self.wake_event.set()
+
+    def database(self):
+        with self.app.app_context():
+            return get_client()[DB_NAME]
+
+    def work(self):
+        while True:
+            try:
+                job = claim_job(self.database(), self.worker_id)
+            except Exception as e:
+                self.app.logger.warning('Claiming a job failed: %s', e)
+                job = None
+            if job is None:
+                self.wake_event.wait(POLL_SECONDS)
+                self.wake_event.clear()
+                continue
+            self.run(job)
+
+    def run(self, job):
+        with self.lock:
+            self.running.add(job['_id'])
+        database = self.database()
+        try:
+            if job['attempts'] > job['max_attempts']:
+                # its worker died on the last attempt
+                finish_job(database, job, error=job.get('error') or 'Worker stopped while running the job')
+                return
+            with self.app.app_context():
+                result = handlers[job['kind']](**job['params'])
+            finish_job(database, job, result=result)
+        except Exception as e:
+            self.app.logger.warning('Job %s (%s) attempt %d failed: %s', job['_id'], job['kind'], job['attempts'], e)
+            finish_job(database, job, error=str(e))
+        finally:
+            with self.lock:
+                self.running.discard(job['_id'])
+
+    # long jobs keep their lease as long as this process is alive
+    def renew_leases(self):
+        while True:
+            time.sleep(LEASE_SECONDS / 3)
+            with self.lock:
+                running = list(self.running)
+            if not running:
+                continue
+            try:
+                self.database().job.update_many(
+                    {'_id': {'$in': running}, 'worker': self.worker_id, 'status': 'running'},
+                    {'$set': {'lease_until': datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)}})
+            except Exception as e:
+                self.app.logger.warning('Renewing job leases failed: %s', e)
+
+
+def init_jobs(app, count=None):
+    if count is None:
+        count = int(app.config.get('JOB_WORKERS', os.getenv('JOB_WORKERS', DEFAULT_JOB_WORKERS)))
+    workers = JobWorkers(app, count)
+    app.extensions['jobs'] = workers
+    # jobs left by other processes or a restart are picked up without waiting for a new one
+    app.before_request(workers.ensure_started)
+    return workers
+
+
+# remove appointments batch by batch together with their slots, safe to retry after a partial run
+def delete_appointments(query):
+    deleted = 0
+    while True:
+        batch = list(db.appointment.find(query, {'patient_id': 1, 'doctor_id': 1, 'appointment_time': 1,
+                                                 'duration_minutes': 1}).limit(CASCADE_BATCH_SIZE))
+        if not batch:
+            return deleted
+        ids = [appointment['_id'] for appointment in batch]
+        db.appointment.delete_many({'_id': {'$in': ids}})
+        db.appointment_slot.delete_many({'appointment_id': {'$in': ids}})
+        # patient deltas re-send the patients whose embedded appointments went away
+        with versioned_write('appointment') as version:
+            record_deletions('appointment', ids, version,
+                             [{'patient_id': appointment.get('patient_id')} for appointment in batch])
+        for appointment in batch:
+            if appointment.get('doctor_id') and isinstance(appointment.get('appointment_time'), datetime):
+                interval_index.remove(str(appointment['doctor_id']), slot_keys(
+                    appointment['appointment_time'], appointment.get('duration_minutes', DEFAULT_DURATION_MINUTES)))
+        deleted += len(ids)
+
+
+# ids are stored as ObjectId by the routes and as strings by older rows
+def id_variants(document_id):
+    return {'$in': [ObjectId(document_id), document_id]}
+
+
+@job_handler('cascade_patient')
+def cascade_patient(patient_id):
+    return {'appointments_deleted': delete_appointments({'patient_id': id_variants(patient_id)})}
+
+
+@job_handler('cascade_doctor')
+def cascade_doctor(doctor_id):
+    return {'appointments_deleted': delete_appointments({'doctor_id': id_variants(doctor_id)})}
+
+
+# move every doctor from one nurse to another, or leave them without one
+@job_handler('reassign_nurse')
+def reassign_nurse(nurse_id, replacement_id=None):
+    with versioned_write('doctor') as version:
+        if replacement_id:
+            update = {'$set': {'nurse_id': replacement_id, SYNC_FIELD: version}}
+        else:
+            update = {'$set': {SYNC_FIELD: version}, '$unset': {'nurse_id': ''}}
+        result = db.doctor.update_many({'nurse_id': nurse_id}, update)
+    cache.invalidate('doctor')
+    return {'doctors_updated': result.modified_count}
+
+
+@job_handler('export_report')
+def export_report(kind, export_format='csv'):
+    collection = BULK_COLLECTIONS[kind]
+    hidden = EXPORT_HIDDEN_FIELDS.get(collection, ())
+    reads = database_for('reports')
+    batches = export_batches(reads[collection].find({}, {field: 0 for field in hidden} or None), None)
+    if export_format == 'csv':
+        chunks = export_csv(batches)
+    else:
+        chunks = (''.join(json.dumps(row) + '\n' for row in rows) for _, rows in batches)
+    # GridFS wants a real Database, not the request proxy
+    reports = gridfs.GridFS(get_db(), collection=REPORT_BUCKET)
+    filename = f'{kind}-{datetime.utcnow():%Y%m%d%H%M%S}.{export_format}'
+    with reports.new_file(filename=filename, content_type=REPORT_FORMATS[export_format]) as report:
+        for chunk in chunks:
+            report.write(chunk.encode('utf-8'))
+    return {'file_id': str(report._id), 'filename': filename}
+
+
+# accepted: the work happens on a job worker, the status URL tells when it is done
+def job_response(job_id):
+    return jsonify({'status': 'success', 'job_id': job_id, 'status_url': f'/jobs/{job_id}'}), 202
+
+
+@jobs_bp.route('/<job_id>', methods=['GET'])
+def get_job(job_id):
+    try:
+        job = db.job.find_one({'_id': ObjectId(job_id)}, JOB_FIELDS)
+        if not job:
+            return jsonify({'status': 'error', 'message': 'Job not found'}), 404
+        return jsonify({'status': 'success', 'job': job})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@jobs_bp.route('/reports', methods=['POST'])
+def create_report():
+    try:
+        request_data = request.json or {}
+        kind = request_data.get('kind')
+        export_format = request_data.get('format', 'csv')
+        if kind not in BULK_COLLECTIONS:
+            return jsonify({'status': 'error', 'message': f'Unknown collection {kind}'}), 404
+        if export_format not in REPORT_FORMATS:
+            return jsonify({'status': 'error', 'message': f'Unknown export format {export_format}'}), 400
+        return job_response(enqueue('export_report', {'kind': kind, 'export_format': export_format}))
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@jobs_bp.route('/<job_id>/download', methods=['GET'])
+def download_report(job_id):
+    try:
+        job = db.job.find_one({'_id': ObjectId(job_id), 'kind': 'export_report'}, {'status': 1, 'result': 1})
+        if not job:
+            return jsonify({'status': 'error', 'message': 'Report not found'}), 404
+        if job['status'] != 'succeeded':
+            return jsonify({'status': 'error', 'message': f"Report is {job['status']}"}), 409
+        report = gridfs.GridFS(get_db(), collection=REPORT_BUCKET).get(ObjectId(job['result']['file_id']))
+        headers = {'Content-Disposition': f"attachment; filename={job['result']['filename']}"}
+        return Response(stream_with_context(iter(report.readchunk, b'')), mimetype=report.content_type,
+                        headers=headers)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
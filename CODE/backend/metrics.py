@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+from collections import Counter
+from flask import Response, current_app, g, request
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLOW_QUERY_MS = 100
+# the same command on the same collection this often in one request is an N+1 pattern
+N_PLUS_ONE_THRESHOLD = 20
+CURSOR_COMMANDS = ('find', 'aggregate', 'getMore')
+
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                self.buckets[i] += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.request_latency = {}
+        self.request_commands = Counter()
+        self.command_count = Counter()
+        self.command_seconds = Counter()
+        self.command_documents = Counter()
+        self.command_failures = Counter()
+        self.slow_commands = Counter()
+        self.n_plus_one = Counter()
+
+    def observe_request(self, method, route, status, seconds, commands):
+        with self.lock:
+            self.request_latency.setdefault((method, route, status), Histogram()).observe(seconds)
+            self.request_commands[route] += commands
+
+    def observe_command(self, command, collection, seconds, documents, failed):
+        key = (command, collection)
+        with self.lock:
+            self.command_count[key] += 1
+            self.command_seconds[key] += seconds
+            self.command_documents[key] += documents
+            if failed:
+                self.command_failures[key] += 1
+            if seconds * 1000 >= SLOW_QUERY_MS:
+                self.slow_commands[key] += 1
+
+    def observe_n_plus_one(self, route, command, collection):
+        with self.lock:
+            self.n_plus_one[(route, command, collection)] += 1
+
+    def render(self):
+        lines = []
+        with self.lock:
+            lines += ['# HELP http_request_duration_seconds Request latency by route.',
+                      '# TYPE http_request_duration_seconds histogram']
+            for (method, route, status), histogram in sorted(self.request_latency.items()):
+                labels = f'method="{method}",route="{route}",status="{status}"'
+                for bound, count in zip(LATENCY_BUCKETS, histogram.buckets):
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f'http_request_duration_seconds_sum{{{labels}}} {histogram.sum}')
+                lines.append(f'http_request_duration_seconds_count{{{labels}}} {histogram.count}')
+            lines += render_counter('http_request_mongo_commands_total', 'Mongo commands issued by route.',
+                                    self.request_commands, ('route',))
+            for name, help_text, counter in (
+                    ('mongo_commands_total', 'Mongo commands by command and collection.', self.command_count),
+                    ('mongo_command_seconds_total', 'Time spent in Mongo commands.', self.command_seconds),
+                    ('mongo_documents_returned_total', 'Documents returned by Mongo commands.', self.command_documents),
+                    ('mongo_command_failures_total', 'Failed Mongo commands.', self.command_failures),
+                    ('mongo_slow_commands_total', f'Mongo commands slower than {SLOW_QUERY_MS}ms.', self.slow_commands),
+                    ('mongo_n_plus_one_total', 'Requests repeating one command per item.', self.n_plus_one)):
+                labels = ('route', 'command', 'collection') if counter is self.n_plus_one else ('command', 'collection')
+                lines += render_counter(name, help_text, counter, labels)
+        return '\n'.join(lines) + '\n'
+
+
+def render_counter(name, help_text, counter, labels):
+    lines = [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+    for key, value in sorted(counter.items()):
+        key = key if isinstance(key, tuple) else (key,)
+        label_text = ','.join(f'{label}="{label_value}"' for label, label_value in zip(labels, key))
+        lines.append(f'{name}{{{label_text}}} {value}')
+    return lines
+
+
+registry = MetricsRegistry()
+# commands seen by the request running on this thread
+request_state = threading.local()
+
+
+class CommandMetricsListener(monitoring.CommandListener):
+    def __init__(self, app):
+        self.app = app
+        self.lock = threading.Lock()
+        self.collections = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if event.command_name == 'getMore':
+            collection = event.command.get('collection')
+        with self.lock:
+            self.collections[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ''
+
+    def succeeded(self, event):
+        self.finish(event, documents_in_reply(event.command_name, event.reply), failed=False)
+
+    def failed(self, event):
+        self.finish(event, 0, failed=True)
+
+    def finish(self, event, documents, failed):
+        with self.lock:
+            collection = self.collections.pop((event.connection_id, event.request_id), '')
+        seconds = event.duration_micros / 1e6
+        registry.observe_command(event.command_name, collection, seconds, documents, failed)
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            self.app.logger.warning('Slow Mongo %s on %s took %.1fms', event.command_name, collection, seconds * 1000)
+        commands = getattr(request_state, 'commands', None)
+        if commands is not None:
+            commands[(event.command_name, collection)] += 1
+
+
+def documents_in_reply(command_name, reply):
+    if command_name in CURSOR_COMMANDS:
+        cursor = reply.get('cursor', {})
+        return len(cursor.get('firstBatch', cursor.get('nextBatch', [])))
+    return reply.get('n', 0)
+
+
+def start_request_timer():
+    g.metrics_started = time.perf_counter()
+    request_state.commands = Counter()
+
+
+def record_request(response):
+    started = g.pop('metrics_started', None)
+    commands = getattr(request_state, 'commands', Counter())
+    request_state.commands = None
+    if started is None:
+        return response
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    registry.observe_request(request.method, route, response.status_code, time.perf_counter() - started,
+                             sum(commands.values()))
+    for (command, collection), count in commands.items():
+        if count >= N_PLUS_ONE_THRESHOLD:
+            registry.observe_n_plus_one(route, command, collection)
+            current_app.logger.warning('Possible N+1 in %s %s: %d %s commands on %s',
+                                       request.method, route, count, command, collection)
+    return response
+
+
+def metrics_view():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+# nothing is hooked in unless METRICS_ENABLED is set, so disabled metrics cost nothing per request
+def init_metrics(app):
+    if str(app.config.get('METRICS_ENABLED', os.getenv('METRICS_ENABLED', ''))) not in ('1', 'True', 'true'):
+        return
+    # registered globally before the lazy client is built, so the pooled client and Motor both report
+    monitoring.register(CommandMetricsListener(app))
+    app.before_request(start_request_timer)
+    app.after_request(record_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
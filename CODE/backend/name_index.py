@@ -0,0 +1,98 @@
+import threading
+import time
+from database import get_client, DB_NAME
+
+# full reloads bound how stale an index can get from writes made by other workers
+RELOAD_INTERVAL_SECONDS = 300
+
+
+class NameIndex:
+    def __init__(self, collection):
+        self.collection = collection
+        self.lock = threading.Lock()
+        # name -> ids in _id order, the first one wins like the old $group/$first lookup
+        self.ids_by_name = {}
+        self.name_by_id = {}
+        self.loaded_at = None
+
+    def load(self, db):
+        ids_by_name, name_by_id = {}, {}
+        for document in db[self.collection].find({'name': {'$exists': True}}, {'name': 1}).sort('_id', 1):
+            ids_by_name.setdefault(document['name'], []).append(document['_id'])
+            name_by_id[document['_id']] = document['name']
+        with self.lock:
+            self.ids_by_name, self.name_by_id = ids_by_name, name_by_id
+            self.loaded_at = time.monotonic()
+
+    def resolve(self, db, name):
+        if not name:
+            return None
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > RELOAD_INTERVAL_SECONDS:
+            self.load(db)
+        ids = self.ids_by_name.get(name)
+        if ids:
+            return ids[0]
+        # added by another worker since the last load
+        document = db[self.collection].find_one({'name': name}, {'name': 1}, sort=[('_id', 1)])
+        if document:
+            self.add(document['_id'], name)
+            return document['_id']
+        return None
+
+    def is_ambiguous(self, name):
+        return len(self.ids_by_name.get(name, [])) > 1
+
+    def add(self, document_id, name):
+        if not name:
+            return
+        with self.lock:
+            self.discard(document_id)
+            ids = self.ids_by_name.setdefault(name, [])
+            if document_id not in ids:
+                ids.append(document_id)
+                ids.sort()
+            self.name_by_id[document_id] = name
+
+    def remove(self, document_id):
+        with self.lock:
+            self.discard(document_id)
+
+    # caller holds the lock
+    def discard(self, document_id):
+        name = self.name_by_id.pop(document_id, None)
+        if name is not None:
+            ids = self.ids_by_name.get(name, [])
+            if document_id in ids:
+                ids.remove(document_id)
+            if not ids:
+                self.ids_by_name.pop(name, None)
+
+
+patient_names = NameIndex('patient')
+doctor_names = NameIndex('doctor')
+
+
+def apply_change(index, change):
+    document_id = change['documentKey']['_id']
+    if change['operationType'] == 'delete':
+        index.remove(document_id)
+    elif change.get('fullDocument'):
+        index.add(document_id, change['fullDocument'].get('name'))
+
+
+# keep the indexes fresh across workers with change streams (needs a replica set)
+def start_change_stream_watcher(app):
+    def watch(index):
+        with app.app_context():
+            collection = get_client()[DB_NAME][index.collection]
+        while True:
+            try:
+                with collection.watch(full_document='updateLookup') as stream:
+                    for change in stream:
+                        apply_change(index, change)
+            except Exception as e:
+                app.logger.warning('Name index change stream for %s stopped: %s', index.collection, e)
+                time.sleep(5)
+
+    for index in (patient_names, doctor_names):
+        threading.Thread(target=watch, args=(index,), daemon=True, name=f'{index.collection}-names').start()
@@ -1,16 +1,54 @@
 from flask import Blueprint, request, jsonify
-from functions import convert_id, build_query, connect_to_database
+from functions import build_query, wants_stream, stream_documents, \
+    STREAM_BATCH_SIZE
+from database import db
+from consistency import reads_from
+from cache import cache
+from jobs import enqueue, job_response
+from coalescer import writes
+from search import run_search, SearchError
+from sync import current_versions, delta, is_not_modified, list_etag, not_modified, record_deletion, \
+    parse_sync_token, versioned_write, with_etag, SYNC_FIELD
 
 nurse_bp = Blueprint('nurse', __name__)
-db = connect_to_database()
 
 # Routes for Nurses
 @nurse_bp.route('/', methods=['GET'])
+@reads_from('lists')
 def get_nurses():
     try:
+        versions = current_versions(['nurse'])
+        etag = list_etag(versions)
+        if is_not_modified(etag):
+            return not_modified(etag)
+        since = request.args.get('since')
+        if since is not None:
+            version = parse_sync_token(since)
+            if version is None:
+                return jsonify({'status': 'error', 'message': 'since must be a sync_token from /nurse/'}), 400
+            nurses, deleted = delta('nurse', version)
+            return with_etag(jsonify({'status': 'success', 'nurses': list(nurses), 'deleted': deleted,
+                                      'sync_token': versions['nurse']}), etag)
+        if wants_stream():
+            return with_etag(stream_documents(db.nurse.find().batch_size(STREAM_BATCH_SIZE)), etag)
         nurses = list(db.nurse.find())
-        nurses = [convert_id(nurse) for nurse in nurses]
-        return jsonify({'status': 'success', 'nurses': nurses})
+        return with_etag(jsonify({'status': 'success', 'nurses': nurses, 'sync_token': versions['nurse']}), etag)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@nurse_bp.route('/search', methods=['GET'])
+@reads_from('lists')
+def search_nurses():
+    try:
+        versions = current_versions(['nurse'])
+        etag = list_etag(versions)
+        if is_not_modified(etag):
+            return not_modified(etag)
+        nurses, next_after = run_search('nurse', request.args)
+        return with_etag(jsonify({'status': 'success', 'nurses': nurses, 'next_after': next_after}), etag)
+    except SearchError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -19,7 +57,9 @@ def get_nurses():
 def add_nurse():
     try:
         new_nurse_data = request.json
-        result = db.nurse.insert_one(new_nurse_data)
+        with versioned_write('nurse') as version:
+            new_nurse_data[SYNC_FIELD] = version
+            result = db.nurse.insert_one(new_nurse_data)
         inserted_id = str(result.inserted_id)
         new_nurse_data['_id'] = inserted_id
         return jsonify({'status': 'success', 'message': 'Nurse added', 'nurse': new_nurse_data})
@@ -37,9 +77,9 @@ def get_nurse_info():
         if not nurse_name and not nurse_id and not nurse_email:
             return jsonify({'status': 'error', 'message': 'Nurse name or ObjectId or email not provided'}), 400
         query = build_query(name=nurse_name, objectId=nurse_id, email=nurse_email)
-        nurse = db.nurse.find_one(query)
+        nurse = cache.find_one('nurse', lambda: db.nurse.find_one(query),
+                                name=nurse_name, objectId=nurse_id, email=nurse_email)
         if nurse:
-            nurse = convert_id(nurse)
             return jsonify({'status': 'success', 'nurse': nurse})
         else:
             return jsonify({'status': 'error', 'message': 'Nurse not found'}), 404
@@ -56,7 +96,8 @@ def update_nurse():
         if not nurse_name and not nurse_id:
             return jsonify({'status': 'error', 'message': 'Nurse name or ObjectId not provided'}), 400
         query = build_query(name=nurse_name, objectId=nurse_id, email=None)
-        db.nurse.update_one(query, {"$set": updated_data})
+        writes.update('nurse', query, updated_data)
+        cache.invalidate('nurse')
         return jsonify({'status': 'success', 'message': 'Nurse updated'})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -72,10 +113,35 @@ def delete_nurse():
         if not nurse_name and not nurse_id and not nurse_email:
             return jsonify({'status': 'error', 'message': 'Nurse name or ObjectId or email not provided'}), 400
         query = build_query(name=nurse_name, objectId=nurse_id, email=nurse_email)
-        result = db.nurse.delete_one(query)
-        if result.deleted_count == 1:
-            return jsonify({'status': 'success', 'message': 'Nurse deleted'})
+        deleted = db.nurse.find_one_and_delete(query, {'_id': 1})
+        cache.invalidate('nurse')
+        if deleted:
+            with versioned_write('nurse') as version:
+                record_deletion('nurse', deleted['_id'], version)
+            # doctors still pointing at the nurse are unassigned by a job worker
+            job_id = enqueue('reassign_nurse', {'nurse_id': str(deleted['_id'])})
+            return jsonify({'status': 'success', 'message': 'Nurse deleted', 'job_id': job_id})
         else:
             return jsonify({'status': 'error', 'message': 'Nurse not found'}), 404
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+# move every doctor of one nurse to another in the background
+@nurse_bp.route('/reassign', methods=['PUT'])
+def reassign_nurse():
+    try:
+        request_data = request.json
+        nurse_query = build_query(name=request_data.get('name'), objectId=request_data.get('objectId'), email=None)
+        replacement_query = build_query(name=request_data.get('replacementName'),
+                                        objectId=request_data.get('replacementId'), email=None)
+        if not nurse_query or not replacement_query:
+            return jsonify({'status': 'error', 'message': 'Nurse and replacement name or ObjectId not provided'}), 400
+        nurse = db.nurse.find_one(nurse_query, {'_id': 1})
+        replacement = db.nurse.find_one(replacement_query, {'_id': 1})
+        if not nurse or not replacement:
+            return jsonify({'status': 'error', 'message': 'Nurse not found'}), 404
+        return job_response(enqueue('reassign_nurse', {'nurse_id': str(nurse['_id']),
+                                                       'replacement_id': str(replacement['_id'])}))
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -1,31 +1,150 @@
 from flask import Blueprint, request, jsonify
-from functions import convert_id, build_query, connect_to_database, convert_objectid
+from bson.objectid import ObjectId
+from functions import build_query, group_appointments_by_patient, build_projection, \
+    wants_stream, stream_documents, STREAM_BATCH_SIZE
+from database import db
+from consistency import reads_from
+from name_index import patient_names
+from jobs import enqueue
+from coalescer import writes
+from search import run_search, SearchError
+from sync import current_versions, delta, is_not_modified, list_etag, not_modified, record_deletion, \
+    sync_floor, versioned_write, with_etag, SYNC_FIELD
 
 patient_bp = Blueprint('patient', __name__)
-db = connect_to_database()
+
+# patients per appointment $in lookup
+APPOINTMENT_BATCH_SIZE = 1000
+
+
+class PageError(ValueError):
+    pass
+
+
+# ?limit= and ?after= of the list, validated the same way by the Flask route and the ASGI fast path
+def parse_page_args(limit, after):
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise PageError('limit must be a number')
+        if limit < 0:
+            raise PageError('limit must not be negative')
+    if after and not ObjectId.is_valid(after):
+        raise PageError('after must be the _id of a patient')
+    return limit, ObjectId(after) if after else None
+
+
+# attach appointments batch by batch so the cursor is never materialized up front
+def iter_patients_with_appointments(cursor, with_appointments):
+    batch = []
+    for patient in cursor:
+        batch.append(patient)
+        if len(batch) == APPOINTMENT_BATCH_SIZE:
+            yield from attach_appointments(batch, with_appointments)
+            batch = []
+    yield from attach_appointments(batch, with_appointments)
+
+
+def attach_appointments(batch, with_appointments):
+    appointments = group_appointments_by_patient([patient['_id'] for patient in batch], db) \
+        if with_appointments and batch else {}
+    for patient in batch:
+        if with_appointments:
+            patient['appointments'] = appointments.get(str(patient['_id']), 'N/A')
+        yield patient
+
+
+# patients embed their appointments, so their sync token is '<patient version>.<appointment version>'
+def patient_sync_token(versions):
+    return f"{versions['patient']}.{versions['appointment']}"
+
+
+def parse_patient_sync_token(token):
+    parts = token.split('.')
+    if len(parts) != 2 or not all(part.isdigit() for part in parts):
+        return None
+    return int(parts[0]), int(parts[1])
+
+
+# patients changed since the token, plus those whose appointments were booked, moved or deleted since
+def patient_delta(patient_since, appointment_since):
+    changed, deleted = delta('patient', patient_since)
+    patients = {patient['_id']: patient for patient in changed}
+    floor = sync_floor(appointment_since)
+    touched = [appointment.get('patient_id') for appointment in
+               db.appointment.find({SYNC_FIELD: {'$gt': floor}}, {'patient_id': 1})]
+    touched += [tombstone.get('patient_id') for tombstone in
+                db.tombstone.find({'collection': 'appointment', SYNC_FIELD: {'$gt': floor}}, {'patient_id': 1})]
+    # appointments store the patient as an ObjectId, older rows as a string
+    ids = {ObjectId(str(patient_id)) for patient_id in touched if patient_id and ObjectId.is_valid(str(patient_id))}
+    ids -= set(patients) | set(deleted)
+    if ids:
+        for patient in db.patient.find({'_id': {'$in': list(ids)}}):
+            patients[patient['_id']] = patient
+    return list(patients.values()), deleted
 
 
 # Routes for Patients
 @patient_bp.route('/', methods=['GET'])
+@reads_from('lists')
 def get_patients():
     try:
-        patients = list(db.patient.find())
-        patients_with_appointments = []
+        # patients embed their appointments, so both collections version the response
+        versions = current_versions(['patient', 'appointment'])
+        etag = list_etag(versions)
+        if is_not_modified(etag):
+            return not_modified(etag)
+        since = request.args.get('since')
+        if since is not None:
+            tokens = parse_patient_sync_token(since)
+            if tokens is None:
+                return jsonify({'status': 'error', 'message': 'since must be a sync_token from /patients/'}), 400
+            patients, deleted = patient_delta(*tokens)
+            patients = list(iter_patients_with_appointments(patients, True))
+            return with_etag(jsonify({'status': 'success', 'patients': patients, 'deleted': deleted,
+                                      'sync_token': patient_sync_token(versions)}), etag)
 
-        for patient in patients:
-            patient_id = str(patient['_id'])  # Convert ObjectId to string
-            appointments = list(db.appointment.find({'patient_id': patient_id}))
+        try:
+            limit, after = parse_page_args(request.args.get('limit'), request.args.get('after'))
+        except PageError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        projection = build_projection(request.args.get('fields'))
 
-            if appointments:
-                patient['appointments'] = [convert_objectid(app) for app in appointments]
-            else:
-                patient['appointments'] = 'N/A'
+        # keyset pagination on _id, so deep pages cost the same as the first one
+        query = {'_id': {'$gt': after}} if after else {}
+        cursor = db.patient.find(query, projection).sort('_id', 1).batch_size(STREAM_BATCH_SIZE)
+        if limit:
+            cursor = cursor.limit(limit)
+        with_appointments = projection is None or 'appointments' in projection
+        patients = iter_patients_with_appointments(cursor, with_appointments)
+        if wants_stream():
+            return with_etag(stream_documents(patients), etag)
 
-            # Convert patient_id to string
-            patient = convert_id(patient)
-            patients_with_appointments.append(patient)
+        patients = list(patients)
+        response = {'status': 'success', 'patients': patients, 'total': db.patient.estimated_document_count(),
+                    'sync_token': patient_sync_token(versions)}
+        if limit and len(patients) == limit:
+            response['next_after'] = patients[-1]['_id']
+        return with_etag(jsonify(response), etag)
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 500
 
-        return jsonify({'status': 'success', 'patients': patients_with_appointments})
+
+@patient_bp.route('/search', methods=['GET'])
+@reads_from('lists')
+def search_patients():
+    try:
+        versions = current_versions(['patient', 'appointment'])
+        etag = list_etag(versions)
+        if is_not_modified(etag):
+            return not_modified(etag)
+        patients, next_after = run_search('patient', request.args)
+        fields = request.args.get('fields')
+        patients = list(attach_appointments(patients, not fields or 'appointments' in fields))
+        return with_etag(jsonify({'status': 'success', 'patients': patients, 'next_after': next_after}), etag)
+    except SearchError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
 
@@ -34,7 +153,10 @@ def get_patients():
 def add_patient():
     try:
         new_patient_data = request.json
-        result = db.patient.insert_one(new_patient_data)
+        with versioned_write('patient') as version:
+            new_patient_data[SYNC_FIELD] = version
+            result = db.patient.insert_one(new_patient_data)
+        patient_names.add(result.inserted_id, new_patient_data.get('name'))
         inserted_id = str(result.inserted_id)
         new_patient_data['_id'] = inserted_id
         return jsonify({'status': 'success', 'message': 'Patient added', 'patient': new_patient_data})
@@ -53,7 +175,6 @@ def get_patient_info():
         query = build_query(name=patient_name, objectId=patient_id, email=None)
         patient = db.patient.find_one(query)
         if patient:
-            patient = convert_id(patient)
             return jsonify({'status': 'success', 'patient': patient})
         else:
             return jsonify({'status': 'error', 'message': 'Patient not found'}), 404
@@ -70,7 +191,9 @@ def update_patient():
         if not patient_name and not patient_id:
             return jsonify({'status': 'error', 'message': 'Patient name or ObjectId not provided'}), 400
         query = build_query(name=patient_name, objectId=patient_id, email=None)
-        db.patient.update_one(query, {"$set": updated_data})
+        writes.update('patient', query, updated_data)
+        if patient_id and patient_name:
+            patient_names.add(ObjectId(patient_id), patient_name)
         return jsonify({'status': 'success', 'message': 'Patient updated'})
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
@@ -85,9 +208,14 @@ def delete_patient():
         if not patient_name and not patient_id:
             return jsonify({'status': 'error', 'message': 'Patient name or ObjectId not provided'}), 400
         query = build_query(name=patient_name, objectId=patient_id, email=None)
-        result = db.patient.delete_one(query)
-        if result.deleted_count == 1:
-            return jsonify({'status': 'success', 'message': 'Patient deleted'})
+        deleted = db.patient.find_one_and_delete(query, {'_id': 1})
+        if deleted:
+            with versioned_write('patient') as version:
+                record_deletion('patient', deleted['_id'], version)
+            patient_names.remove(deleted['_id'])
+            # the patient's appointments are removed by a job worker
+            job_id = enqueue('cascade_patient', {'patient_id': str(deleted['_id'])})
+            return jsonify({'status': 'success', 'message': 'Patient deleted', 'job_id': job_id})
         else:
             return jsonify({'status': 'error', 'message': 'Patient not found'}), 404
     except Exception as e:
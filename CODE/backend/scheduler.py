@@ -0,0 +1,192 @@
+import bisect
+import threading
+import time
+from datetime import datetime, timedelta
+from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError
+
+# appointments reserve every SLOT_MINUTES slot they touch; a unique
+# {doctor_id, slot} index on db.appointment_slot makes overlaps impossible
+SLOT_MINUTES = 5
+DEFAULT_DURATION_MINUTES = 10
+DUPLICATE_KEY_ERROR = 11000
+
+# free slot search
+WORKDAY_START_HOUR = 9
+WORKDAY_END_HOUR = 17
+SEARCH_HORIZON_DAYS = 30
+INDEX_TTL_SECONDS = 30
+
+
+slot_index_ready = False
+
+
+# overlaps are only rejected while the unique index exists, so never claim a slot without it
+def ensure_slot_index(db):
+    global slot_index_ready
+    if not slot_index_ready:
+        db.appointment_slot.create_index([('doctor_id', ASCENDING), ('slot', ASCENDING)],
+                                         name='appointment_slot_unique', unique=True)
+        slot_index_ready = True
+
+
+def floor_to_slot(moment):
+    return moment.replace(minute=moment.minute - moment.minute % SLOT_MINUTES, second=0, microsecond=0)
+
+
+def slot_keys(start, duration_minutes):
+    end = start + timedelta(minutes=duration_minutes)
+    slot = floor_to_slot(start)
+    keys = []
+    while slot < end:
+        keys.append(slot)
+        slot += timedelta(minutes=SLOT_MINUTES)
+    return keys
+
+
+# insert all slot claims in one unordered bulk write, returns the owners that lost a slot
+def claim_slots(db, claims):
+    docs = [{'doctor_id': doctor_id, 'slot': slot, 'appointment_id': appointment_id}
+            for _, appointment_id, doctor_id, slot in claims]
+    failed = set()
+    if not docs:
+        return failed
+    ensure_slot_index(db)
+    try:
+        db.appointment_slot.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details['writeErrors']:
+            if error['code'] != DUPLICATE_KEY_ERROR:
+                raise
+            failed.add(claims[error['index']][0])
+    if failed:
+        # give back the slots the losing appointments did get, the others belong to someone else
+        lost = [claim for claim in claims if claim[0] in failed]
+        db.appointment_slot.delete_many({'$or': [{'appointment_id': appointment_id, 'slot': slot}
+                                                 for _, appointment_id, _, slot in lost]})
+    return failed
+
+
+def release_slots(db, appointment_id, slots=None):
+    query = {'appointment_id': appointment_id}
+    if slots is not None:
+        query['slot'] = {'$in': slots}
+    db.appointment_slot.delete_many(query)
+
+
+class IntervalIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # doctor_id -> (loaded_at, sorted list of taken slot starts)
+        self.doctors = {}
+
+    def taken_slots(self, db, doctor_id):
+        entry = self.doctors.get(doctor_id)
+        if entry is None or time.monotonic() - entry[0] > INDEX_TTL_SECONDS:
+            cursor = db.appointment_slot.find({'doctor_id': doctor_id, 'slot': {'$gte': floor_to_slot(datetime.now())}},
+                                              {'slot': 1, '_id': 0})
+            entry = (time.monotonic(), sorted(doc['slot'] for doc in cursor))
+            with self.lock:
+                self.doctors[doctor_id] = entry
+        return entry[1]
+
+    def add(self, doctor_id, slots):
+        with self.lock:
+            entry = self.doctors.get(doctor_id)
+            if entry:
+                for slot in slots:
+                    bisect.insort(entry[1], slot)
+
+    def remove(self, doctor_id, slots):
+        with self.lock:
+            entry = self.doctors.get(doctor_id)
+            if entry:
+                for slot in slots:
+                    position = bisect.bisect_left(entry[1], slot)
+                    if position < len(entry[1]) and entry[1][position] == slot:
+                        del entry[1][position]
+
+    def next_free(self, db, doctor_id, after, count, duration_minutes):
+        taken = self.taken_slots(db, doctor_id)
+        needed = timedelta(minutes=SLOT_MINUTES * len(slot_keys(datetime.min, duration_minutes)))
+        step = timedelta(minutes=SLOT_MINUTES)
+        candidate = floor_to_slot(after)
+        if candidate < after:
+            candidate += step
+        horizon = candidate + timedelta(days=SEARCH_HORIZON_DAYS)
+        free = []
+        with self.lock:
+            while len(free) < count and candidate < horizon:
+                day_start = candidate.replace(hour=WORKDAY_START_HOUR, minute=0)
+                day_end = candidate.replace(hour=WORKDAY_END_HOUR, minute=0)
+                if candidate < day_start:
+                    candidate = day_start
+                    continue
+                if candidate + needed > day_end:
+                    candidate = day_start + timedelta(days=1)
+                    continue
+                # the first taken slot at or after the candidate decides whether it fits
+                position = bisect.bisect_left(taken, candidate)
+                if position == len(taken) or taken[position] >= candidate + needed:
+                    free.append(candidate)
+                    candidate += needed
+                else:
+                    candidate = taken[position] + step
+        return free
+
+
+interval_index = IntervalIndex()
+
+
+def book_appointments(db, appointments):
+    claims = [(i, appointment['_id'], str(appointment['doctor_id']), slot)
+              for i, appointment in enumerate(appointments)
+              for slot in slot_keys(appointment['appointment_time'], appointment['duration_minutes'])]
+    failed = claim_slots(db, claims)
+    booked = [appointment for i, appointment in enumerate(appointments) if i not in failed]
+    if booked:
+        try:
+            db.appointment.insert_many(booked)
+        except Exception:
+            for appointment in booked:
+                release_slots(db, appointment['_id'])
+            raise
+    for owner, _, doctor_id, slot in claims:
+        if owner not in failed:
+            interval_index.add(doctor_id, [slot])
+    return failed
+
+
+# move an appointment, claiming only the slots it does not already hold
+def reschedule_appointment(db, appointment, appointment_time, changes=None):
+    doctor_id = str(appointment['doctor_id'])
+    duration = appointment.get('duration_minutes', DEFAULT_DURATION_MINUTES)
+    old_slots = slot_keys(appointment['appointment_time'], duration)
+    new_slots = slot_keys(appointment_time, duration)
+    added = [slot for slot in new_slots if slot not in old_slots]
+    removed = [slot for slot in old_slots if slot not in new_slots]
+    if claim_slots(db, [(0, appointment['_id'], doctor_id, slot) for slot in added]):
+        return False
+    release_slots(db, appointment['_id'], removed)
+    db.appointment.update_one({'_id': appointment['_id']}, {'$set': {'appointment_time': appointment_time, **(changes or {})}})
+    interval_index.add(doctor_id, added)
+    interval_index.remove(doctor_id, removed)
+    return True
+
+
+# claim slots for appointments booked before slots existed, safe to run repeatedly
+def backfill_slots(db):
+    docs = []
+    for appointment in db.appointment.find({'doctor_id': {'$ne': None}, 'appointment_time': {'$type': 'date'}}):
+        duration = appointment.get('duration_minutes', DEFAULT_DURATION_MINUTES)
+        docs.extend({'doctor_id': str(appointment['doctor_id']), 'slot': slot, 'appointment_id': appointment['_id']}
+                    for slot in slot_keys(appointment['appointment_time'], duration))
+    if not docs:
+        return 0
+    ensure_slot_index(db)
+    try:
+        return len(db.appointment_slot.insert_many(docs, ordered=False).inserted_ids)
+    except BulkWriteError as e:
+        if any(error['code'] != DUPLICATE_KEY_ERROR for error in e.details['writeErrors']):
+            raise
+        return e.details['nInserted']
@@ -0,0 +1,180 @@
+import base64
+from datetime import datetime
+import bson
+from bson.errors import InvalidBSON
+from bson.objectid import ObjectId
+from functions import build_projection
+from database import db
+
+DEFAULT_SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 500
+# case and accent insensitive, shared by the search indexes and every prefix query so they can use them
+SEARCH_COLLATION = {'locale': 'en', 'strength': 1}
+DATE_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d")
+
+# collection -> what a search may touch; anything else in the query string is rejected
+SEARCH_SPECS = {
+    'patient': {
+        'prefix': 'name',
+        'filters': ('gender', 'bloodGroup', 'age'),
+        'ranges': {},
+        'sorts': ('name', '_id'),
+    },
+    'doctor': {
+        'prefix': 'name',
+        'filters': ('department', 'specialization', 'gender', 'email'),
+        'ranges': {},
+        'sorts': ('name', 'department', '_id'),
+    },
+    'nurse': {
+        'prefix': 'name',
+        'filters': ('department', 'shift', 'position', 'email'),
+        'ranges': {},
+        'sorts': ('name', 'department', '_id'),
+    },
+    'appointment': {
+        'prefix': 'patient_name',
+        'filters': ('doctor_id', 'patient_id', 'doctor_name', 'patient_name'),
+        'ids': ('doctor_id', 'patient_id'),
+        'ranges': {'appointment_time': 'datetime'},
+        'sorts': ('appointment_time', 'patient_name', '_id'),
+    },
+}
+# query arguments every search understands besides the collection's own filters
+RESERVED_ARGS = ('q', 'mode', 'sort', 'limit', 'after', 'fields')
+
+
+class SearchError(ValueError):
+    pass
+
+
+# U+FFFF sorts after every other character, under the simple collation and under ICU
+def prefix_upper_bound(prefix):
+    return prefix + '\uffff'
+
+
+def parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+    raise SearchError(f'Invalid date: {value}')
+
+
+# ids are stored as ObjectId by the routes and as strings by older rows
+def id_variants(field, values):
+    variants = []
+    for value in values:
+        if not ObjectId.is_valid(value):
+            raise SearchError(f'Invalid {field}: {value}')
+        variants += [ObjectId(value), value]
+    return variants
+
+
+def encode_cursor(document, sort_field):
+    raw = bson.encode({'value': document.get(sort_field), '_id': document['_id']})
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(token):
+    try:
+        cursor = bson.decode(base64.urlsafe_b64decode(token.encode()))
+        return cursor['value'], cursor['_id']
+    except (ValueError, KeyError, InvalidBSON):
+        raise SearchError('Invalid cursor')
+
+
+# continue after the last document of the previous page on (sort field, _id)
+def keyset_filter(sort_field, direction, after):
+    value, last_id = decode_cursor(after)
+    operator = '$gt' if direction == 1 else '$lt'
+    if sort_field == '_id':
+        return {'_id': {operator: last_id}}
+    # documents without the field sort first, nothing compares greater or less than null
+    if value is None:
+        tie = {sort_field: None, '_id': {operator: last_id}}
+        return {'$or': [{sort_field: {'$ne': None}}, tie]} if direction == 1 else tie
+    return {'$or': [{sort_field: {operator: value}}, {sort_field: value, '_id': {operator: last_id}}]}
+
+
+# validated query arguments -> (filter, sort, limit, projection, sort field, text search)
+def compile_search(collection, args):
+    spec = SEARCH_SPECS[collection]
+    range_args = {f'{field}_{bound}': field for field in spec['ranges'] for bound in ('from', 'to')}
+    unknown = [arg for arg in args if arg not in RESERVED_ARGS and arg not in spec['filters'] and arg not in range_args]
+    if unknown:
+        raise SearchError('Unknown search arguments: ' + ', '.join(sorted(unknown)))
+
+    clauses = []
+    term = (args.get('q') or '').strip()
+    mode = args.get('mode', 'prefix')
+    if mode not in ('prefix', 'text'):
+        raise SearchError('mode must be prefix or text')
+    text = mode == 'text' and bool(term)
+    if text:
+        clauses.append({'$text': {'$search': term}})
+    elif term:
+        # a range instead of a regex, so the collation index answers it case-insensitively
+        clauses.append({spec['prefix']: {'$gte': term, '$lt': prefix_upper_bound(term)}})
+
+    for field in spec['filters']:
+        if args.get(field):
+            values = [value.strip() for value in args[field].split(',') if value.strip()]
+            if field in spec.get('ids', ()):
+                clauses.append({field: {'$in': id_variants(field, values)}})
+            else:
+                clauses.append({field: values[0] if len(values) == 1 else {'$in': values}})
+
+    for arg, field in range_args.items():
+        if args.get(arg):
+            value = parse_date(args[arg]) if spec['ranges'][field] == 'datetime' else args[arg]
+            clauses.append({field: {'$gte' if arg.endswith('_from') else '$lt': value}})
+
+    sort_arg = args.get('sort') or spec['sorts'][0]
+    sort_field = sort_arg.lstrip('-')
+    if sort_field not in spec['sorts']:
+        raise SearchError('sort must be one of: ' + ', '.join(spec['sorts']))
+    direction = -1 if sort_arg.startswith('-') else 1
+
+    try:
+        limit = int(args.get('limit', DEFAULT_SEARCH_LIMIT))
+    except ValueError:
+        raise SearchError('limit must be a number')
+    if not 0 < limit <= MAX_SEARCH_LIMIT:
+        raise SearchError(f'limit must be between 1 and {MAX_SEARCH_LIMIT}')
+
+    if args.get('after'):
+        if text:
+            raise SearchError('text search results are ranked and cannot be paged with after')
+        clauses.append(keyset_filter(sort_field, direction, args['after']))
+
+    projection = build_projection(args.get('fields'))
+    if projection is not None:
+        projection[sort_field] = 1
+    query = {'$and': clauses} if len(clauses) > 1 else (clauses[0] if clauses else {})
+    sort = [(sort_field, direction)] if sort_field == '_id' else [(sort_field, direction), ('_id', direction)]
+    return query, sort, limit, projection, sort_field, text
+
+
+# one page of matches and the cursor for the next one, None on the last page
+def run_search(collection, args, hidden_fields=()):
+    query, sort, limit, projection, sort_field, text = compile_search(collection, args)
+    if projection is None and hidden_fields:
+        projection = {field: 0 for field in hidden_fields}
+    elif projection is not None:
+        for field in hidden_fields:
+            projection.pop(field, None)
+    if text:
+        # text indexes only support the simple collation, results come back by relevance
+        projection = dict(projection or {}, score={'$meta': 'textScore'})
+        cursor = db[collection].find(query, projection).sort([('score', {'$meta': 'textScore'})])
+    else:
+        cursor = db[collection].find(query, projection, collation=SEARCH_COLLATION).sort(sort)
+    documents = list(cursor.limit(limit + 1))
+    next_after = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        if not text:
+            next_after = encode_cursor(documents[-1], sort_field)
+    return documents, next_after
@@ -0,0 +1,200 @@
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from werkzeug.security import generate_password_hash
+from database import DB_NAME
+from departments import departments
+from indexes import ensure_indexes
+from scheduler import slot_keys, DEFAULT_DURATION_MINUTES, WORKDAY_START_HOUR, WORKDAY_END_HOUR
+from sync import SYNC_FIELD
+
+SEED_BATCH_SIZE = 5000
+SEEDED_COLLECTIONS = ('patient', 'doctor', 'nurse', 'appointment', 'appointment_slot', 'collection_version',
+                      'tombstone', 'department_stats')
+# every seeded doctor logs in with this password
+SEED_PASSWORD = 'password'
+
+FIRST_NAMES = ('James', 'Mary', 'Robert', 'Patricia', 'John', 'Jennifer', 'Michael', 'Linda', 'David', 'Elizabeth',
+               'Arjun', 'Priya', 'Rahul', 'Ananya', 'Vikram', 'Divya', 'Karthik', 'Lakshmi', 'Suresh', 'Meena')
+LAST_NAMES = ('Smith', 'Johnson', 'Williams', 'Brown', 'Jones', 'Garcia', 'Miller', 'Davis', 'Kumar', 'Sharma',
+              'Iyer', 'Reddy', 'Nair', 'Patel', 'Rao', 'Menon', 'Pillai', 'Das', 'Singh', 'Gupta')
+BLOOD_GROUPS = ('A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-')
+SHIFTS = ('Morning', 'Evening', 'Night')
+POSITIONS = ('Staff Nurse', 'Head Nurse', 'Nurse Practitioner')
+REASONS = ('Checkup', 'Follow up', 'Consultation', 'Fever', 'Vaccination', 'Lab results', 'Chest pain', 'Back pain')
+
+
+# names carry the sequence number, so the name indexes and get_*_info lookups stay unambiguous
+def person_name(rng, number):
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {number}'
+
+
+def generate_doctors(rng, count, nurse_ids, password_hash):
+    for number in range(count):
+        department = departments[number % len(departments)]['name']
+        doctor = {
+            '_id': ObjectId(),
+            'name': person_name(rng, number),
+            'email': f'doctor{number}@example.com',
+            'password': password_hash,
+            'gender': rng.choice(('Male', 'Female')),
+            'department': department,
+            'specialization': department,
+            'experience': str(rng.randint(1, 35)),
+            SYNC_FIELD: 1,
+        }
+        if nurse_ids:
+            doctor['nurse_id'] = str(nurse_ids[number % len(nurse_ids)])
+        yield doctor
+
+
+def generate_nurses(rng, count):
+    for number in range(count):
+        yield {
+            '_id': ObjectId(),
+            'name': person_name(rng, number),
+            'email': f'nurse{number}@example.com',
+            'department': departments[number % len(departments)]['name'],
+            'shift': rng.choice(SHIFTS),
+            'position': rng.choice(POSITIONS),
+            SYNC_FIELD: 1,
+        }
+
+
+# form fields arrive as strings, so the seeded ones are strings too
+def generate_patients(rng, count):
+    for number in range(count):
+        yield {
+            '_id': ObjectId(),
+            'name': person_name(rng, number),
+            'age': str(rng.randint(1, 95)),
+            'gender': rng.choice(('Male', 'Female')),
+            'contact': f'9{rng.randint(100000000, 999999999)}',
+            'address': f'{rng.randint(1, 500)} Main Road',
+            'bloodGroup': rng.choice(BLOOD_GROUPS),
+            'weight': str(rng.randint(3, 120)),
+            'height': str(rng.randint(50, 200)),
+            SYNC_FIELD: 1,
+        }
+
+
+# every doctor's day is filled back to back, so no two seeded appointments share a slot
+class AppointmentGenerator:
+    def __init__(self, rng, doctors, per_patient, start):
+        self.rng = rng
+        self.doctors = doctors
+        self.per_patient = per_patient
+        self.start = start
+        self.booked = [0] * len(doctors)
+        self.slots_per_day = (WORKDAY_END_HOUR - WORKDAY_START_HOUR) * 60 // DEFAULT_DURATION_MINUTES
+
+    def for_patients(self, patients):
+        for patient in patients:
+            for _ in range(self.per_patient):
+                doctor_number = self.rng.randrange(len(self.doctors))
+                doctor_id, doctor_name = self.doctors[doctor_number]
+                day, slot = divmod(self.booked[doctor_number], self.slots_per_day)
+                self.booked[doctor_number] += 1
+                yield {
+                    '_id': ObjectId(),
+                    'patient_id': patient['_id'],
+                    'patient_name': patient['name'],
+                    'doctor_id': doctor_id,
+                    'doctor_name': doctor_name,
+                    'appointment_time': self.start + timedelta(days=day, hours=WORKDAY_START_HOUR,
+                                                               minutes=slot * DEFAULT_DURATION_MINUTES),
+                    'duration_minutes': DEFAULT_DURATION_MINUTES,
+                    'reason': self.rng.choice(REASONS),
+                    SYNC_FIELD: 1,
+                }
+
+
+def appointment_slots(appointments):
+    return [{'doctor_id': str(appointment['doctor_id']), 'slot': slot, 'appointment_id': appointment['_id']}
+            for appointment in appointments
+            for slot in slot_keys(appointment['appointment_time'], appointment['duration_minutes'])]
+
+
+# insert a generator batch by batch so memory stays flat at millions of documents
+def insert_batches(collection, documents, on_batch=None):
+    batch = []
+    inserted = 0
+    for document in documents:
+        batch.append(document)
+        if len(batch) == SEED_BATCH_SIZE:
+            inserted += flush(collection, batch, on_batch)
+            batch = []
+    if batch:
+        inserted += flush(collection, batch, on_batch)
+    return inserted
+
+
+def flush(collection, batch, on_batch):
+    collection.insert_many(batch, ordered=False)
+    if on_batch:
+        on_batch(batch)
+    return len(batch)
+
+
+# seeding twice without drop collides on the unique doctor email index
+def seed(db, patients=10000, doctors=100, nurses=100, appointments_per_patient=2, seed_value=0, drop=False,
+         start=None):
+    rng = random.Random(seed_value)
+    if drop:
+        for collection in SEEDED_COLLECTIONS:
+            db[collection].drop()
+    ensure_indexes(db)
+    start = start or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    # one hash for every doctor, hashing each one would dominate the seeding time
+    password_hash = generate_password_hash(SEED_PASSWORD)
+    counts = {'appointment': 0, 'appointment_slot': 0}
+    started = time.perf_counter()
+
+    nurse_ids = []
+    counts['nurse'] = insert_batches(db.nurse, generate_nurses(rng, nurses),
+                                     lambda batch: nurse_ids.extend(nurse['_id'] for nurse in batch))
+    # only (_id, name) pairs are kept in memory, appointments are generated per patient batch
+    doctor_refs = []
+    counts['doctor'] = insert_batches(db.doctor, generate_doctors(rng, doctors, nurse_ids, password_hash),
+                                      lambda batch: doctor_refs.extend((doctor['_id'], doctor['name'])
+                                                                       for doctor in batch))
+    generator = AppointmentGenerator(rng, doctor_refs, appointments_per_patient, start)
+
+    def insert_slots(appointments):
+        slots = appointment_slots(appointments)
+        db.appointment_slot.insert_many(slots, ordered=False)
+        counts['appointment_slot'] += len(slots)
+
+    def insert_appointments(batch):
+        if doctor_refs and appointments_per_patient:
+            counts['appointment'] += insert_batches(db.appointment, generator.for_patients(batch), insert_slots)
+
+    counts['patient'] = insert_batches(db.patient, generate_patients(rng, patients), insert_appointments)
+    for collection in ('patient', 'doctor', 'nurse', 'appointment'):
+        db.collection_version.update_one({'_id': collection}, {'$max': {'version': 1}}, upsert=True)
+    counts['seconds'] = round(time.perf_counter() - started, 2)
+    return counts
+
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Fill the hospital database with synthetic data.')
+    parser.add_argument('--patients', type=int, default=10000)
+    parser.add_argument('--doctors', type=int, default=100)
+    parser.add_argument('--nurses', type=int, default=100)
+    parser.add_argument('--appointments-per-patient', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0, help='random seed, the same seed gives the same data')
+    parser.add_argument('--drop', action='store_true', help='drop the seeded collections first')
+    parser.add_argument('--uri', default=os.getenv('MONGO_URI'))
+    args = parser.parse_args()
+    db = MongoClient(args.uri)[DB_NAME]
+    print(seed(db, args.patients, args.doctors, args.nurses, args.appointments_per_patient, args.seed, args.drop))
+
+
+if __name__ == "__main__":
+    main()
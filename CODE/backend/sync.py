@@ -0,0 +1,90 @@
+import hashlib
+from contextlib import contextmanager
+from datetime import datetime
+from flask import current_app, request
+from pymongo import ReturnDocument
+from database import db
+
+# every write stamps its documents with the collection's next version, a sync token is such a version.
+# Concurrent writers can commit out of version order, so deltas re-send this many versions back
+# and clients apply them idempotently by _id.
+SYNC_OVERLAP = 50
+SYNC_FIELD = 'sync_version'
+
+
+def bump_version(collection):
+    counter = db.collection_version.find_one_and_update({'_id': collection}, {'$inc': {'version': 1}},
+                                                        upsert=True, return_document=ReturnDocument.AFTER)
+    return counter['version']
+
+
+# yields the version the written documents carry and publishes a newer one once the write is
+# acknowledged, so a list read between the two can never pair the new version with data lacking the write
+@contextmanager
+def versioned_write(collection):
+    yield bump_version(collection)
+    bump_version(collection)
+
+
+def current_versions(collections):
+    versions = {collection: 0 for collection in collections}
+    for counter in db.collection_version.find({'_id': {'$in': list(collections)}}):
+        versions[counter['_id']] = counter['version']
+    return versions
+
+
+def record_deletion(collection, document_id, version):
+    db.tombstone.insert_one({'collection': collection, 'document_id': document_id,
+                             SYNC_FIELD: version, 'deleted_at': datetime.utcnow()})
+
+
+# details: extra fields per document, e.g. the patient a deleted appointment belonged to
+def record_deletions(collection, document_ids, version, details=None):
+    deleted_at = datetime.utcnow()
+    details = details or [{}] * len(document_ids)
+    db.tombstone.insert_many([{**extra, 'collection': collection, 'document_id': document_id, SYNC_FIELD: version,
+                               'deleted_at': deleted_at} for document_id, extra in zip(document_ids, details)])
+
+
+# the ETag covers the versions of every collection in the response and the query arguments
+def list_etag(versions):
+    return etag_for(versions, request.query_string.decode())
+
+
+# shared with the ASGI fast paths, so both servers hand out interchangeable ETags
+def etag_for(versions, query_string):
+    state = ','.join(f'{collection}:{version}' for collection, version in sorted(versions.items()))
+    return hashlib.sha1(f'{state}?{query_string}'.encode()).hexdigest()
+
+
+def is_not_modified(etag):
+    return request.if_none_match.contains(etag)
+
+
+def not_modified(etag):
+    return with_etag(current_app.response_class(status=304), etag)
+
+
+def with_etag(response, etag):
+    response.set_etag(etag)
+    # browsers revalidate with If-None-Match instead of refetching the whole list
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+# a list's sync token is its collection version, None when the token is anything else
+def parse_sync_token(token):
+    return int(token) if token.isdigit() else None
+
+
+def sync_floor(since):
+    return max(since - SYNC_OVERLAP, 0)
+
+
+# documents changed and ids deleted since a sync token
+def delta(collection, since, projection=None):
+    floor = sync_floor(since)
+    changed = db[collection].find({SYNC_FIELD: {'$gt': floor}}, projection).sort(SYNC_FIELD, 1)
+    deleted = [tombstone['document_id'] for tombstone in
+               db.tombstone.find({'collection': collection, SYNC_FIELD: {'$gt': floor}}, {'document_id': 1})]
+    return changed, deleted
@@ -0,0 +1,68 @@
+import os
+import sys
+import mongomock
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# app.py builds an app on import, keep it from pinging a server that is not there
+os.environ.setdefault('MONGO_WARM_UP', '0')
+os.environ.setdefault('JOB_WORKERS', '0')
+
+import database
+import name_index
+import scheduler
+from app import create_app
+
+# tests needing server-only features (e.g. $unionWith, explain) run against this server when one answers
+MONGO_TEST_URI = os.getenv('MONGO_TEST_URI', 'mongodb://localhost:27017')
+MONGO_TEST_DB = 'HospitalManagementTest'
+TEST_CONFIG = {'TESTING': True, 'MONGO_WARM_UP': '0', 'JOB_WORKERS': 0, 'AUTH_REQUIRED': '0',
+               'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000'}
+
+
+# module globals outlive an app, a fresh database needs them empty again
+def reset_module_state():
+    scheduler.slot_index_ready = False
+    scheduler.interval_index.doctors = {}
+    for index in (name_index.patient_names, name_index.doctor_names):
+        index.ids_by_name, index.name_by_id, index.loaded_at = {}, {}, None
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(database, 'MongoClient', lambda *_, **__: client)
+    reset_module_state()
+    yield client
+    reset_module_state()
+
+
+@pytest.fixture
+def db(mongo):
+    return mongo[database.DB_NAME]
+
+
+@pytest.fixture
+def app(mongo):
+    return create_app(TEST_CONFIG)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def mongod():
+    client = MongoClient(MONGO_TEST_URI, serverSelectionTimeoutMS=500)
+    try:
+        client.admin.command('ping')
+    except PyMongoError as e:
+        client.close()
+        pytest.skip(f'no MongoDB server at {MONGO_TEST_URI}: {e}')
+    client.drop_database(MONGO_TEST_DB)
+    yield client[MONGO_TEST_DB]
+    client.drop_database(MONGO_TEST_DB)
+    client.close()
@@ -0,0 +1,76 @@
+import pytest
+
+TIME = '2030-01-07 10:00:00'
+
+
+@pytest.fixture
+def namesakes(client):
+    doctors = [client.post('/doctor/add', json={'name': 'Dr. Same', 'email': f'same{i}@example.com'})
+               .json['doctor']['_id'] for i in range(2)]
+    patient = client.post('/patients/add', json={'name': 'Pat', 'age': 30}).json['patient']['_id']
+    return doctors, patient
+
+
+def test_ambiguous_name_without_id_is_a_conflict(client, db, namesakes):
+    response = client.post('/appointment/add', json={'patient_name': 'Pat', 'doctor_name': 'Dr. Same',
+                                                     'appointment_time': TIME})
+
+    assert response.status_code == 409
+    assert 'doctor_id' in response.json['message']
+    assert db.appointment.count_documents({}) == 0
+
+
+def test_an_id_settles_an_ambiguous_name(client, namesakes):
+    doctors, _ = namesakes
+    response = client.post('/appointment/add', json={'patient_name': 'Pat', 'doctor_name': 'Dr. Same',
+                                                     'doctor_id': doctors[1], 'appointment_time': TIME})
+
+    assert response.status_code == 200
+    assert response.json['appointment']['doctor_id'] == doctors[1]
+
+
+def test_batch_reports_ambiguous_names_per_appointment(client, namesakes):
+    doctors, _ = namesakes
+    response = client.post('/appointment/add_batch', json={'appointments': [
+        {'patient_name': 'Pat', 'doctor_name': 'Dr. Same', 'appointment_time': TIME},
+        {'patient_name': 'Pat', 'doctor_id': doctors[0], 'appointment_time': TIME},
+    ]})
+
+    assert response.status_code == 200
+    assert [appointment['doctor_id'] for appointment in response.json['appointments']] == [doctors[0]]
+    assert len(response.json['errors']) == 1
+    assert 'More than one doctor' in response.json['errors'][0]['message']
+
+
+def test_update_with_ambiguous_name_leaves_the_appointment(client, db, namesakes):
+    doctors, _ = namesakes
+    appointment_id = client.post('/appointment/add', json={'patient_name': 'Pat', 'doctor_id': doctors[0],
+                                                           'appointment_time': TIME}).json['appointment']['_id']
+    response = client.put('/appointment/update', json={'appointment_id': appointment_id, 'doctor_name': 'Dr. Same',
+                                                       'appointment_time': '2030-01-07 11:00:00'})
+
+    assert response.status_code == 409
+    assert db.appointment.find_one()['appointment_time'].hour == 10
+
+
+# exactly what AppointmentScheduling.js posts, its patient id field is free text
+@pytest.mark.parametrize('patient_id', ['', 'P-17'])
+def test_booking_form_payload_is_accepted(client, db, patient_id):
+    doctor_id = client.post('/doctor/add', json={'name': 'Dr. Form', 'department': 'Cardiology'}).json['doctor']['_id']
+    patient = client.post('/patients/add', json={'name': 'Form Patient', 'contact': '9000000000'}).json['patient']
+
+    response = client.post('/appointment/add', json={
+        'patientId': patient_id,
+        'patientName': 'Form Patient',
+        'contact': '9000000000',
+        'department': 'Cardiology',
+        'doctorName': 'Dr. Form',
+        'appointment_time': TIME,
+        'reason': 'Checkup',
+    })
+
+    assert response.status_code == 200
+    assert response.json['appointment']['doctorName'] == 'Dr. Form'
+    stored = db.appointment.find_one()
+    assert str(stored['doctor_id']) == doctor_id
+    assert str(stored['patient_id']) == patient['_id']
@@ -0,0 +1,58 @@
+import asyncio
+import base64
+import bson
+import pytest
+from bson.timestamp import Timestamp
+from app import create_app
+from consistency import CAUSAL_HEADER
+from conftest import TEST_CONFIG
+
+# nothing listens here, every test below must finish before a server is needed
+UNREACHABLE = 'mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=200'
+
+
+@pytest.fixture
+def backend():
+    from asgi import AsyncBackend
+
+    def build(list_read_preference):
+        return AsyncBackend(create_app(dict(TEST_CONFIG, MONGO_URI=UNREACHABLE,
+                                            MONGO_LIST_READ_PREFERENCE=list_read_preference)))
+    return build
+
+
+def causal_token(seconds):
+    cluster_time = Timestamp(seconds, 1)
+    raw = bson.encode({'operation_time': cluster_time, 'cluster_time': {'clusterTime': cluster_time}})
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+async def open_session(backend, token):
+    async with backend.read_session(token) as session:
+        return session and (session.options.causal_consistency, session.operation_time)
+
+
+def test_primary_list_reads_need_no_session(backend):
+    assert asyncio.run(open_session(backend('primary'), causal_token(5))) is None
+
+
+def test_secondary_list_reads_share_a_causal_session_from_the_token(backend):
+    assert asyncio.run(open_session(backend('secondaryPreferred'), causal_token(5))) == (True, Timestamp(5, 1))
+    assert asyncio.run(open_session(backend('secondaryPreferred'), '')) == (True, None)
+
+
+def test_malformed_causal_token_is_rejected(backend):
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+    scope = {'type': 'http', 'method': 'GET', 'path': '/nurse/', 'query_string': b'',
+             'headers': [(CAUSAL_HEADER.lower().encode(), b'not-a-token')]}
+
+    asyncio.run(backend('secondaryPreferred')(scope, receive, send))
+
+    assert sent[0]['status'] == 400
+    assert b'Invalid causal token' in sent[1]['body']
@@ -0,0 +1,19 @@
+import json
+import pytest
+
+ROWS = ''.join(json.dumps({'name': f'Imported {n}', 'age': 30 + n}) + '\n' for n in range(5))
+
+
+@pytest.mark.parametrize('batch_size', ['0', '-1', 'abc'])
+def test_batch_size_below_one_is_rejected(client, db, batch_size):
+    response = client.post(f'/bulk/patients?batch_size={batch_size}', data=ROWS, content_type='application/x-ndjson')
+    assert response.status_code == 400
+    assert response.get_json()['message'] == 'batch_size must be a positive integer'
+    assert db.patient.count_documents({}) == 0
+
+
+def test_rows_are_imported_in_batches(client, db):
+    response = client.post('/bulk/patients?batch_size=2', data=ROWS, content_type='application/x-ndjson')
+    assert response.status_code == 200
+    assert response.get_json()['inserted'] == 5
+    assert sorted(patient['name'] for patient in db.patient.find()) == [f'Imported {n}' for n in range(5)]
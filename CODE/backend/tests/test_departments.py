@@ -0,0 +1,44 @@
+from collections import Counter
+from datetime import datetime
+from departments import compute_department_stats, refresh_department_stats
+
+
+# independent of the aggregation: count staff and appointments in Python
+def recount(database):
+    departments = {doctor['_id']: doctor.get('department') for doctor in database.doctor.find()}
+    staffs = Counter(person.get('department') for collection in (database.doctor, database.nurse)
+                     for person in collection.find())
+    appointments = Counter(departments.get(appointment.get('doctor_id')) for appointment in database.appointment.find())
+    return {name: (staffs[name], appointments[name]) for name in set(staffs) | set(appointments)
+            if isinstance(name, str)}
+
+
+def materialized(database):
+    return {stats['_id']: (stats['staffs'], stats['appointments']) for stats in database.department_stats.find()}
+
+
+def check(database):
+    refresh_department_stats(database)
+    expected = compute_department_stats(database)
+    assert materialized(database) == expected == recount(database)
+    return expected
+
+
+def test_refreshed_stats_match_a_recompute(mongod):
+    doctors = mongod.doctor.insert_many([{'name': 'Heart', 'department': 'Cardiology'},
+                                         {'name': 'Brain', 'department': 'Neurology'},
+                                         {'name': 'Nobody'}]).inserted_ids
+    mongod.nurse.insert_many([{'name': 'Ann', 'department': 'Cardiology'},
+                              {'name': 'Bea', 'department': 'Dermatology'}])
+    mongod.appointment.insert_many([{'doctor_id': doctor_id, 'appointment_time': datetime(2030, 1, 7, 9 + i)}
+                                    for i, doctor_id in enumerate(doctors + doctors[:1])])
+
+    assert check(mongod) == {'Cardiology': (2, 2), 'Neurology': (1, 1), 'Dermatology': (1, 0)}
+
+    # a new department, a moved doctor, and one department left with nobody in it
+    mongod.doctor.insert_one({'name': 'Bones', 'department': 'Orthopedics'})
+    mongod.doctor.update_one({'_id': doctors[1]}, {'$set': {'department': 'Cardiology'}})
+    mongod.nurse.delete_one({'name': 'Bea'})
+    mongod.appointment.delete_one({'doctor_id': doctors[0]})
+
+    assert check(mongod) == {'Cardiology': (3, 2), 'Orthopedics': (1, 0)}
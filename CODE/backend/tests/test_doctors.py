@@ -0,0 +1,47 @@
+import pytest
+from indexes import INDEXES
+
+
+@pytest.fixture
+def doctor_with_nurse(client):
+    client.post('/nurse/add', json={'name': 'N1', 'email': 'n1@example.com'})
+    client.post('/doctor/add', json={'name': 'D1', 'email': 'd1@example.com', 'password': 'secret'})
+    client.put('/doctor/assign_nurse', json={'name': 'D1', 'nurseName': 'N1'})
+
+
+# both lookups share one cache entry per name, whichever runs first fills it
+@pytest.mark.parametrize('paths', [('/doctor/get_doctor_info', '/extra/find_nurse_from_doctor'),
+                                   ('/extra/find_nurse_from_doctor', '/doctor/get_doctor_info')])
+def test_cached_doctor_lookups_never_return_the_password(client, doctor_with_nurse, paths):
+    bodies = {'/doctor/get_doctor_info': {'name': 'D1'}, '/extra/find_nurse_from_doctor': {'doctorName': 'D1'}}
+    for path in paths + paths:
+        response = client.post(path, json=bodies[path])
+
+        assert response.status_code == 200
+        assert 'password' not in response.json['doctor']
+    assert client.get('/cache_stats').json['cache']['hits'] > 0
+
+
+def test_login_still_checks_the_password(client, doctor_with_nurse):
+    client.post('/doctor/get_doctor_info', json={'name': 'D1'})
+
+    assert client.post('/doctor/login', json={'email': 'd1@example.com', 'password': 'secret'}).status_code == 200
+    assert client.post('/doctor/login', json={'email': 'd1@example.com', 'password': 'wrong'}).status_code == 401
+
+
+@pytest.fixture
+def email_index(db):
+    collection, keys, options = INDEXES['doctor_email']
+    db[collection].create_index(keys, name='doctor_email', **options)
+
+
+def test_only_non_empty_emails_have_to_be_unique(client, db, email_index):
+    for doctor in ({'name': 'D1', 'email': ''}, {'name': 'D2', 'email': ''}, {'name': 'D3'}, {'name': 'D4'},
+                   {'name': 'D5', 'email': 'd5@example.com'}):
+        assert client.post('/doctor/add', json=doctor).status_code == 200
+
+    response = client.post('/doctor/add', json={'name': 'D6', 'email': 'd5@example.com'})
+    assert response.status_code == 409
+    assert response.json['message'] == 'A doctor with this email already exists'
+    assert client.put('/doctor/update', json={'name': 'D1', 'email': 'd5@example.com'}).status_code == 409
+    assert db.doctor.count_documents({'email': 'd5@example.com'}) == 1
@@ -0,0 +1,42 @@
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ASCENDING
+from indexes import INDEXES, ensure_indexes, find_collscans
+
+
+# the planner only weighs indexes for collections that exist, so give every queried one a few rows
+def seed(database):
+    database.doctor.insert_many([{'name': f'Doctor {i}', 'email': f'doctor{i}@example.com',
+                                  'department': 'Cardiology'} for i in range(20)])
+    database.nurse.insert_many([{'name': f'Nurse {i}', 'department': 'Neurology'} for i in range(20)])
+    database.patient.insert_many([{'name': f'Patient {i}', 'age': i} for i in range(20)])
+    database.appointment.insert_many([{'patient_id': ObjectId(), 'doctor_id': ObjectId(), 'patient_name': 'Patient',
+                                       'appointment_time': datetime(2024, 1, 1, 9 + i % 8)} for i in range(20)])
+    database.appointment_slot.insert_many([{'doctor_id': str(ObjectId()), 'slot': datetime(2024, 1, 1, 9, i),
+                                            'appointment_id': ObjectId()} for i in range(20)])
+
+
+def test_hot_queries_use_an_index(mongod):
+    seed(mongod)
+    assert sorted(ensure_indexes(mongod)) == sorted(INDEXES)
+    # a second run finds every index in place
+    assert sorted(ensure_indexes(mongod)) == sorted(INDEXES)
+
+    assert find_collscans(mongod) == []
+
+
+def test_a_missing_index_is_reported(mongod):
+    seed(mongod)
+    ensure_indexes(mongod)
+    mongod.patient.drop_index('patient_name')
+
+    assert find_collscans(mongod) == ['find_patient_by_name']
+
+
+# the email index used to be sparse, which still refused a second doctor with an empty email
+def test_a_changed_index_is_rebuilt(mongod):
+    mongod.doctor.create_index([('email', ASCENDING)], name='doctor_email', unique=True, sparse=True)
+    ensure_indexes(mongod)
+    mongod.doctor.insert_many([{'name': 'A', 'email': ''}, {'name': 'B', 'email': ''}])
+
+    assert 'partialFilterExpression' in mongod.doctor.index_information()['doctor_email']
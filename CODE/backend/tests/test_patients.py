@@ -0,0 +1,39 @@
+import asyncio
+import pytest
+
+
+@pytest.fixture
+def patients(client):
+    return [client.post('/patients/add', json={'name': f'Patient {i}', 'age': i}).json['patient']['_id']
+            for i in range(5)]
+
+
+def test_keyset_pages_cover_every_patient(client, patients):
+    first = client.get('/patients/?limit=3&fields=name').json
+    second = client.get(f"/patients/?limit=3&fields=name&after={first['next_after']}").json
+
+    assert [patient['_id'] for patient in first['patients'] + second['patients']] == sorted(patients)
+    assert 'next_after' not in second
+
+
+@pytest.mark.parametrize('query, message', [
+    ('after=nope', 'after must be the _id of a patient'),
+    ('limit=ten', 'limit must be a number'),
+    ('limit=-1', 'limit must not be negative'),
+])
+def test_malformed_page_arguments_are_rejected(client, patients, query, message):
+    response = client.get(f'/patients/?{query}')
+
+    assert response.status_code == 400
+    assert response.json['message'] == message
+
+
+@pytest.mark.parametrize('args', [{'after': ['nope']}, {'limit': ['ten']}])
+def test_asgi_fast_path_rejects_malformed_page_arguments(app, args):
+    from asgi import AsyncBackend
+    backend = AsyncBackend(app)
+
+    payload, status = asyncio.run(backend.get_patients(args, None))
+
+    assert status == 400
+    assert payload['status'] == 'error'
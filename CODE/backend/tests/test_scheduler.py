@@ -0,0 +1,87 @@
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import mongomock
+import pytest
+
+DOCTOR = 'Dr. Race'
+PATIENT = 'Pat Race'
+CALLERS = 64
+
+
+# the server checks a unique index atomically with the insert, mongomock stores the document first and
+# checks afterwards, so two racing inserts can both see the other and both roll back
+@pytest.fixture
+def atomic_inserts(monkeypatch):
+    lock = threading.RLock()
+    insert = mongomock.collection.Collection._insert
+
+    def locked_insert(self, *args, **kwargs):
+        with lock:
+            return insert(self, *args, **kwargs)
+    monkeypatch.setattr(mongomock.collection.Collection, '_insert', locked_insert)
+
+
+@pytest.fixture
+def people(client):
+    doctor_id = client.post('/doctor/add', json={'name': DOCTOR}).json['doctor']['_id']
+    patient_id = client.post('/patients/add', json={'name': PATIENT, 'age': 40}).json['patient']['_id']
+    return doctor_id, patient_id
+
+
+def fire(app, calls):
+    barrier = threading.Barrier(len(calls))
+
+    def call(request):
+        method, path, body = request
+        test_client = app.test_client()
+        barrier.wait()
+        return getattr(test_client, method)(path, json=body)
+    with ThreadPoolExecutor(max_workers=len(calls)) as pool:
+        return list(pool.map(call, calls))
+
+
+def booked(response):
+    if response.status_code != 200:
+        return 0
+    return len(response.json.get('appointments', [response.json.get('appointment')]))
+
+
+# /add at 10:00 holds the 10:00 and 10:05 slots, /add_batch at 10:05 holds 10:05 and 10:10;
+# every caller needs 10:05, so only one of them may get an appointment
+def test_parallel_bookings_of_one_slot_have_one_winner(app, db, people, atomic_inserts):
+    doctor_id, patient_id = people
+    single = {'doctor_id': doctor_id, 'patient_id': patient_id, 'appointment_time': '2030-01-07 10:00:00'}
+    batch = {'appointments': [{'doctor_id': doctor_id, 'patient_id': patient_id,
+                               'appointment_time': '2030-01-07 10:05:00'}]}
+    calls = [('post', '/appointment/add', dict(single)) if i % 2 else ('post', '/appointment/add_batch', batch)
+             for i in range(CALLERS)]
+
+    responses = fire(app, calls)
+
+    assert all(response.status_code in (200, 400) for response in responses)
+    assert sum(booked(response) for response in responses) == 1
+    assert db.appointment.count_documents({}) == 1
+    slots = [(slot['doctor_id'], slot['slot']) for slot in db.appointment_slot.find()]
+    assert len(slots) == len(set(slots)) == 2
+    winner = db.appointment.find_one()['_id']
+    assert {slot['appointment_id'] for slot in db.appointment_slot.find()} == {winner}
+
+
+def test_parallel_reschedules_into_one_slot_have_one_winner(app, client, db, people, atomic_inserts):
+    doctor_id, patient_id = people
+    appointment_ids = []
+    for hour in range(9, 17):
+        response = client.post('/appointment/add', json={'doctor_id': doctor_id, 'patient_id': patient_id,
+                                                          'appointment_time': f'2030-01-07 {hour:02d}:30:00'})
+        appointment_ids.append(response.json['appointment']['_id'])
+    calls = [('put', '/appointment/update', {'appointment_id': appointment_id,
+                                             'appointment_time': '2030-01-08 12:00:00'})
+             for appointment_id in appointment_ids]
+
+    responses = fire(app, calls)
+
+    assert sorted(response.status_code for response in responses) == [200] + [400] * (len(calls) - 1)
+    assert db.appointment.count_documents({'appointment_time': {'$gte': datetime(2030, 1, 8)}}) == 1
+    slots = [(slot['doctor_id'], slot['slot']) for slot in db.appointment_slot.find()]
+    assert len(slots) == len(set(slots)) == 2 * len(calls)
@@ -0,0 +1,26 @@
+import tracemalloc
+
+PATIENTS = 5000
+NOTES = 'x' * 2000
+
+
+# the whole NDJSON body is ~10MB, streaming must never hold more than a fraction of it
+def test_streamed_list_keeps_a_bounded_peak(client, db):
+    db.patient.insert_many([{'name': f'Patient {i}', 'age': i % 90, 'notes': NOTES} for i in range(PATIENTS)])
+
+    tracemalloc.start()
+    try:
+        response = client.get('/patients/?stream=1&fields=name,age,notes', buffered=False)
+        lines = size = 0
+        for chunk in response.response:
+            size += len(chunk)
+            lines += chunk.count('\n' if isinstance(chunk, str) else b'\n')
+        response.close()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    assert response.mimetype == 'application/x-ndjson'
+    assert lines == PATIENTS
+    assert size > PATIENTS * len(NOTES)
+    assert peak < size // 5
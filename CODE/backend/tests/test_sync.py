@@ -0,0 +1,23 @@
+import pytest
+
+LISTS = ['/patients/', '/doctor/', '/nurse/', '/appointment/']
+
+
+@pytest.mark.parametrize('path', LISTS)
+@pytest.mark.parametrize('since', ['abc', '-1', '1.5.2', ''])
+def test_malformed_since_is_rejected(client, db, path, since):
+    response = client.get(f'{path}?since={since}')
+
+    assert response.status_code == 400
+    assert response.json['message'] == f'since must be a sync_token from {path}'
+
+
+@pytest.mark.parametrize('path, key', [('/doctor/', 'doctors'), ('/nurse/', 'nurses')])
+def test_since_returns_the_changes_after_a_sync_token(client, db, path, key):
+    client.post(f'{path}add', json={'name': 'Before'})
+    token = client.get(path).json['sync_token']
+    client.post(f'{path}add', json={'name': 'After'})
+
+    delta = client.get(f'{path}?since={token}').json
+    assert 'After' in [document['name'] for document in delta[key]]
+    assert delta['sync_token'] > token